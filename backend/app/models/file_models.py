@@ -1,7 +1,14 @@
-﻿from datetime import datetime
+﻿from collections.abc import MutableMapping
+from datetime import datetime
 from bson import ObjectId
+from bson.codec_options import CodecOptions
 
 class FileModel:
+    __slots__ = ("_id", "filename", "original_name", "size", "mime_type", "upload_date")
+
+    # Fields a bulk read needs to fetch - everything else stays undecoded on the server
+    PROJECTION = {"filename": 1, "original_name": 1, "size": 1, "mime_type": 1, "upload_date": 1}
+
     def __init__(self, filename: str, original_name: str, size: int, mime_type: str, upload_date: datetime = None, _id: ObjectId = None):
         self._id = _id
         self.filename = filename
@@ -29,3 +36,48 @@ class FileModel:
             mime_type=data["mime_type"],
             upload_date=data.get("upload_date")
         )
+
+class FileRow(FileModel, MutableMapping):
+    """FileModel the BSON decoder can fill in directly.
+
+    Used as the document_class for bulk reads, so each row is decoded straight
+    into one slotted object with no intermediate dict. Keys outside the slots
+    are dropped.
+    """
+
+    __slots__ = ()
+
+    def __init__(self):
+        self._id = None
+        self.filename = None
+        self.original_name = None
+        self.size = None
+        self.mime_type = None
+        self.upload_date = None
+
+    def __getitem__(self, key):
+        if key not in FileModel.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key in FileModel.__slots__:
+            setattr(self, key, value)
+
+    def __delitem__(self, key):
+        self.__setitem__(key, None)
+
+    def __iter__(self):
+        return iter(FileModel.__slots__)
+
+    def __len__(self):
+        return len(FileModel.__slots__)
+
+FILE_ROW_CODEC_OPTIONS = CodecOptions(document_class=FileRow)
+
+def hydrate_files(collection, query: dict = None, sort=("upload_date", -1), batch_size: int = 500):
+    """Bulk read decoding only FileModel.PROJECTION straight into FileRow objects"""
+    cursor = collection.with_options(codec_options=FILE_ROW_CODEC_OPTIONS).find(query or {}, FileModel.PROJECTION)
+    if sort:
+        cursor = cursor.sort(*sort)
+    return cursor.batch_size(batch_size)
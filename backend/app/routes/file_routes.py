@@ -1,9 +1,10 @@
 ﻿import os
-from fastapi import APIRouter, UploadFile, File, HTTPException, status
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Query, status
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from app.services.file_service import FileService
+from app.services.file_encoder import encode_file_model, iter_ndjson, wants_ndjson, NDJSON_MEDIA_TYPE
 from app.schemas.file_schemas import FileResponse, FileListResponse
-from typing import List
+from typing import List, Optional
 
 router = APIRouter()
 file_service = FileService()
@@ -58,23 +59,21 @@ async def upload_file(file: UploadFile = File(...)):
             detail=f"Error uploading file: {str(e)}"
         )
 
+def _encode_row(file):
+    return encode_file_model(file, {"url": f"/api/files/download/{file.filename}"})
+
 @router.get("/", response_model=FileListResponse)
-async def get_all_files():
+async def get_all_files(request: Request, format: Optional[str] = Query(None)):
     try:
-        files = await file_service.get_all_files()
-        file_responses = []
-        for file in files:
-            file_responses.append(FileResponse(
-                id=str(file._id),
-                filename=file.filename,
-                original_name=file.original_name,
-                size=file.size,
-                mime_type=file.mime_type,
-                upload_date=file.upload_date,
-                url=f"/api/files/download/{file.filename}"
-            ))
-        
-        return FileListResponse(files=file_responses, total=len(file_responses))
+        files = file_service.iter_all_files()
+
+        if wants_ndjson(request.headers.get("accept"), format):
+            return StreamingResponse(iter_ndjson(files, encode=_encode_row), media_type=NDJSON_MEDIA_TYPE)
+
+        # Same shape as FileListResponse, encoded directly instead of building a model per row
+        rows = [_encode_row(file) for file in files]
+        body = '{"files":[' + ",".join(rows) + '],"total":' + str(len(rows)) + "}"
+        return Response(content=body.encode("utf-8"), media_type="application/json")
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
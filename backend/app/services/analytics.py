@@ -0,0 +1,145 @@
+﻿import asyncio
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from typing import Dict, List, Optional, Tuple
+
+EVENT_TYPES = ("upload", "download", "delete")
+GRANULARITIES = ("minute", "hour", "day")
+METRICS = {
+    "uploads": "upload_count",
+    "downloads": "download_count",
+    "deletes": "delete_count",
+    "bytes_uploaded": "upload_bytes",
+    "bytes_downloaded": "download_bytes",
+    "bytes_deleted": "delete_bytes"
+}
+
+# Fine-grained buckets are only kept as long as they are useful for zooming in
+ROLLUP_RETENTION = {"minute": timedelta(days=2), "hour": timedelta(days=90)}
+
+def bucket_start(ts: datetime, granularity: str) -> datetime:
+    if granularity == "minute":
+        return ts.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+class AnalyticsRecorder:
+    """Event log plus incrementally maintained rollups for file activity.
+
+    Each event updates one minute, hour and day bucket per file_type (and a
+    per-file daily bucket for top-N queries), so range queries read at most a
+    few thousand small bucket documents instead of scanning files_collection.
+
+    record() only appends to an in-memory buffer, so it never blocks or fails
+    the request that triggered it. A background task writes the buffer every
+    flush_interval_seconds, merging increments that hit the same bucket;
+    reads lag behind by at most one interval.
+    """
+
+    def __init__(self, db, event_retention_days: int = 30, flush_interval_seconds: float = 2):
+        self.events = db.file_events
+        self.rollups = db.file_rollups
+        self.file_rollups = db.file_daily_rollups
+        self.event_retention = timedelta(days=event_retention_days)
+        self.flush_interval_seconds = flush_interval_seconds
+        self._pending: List[Tuple] = []
+        self.flushed_total = 0
+        self.dropped_total = 0
+        self._task = None
+
+    def ensure_indexes(self):
+        self.events.create_index("ts", expireAfterSeconds=int(self.event_retention.total_seconds()), background=True)
+        self.rollups.create_index([("granularity", 1), ("bucket", 1), ("file_type", 1)], unique=True, background=True)
+        for granularity, retention in ROLLUP_RETENTION.items():
+            self.rollups.create_index(
+                "bucket",
+                name=f"expire_{granularity}_buckets",
+                expireAfterSeconds=int(retention.total_seconds()),
+                partialFilterExpression={"granularity": granularity},
+                background=True
+            )
+        self.file_rollups.create_index([("bucket", 1), ("file_id", 1)], unique=True, background=True)
+
+    def record(self, event_type: str, file_id: str, file_type: Optional[str], size: int, ts: datetime = None, count: int = 1):
+        self._pending.append((event_type, file_id, file_type or "other", size, ts or datetime.utcnow(), count))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval_seconds)
+            await self.flush()
+
+    async def flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            await asyncio.to_thread(self.write, batch)
+            self.flushed_total += len(batch)
+        except Exception as e:
+            self.dropped_total += len(batch)
+            print(f"❌ Analytics flush failed, dropped {len(batch)} events: {e}")
+
+    def write(self, batch: List[Tuple]):
+        """Blocking - one insert and two bulk upserts for the whole batch"""
+        events = []
+        rollups: Dict[Tuple, Counter] = defaultdict(Counter)
+        file_rollups: Dict[Tuple, Counter] = defaultdict(Counter)
+        for event_type, file_id, file_type, size, ts, count in batch:
+            events.extend({"type": event_type, "file_id": file_id, "file_type": file_type, "size": size, "ts": ts} for _ in range(count))
+            increments = {f"{event_type}_count": count, f"{event_type}_bytes": size * count}
+            for granularity in GRANULARITIES:
+                rollups[(granularity, bucket_start(ts, granularity), file_type)].update(increments)
+            file_rollups[(bucket_start(ts, "day"), file_id)].update(increments)
+
+        self.events.insert_many(events, ordered=False)
+        self.rollups.bulk_write([
+            UpdateOne({"granularity": granularity, "bucket": bucket, "file_type": file_type}, {"$inc": dict(increments)}, upsert=True)
+            for (granularity, bucket, file_type), increments in rollups.items()
+        ], ordered=False)
+        self.file_rollups.bulk_write([
+            UpdateOne({"bucket": bucket, "file_id": file_id}, {"$inc": dict(increments)}, upsert=True)
+            for (bucket, file_id), increments in file_rollups.items()
+        ], ordered=False)
+
+    def series(self, metric: str, granularity: str, start: datetime, end: datetime, group_by: Optional[str] = None) -> List[Dict]:
+        field = METRICS[metric]
+        group_id = {"bucket": "$bucket"}
+        if group_by == "file_type":
+            group_id["file_type"] = "$file_type"
+
+        rows = self.rollups.aggregate([
+            {"$match": {
+                "granularity": granularity,
+                "bucket": {"$gte": bucket_start(start, granularity), "$lte": end}
+            }},
+            {"$group": {"_id": group_id, "value": {"$sum": f"${field}"}}},
+            {"$sort": {"_id.bucket": 1}}
+        ])
+        return [{**row["_id"], "value": row["value"]} for row in rows]
+
+    def top_files(self, metric: str, start: datetime, end: datetime, limit: int = 10) -> List[Dict]:
+        field = METRICS[metric]
+        rows = self.file_rollups.aggregate([
+            {"$match": {"bucket": {"$gte": bucket_start(start, "day"), "$lte": end}}},
+            {"$group": {"_id": "$file_id", "value": {"$sum": f"${field}"}}},
+            {"$match": {"value": {"$gt": 0}}},
+            {"$sort": {"value": -1}},
+            {"$limit": limit}
+        ])
+        return [{"file_id": row["_id"], "value": row["value"]} for row in rows]
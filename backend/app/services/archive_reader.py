@@ -0,0 +1,106 @@
+﻿import gzip
+import struct
+import tarfile
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+MAX_INDEX_ENTRIES = 10000
+STREAM_CHUNK_SIZE = 64 * 1024
+
+class UnsupportedArchive(ValueError):
+    pass
+
+def build_index(path: Path, original_name: str) -> Dict:
+    """List archive members without decompressing them where the format allows.
+
+    zip reads only the central directory. Plain tar walks the headers and
+    seeks over member data, recording where each member's bytes start.
+    Compressed tars have to be decompressed front to back once to be listed.
+    """
+    path = Path(path)
+    name = original_name.lower()
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            entries = [{
+                "name": info.filename,
+                "size": info.file_size,
+                "compressed_size": info.compress_size,
+                "is_dir": info.is_dir()
+            } for info in archive.infolist()[:MAX_INDEX_ENTRIES + 1]]
+        archive_format = "zip"
+    elif tarfile.is_tarfile(path):
+        archive_format = "tar" if _is_plain_tar(path) else "tar.compressed"
+        entries = []
+        with tarfile.open(path, "r:*") as archive:
+            for member in archive:
+                entry = {"name": member.name, "size": member.size, "is_dir": member.isdir()}
+                if archive_format == "tar" and member.isreg():
+                    entry["offset"] = member.offset_data
+                entries.append(entry)
+                if len(entries) > MAX_INDEX_ENTRIES:
+                    break
+    elif name.endswith(".gz"):
+        archive_format = "gzip"
+        entries = [{"name": Path(original_name).stem, "size": _gzip_size(path), "is_dir": False}]
+    else:
+        raise UnsupportedArchive(f"Browsing {Path(original_name).suffix or 'this'} archives is not supported")
+
+    return {
+        "format": archive_format,
+        "entries": entries[:MAX_INDEX_ENTRIES],
+        "truncated": len(entries) > MAX_INDEX_ENTRIES,
+        "indexed_at": datetime.utcnow()
+    }
+
+def find_entry(index: Dict, member: str) -> Optional[Dict]:
+    for entry in index["entries"]:
+        if entry["name"] == member and not entry["is_dir"]:
+            return entry
+    return None
+
+def iter_member(path: Path, index: Dict, entry: Dict) -> Iterator[bytes]:
+    """Yield one member's decompressed bytes; blocking, so hand it to StreamingResponse"""
+    archive_format = index["format"]
+    if archive_format == "zip":
+        with zipfile.ZipFile(path) as archive, archive.open(entry["name"]) as member:
+            yield from _chunks(member)
+    elif archive_format == "tar" and "offset" in entry:
+        # Uncompressed tar: the member is a contiguous byte range
+        with open(path, "rb") as f:
+            f.seek(entry["offset"])
+            remaining = entry["size"]
+            while remaining > 0:
+                chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    elif archive_format in ("tar", "tar.compressed"):
+        with tarfile.open(path, "r|*") as archive:
+            for member in archive:
+                if member.name == entry["name"]:
+                    yield from _chunks(archive.extractfile(member))
+                    return
+    elif archive_format == "gzip":
+        with gzip.open(path, "rb") as member:
+            yield from _chunks(member)
+
+def _chunks(stream) -> Iterator[bytes]:
+    while True:
+        chunk = stream.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+def _is_plain_tar(path: Path) -> bool:
+    with open(path, "rb") as f:
+        magic = f.read(6)
+    return not (magic.startswith(b"\x1f\x8b") or magic.startswith(b"BZh") or magic.startswith(b"\xfd7zXZ"))
+
+def _gzip_size(path: Path) -> Optional[int]:
+    # ISIZE trailer: uncompressed length mod 2**32, exact for anything under 4GB
+    with open(path, "rb") as f:
+        f.seek(-4, 2)
+        return struct.unpack("<I", f.read(4))[0]
@@ -0,0 +1,51 @@
+﻿import asyncio
+from typing import Any, Callable, Dict, Hashable, Iterable, List
+
+class BatchLoader:
+    """Coalesces lookups issued in the same event-loop tick into one batch call.
+
+    batch_fn receives the distinct keys and returns a dict of key -> value;
+    keys missing from the dict resolve to None. Concurrent loads of the same
+    key share one future, so they also share the returned object. Each caller
+    gets it behind a shield, so one caller being cancelled does not cancel it
+    for the others.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Hashable]], Dict[Hashable, Any]], max_batch_size: int = 500):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+        self.batches = 0
+        self.keys_loaded = 0
+
+    def load(self, key: Hashable) -> asyncio.Future:
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            if not self._pending:
+                # First key of this tick - dispatch once the current callbacks have run
+                loop.call_soon(self._dispatch)
+            future = loop.create_future()
+            self._pending[key] = future
+        return asyncio.shield(future)
+
+    async def load_many(self, keys: Iterable[Hashable]) -> List[Any]:
+        return await asyncio.gather(*(self.load(key) for key in keys))
+
+    def _dispatch(self):
+        pending, self._pending = self._pending, {}
+        keys = list(pending)
+        for start in range(0, len(keys), self.max_batch_size):
+            chunk = keys[start:start + self.max_batch_size]
+            self.batches += 1
+            self.keys_loaded += len(chunk)
+            try:
+                results = self.batch_fn(chunk)
+            except Exception as e:
+                for key in chunk:
+                    if not pending[key].done():
+                        pending[key].set_exception(e)
+                continue
+            for key in chunk:
+                if not pending[key].done():
+                    pending[key].set_result(results.get(key))
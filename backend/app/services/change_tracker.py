@@ -0,0 +1,176 @@
+﻿import asyncio
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from typing import Dict, Iterator
+
+class ChangeTracker:
+    """Monotonic change versions for files_collection plus tombstones for deletions.
+
+    Every mutation takes the next value of a single counter document and stamps
+    it on the file (or on its tombstone when deleted), so "what changed since v"
+    is an indexed range query on both collections.
+
+    A version is allocated before the write that carries it, so until that
+    write lands the version is "in flight" and change cursors must not move
+    past it. Writers use change(), which releases the version once the block
+    exits. Only this process's in-flight versions are known here.
+
+    Each commit also bumps a "committed" count on the same counter document,
+    so every worker sees the same value change once any worker's write lands.
+    committed_count() answers from memory: this worker's own commits update
+    it at once, and the background refresh started by start() picks up other
+    workers' commits within refresh_seconds.
+    """
+
+    COUNTER_ID = "files"
+
+    def __init__(self, db, tombstone_retention_days: int = 7, on_change=None):
+        self.counters = db.counters
+        self.tombstones = db.file_tombstones
+        self.tombstone_retention = timedelta(days=tombstone_retention_days)
+        self.on_change = on_change
+        self._in_flight = set()
+        self._committed = None
+        self._task = None
+
+    def ensure_indexes(self, files_collection):
+        files_collection.create_index("version", background=True)
+        self.tombstones.create_index("version", background=True)
+        self.tombstones.create_index("deleted_at", background=True)
+
+    def next_version(self) -> int:
+        counter = self.counters.find_one_and_update(
+            {"_id": self.COUNTER_ID},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._in_flight.add(counter["seq"])
+        return counter["seq"]
+
+    def commit(self, version: int):
+        """The write stamped with version has landed (or failed) - cursors may pass it"""
+        self._in_flight.discard(version)
+        counter = self.counters.find_one_and_update(
+            {"_id": self.COUNTER_ID},
+            {"$inc": {"committed": 1}},
+            {"committed": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._observe_committed(counter["committed"])
+        # Only now, so caches dropped here cannot be refilled with data from before the write
+        if self.on_change:
+            self.on_change(version)
+
+    @contextmanager
+    def change(self) -> Iterator[int]:
+        """Allocate a version for the write made inside the block"""
+        version = self.next_version()
+        try:
+            yield version
+        finally:
+            self.commit(version)
+
+    def stable_version(self) -> int:
+        """Highest version with no write still in flight at or below it"""
+        if self._in_flight:
+            return min(self._in_flight) - 1
+        return self.current_version()
+
+    def current_version(self) -> int:
+        counter = self.counters.find_one({"_id": self.COUNTER_ID})
+        return counter.get("seq", 0) if counter else 0
+
+    def committed_count(self) -> int:
+        """Writes landed so far by all workers - changes whenever the collection may have"""
+        if self._committed is None:
+            self.refresh_committed()
+        return self._committed
+
+    def refresh_committed(self):
+        counter = self.counters.find_one({"_id": self.COUNTER_ID}, {"committed": 1})
+        self._observe_committed(counter.get("committed", 0) if counter else 0)
+
+    def _observe_committed(self, value: int):
+        # Reads and commits can finish out of order; the count itself only grows
+        self._committed = value if self._committed is None else max(self._committed, value)
+
+    def start(self, refresh_seconds: float = 1.0):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(refresh_seconds))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, refresh_seconds: float):
+        while True:
+            try:
+                await asyncio.to_thread(self.refresh_committed)
+            except Exception as e:
+                print(f"❌ Refreshing the committed change count failed: {e}")
+            await asyncio.sleep(refresh_seconds)
+
+    def horizon(self) -> int:
+        """Highest tombstone version already pruned; older cursors must resync"""
+        counter = self.counters.find_one({"_id": self.COUNTER_ID})
+        return counter.get("horizon", 0) if counter else 0
+
+    def record_deletion(self, file_id: str, version: int):
+        self.tombstones.insert_one({
+            "file_id": file_id,
+            "version": version,
+            "deleted_at": datetime.utcnow()
+        })
+
+    def prune_tombstones(self) -> int:
+        cutoff = datetime.utcnow() - self.tombstone_retention
+        expired = list(self.tombstones.find({"deleted_at": {"$lt": cutoff}}, {"version": 1}))
+        if not expired:
+            return 0
+        self.counters.update_one(
+            {"_id": self.COUNTER_ID},
+            {"$max": {"horizon": max(t["version"] for t in expired)}},
+            upsert=True
+        )
+        result = self.tombstones.delete_many({"_id": {"$in": [t["_id"] for t in expired]}})
+        return result.deleted_count
+
+    def changes_since(self, files_collection, since: int, limit: int = 500, projection: Dict = None) -> Dict:
+        if since < self.horizon():
+            # Tombstones the client needs are gone - only a full reload is correct
+            return {"reset": True, "version": self.stable_version(), "files": [], "deleted": [], "has_more": False}
+
+        # Stop below the oldest write still in flight, or its change would be skipped for good
+        versions = {"$gt": since}
+        if self._in_flight:
+            versions["$lt"] = min(self._in_flight)
+        files = list(files_collection.find({"version": versions, "trashed": False}, projection).sort("version", 1).limit(limit))
+        tombstones = list(self.tombstones.find({"version": versions}, {"_id": 0}).sort("version", 1).limit(limit))
+
+        # Merge both streams by version and cut at limit so the next cursor is exact
+        merged = sorted(
+            [(f["version"], "file", f) for f in files] + [(t["version"], "deleted", t) for t in tombstones],
+            key=lambda change: change[0]
+        )
+        has_more = len(merged) > limit or len(files) == limit or len(tombstones) == limit
+        merged = merged[:limit]
+
+        changed_files = [doc for _, kind, doc in merged if kind == "file"]
+        deleted = [{"id": doc["file_id"], "version": doc["version"]} for _, kind, doc in merged if kind == "deleted"]
+        version = merged[-1][0] if merged else since
+
+        return {
+            "reset": False,
+            "version": version,
+            "files": changed_files,
+            "deleted": deleted,
+            "has_more": has_more
+        }
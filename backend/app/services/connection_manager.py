@@ -0,0 +1,170 @@
+﻿import json
+from fastapi import WebSocket
+from typing import Dict, List, Optional, Set
+from app.services.ws_encoding import EncodedMessage, FILE_FIELDS, encode
+
+ALL_TOPICS = "*"
+
+class Subscription:
+    """What one connection wants: a set of topics, optional file filters and its wire format"""
+
+    __slots__ = ("topics", "file_types", "starred", "file_ids", "encoding")
+
+    def __init__(self, encoding: str = "json"):
+        self.encoding = encoding
+        self.topics: Set[str] = {ALL_TOPICS}
+        self.file_types: Optional[Set[str]] = None
+        self.starred: Optional[bool] = None
+        self.file_ids: Optional[Set[str]] = None
+
+    def set_filters(self, filters: Dict):
+        file_types = filters.get("file_type")
+        if isinstance(file_types, str):
+            file_types = [file_types]
+        self.file_types = set(file_types) if file_types else None
+        self.starred = filters.get("starred")
+        file_ids = filters.get("file_ids")
+        self.file_ids = set(file_ids) if file_ids else None
+
+    def matches(self, file_data: Optional[Dict]) -> bool:
+        # Events without a file (stats) and fields missing from the event never exclude
+        if not file_data:
+            return True
+        if self.file_ids is not None and "id" in file_data and file_data["id"] not in self.file_ids:
+            return False
+        if self.file_types is not None and "file_type" in file_data and file_data["file_type"] not in self.file_types:
+            return False
+        if self.starred is not None and "starred" in file_data and file_data["starred"] != self.starred:
+            return False
+        return True
+
+    def describe(self) -> Dict:
+        return {
+            "topics": sorted(self.topics),
+            "filters": {
+                "file_type": sorted(self.file_types) if self.file_types else None,
+                "starred": self.starred,
+                "file_ids": sorted(self.file_ids) if self.file_ids else None
+            }
+        }
+
+class ConnectionManager:
+    """WebSocket connections indexed by topic.
+
+    New connections receive every topic until they subscribe to specific ones,
+    which keeps clients that never send anything working as before. Dispatch
+    only looks at connections indexed under the event's topic or "*".
+    Opt-in topics are the exception: "*" does not cover them, so only
+    connections that name them explicitly receive them.
+    """
+
+    def __init__(self, opt_in_topics: Set[str] = None):
+        self.opt_in_topics = set(opt_in_topics or ())
+        self.active_connections: List[WebSocket] = []
+        self.subscriptions: Dict[WebSocket, Subscription] = {}
+        self.topic_index: Dict[str, Set[WebSocket]] = {ALL_TOPICS: set()}
+
+    async def connect(self, websocket: WebSocket, encoding: str = "json"):
+        await websocket.accept()
+        self.active_connections.append(websocket)
+        self.subscriptions[websocket] = Subscription(encoding)
+        self.topic_index[ALL_TOPICS].add(websocket)
+        if encoding != "json":
+            # Binary clients need the key table to decode interned file fields
+            await self._send(websocket, {"type": "hello", "encoding": encoding, "file_fields": FILE_FIELDS})
+
+    def disconnect(self, websocket: WebSocket):
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+        subscription = self.subscriptions.pop(websocket, None)
+        if subscription:
+            self._unindex(websocket, subscription.topics)
+
+    def _unindex(self, websocket: WebSocket, topics: Set[str]):
+        for topic in topics:
+            subscribers = self.topic_index.get(topic)
+            if subscribers is not None:
+                subscribers.discard(websocket)
+                if not subscribers and topic != ALL_TOPICS:
+                    del self.topic_index[topic]
+
+    def subscribe(self, websocket: WebSocket, topics: List[str], filters: Dict = None):
+        subscription = self.subscriptions[websocket]
+        if ALL_TOPICS in subscription.topics and topics and ALL_TOPICS not in topics:
+            # First explicit subscription narrows the default "everything"
+            self._unindex(websocket, {ALL_TOPICS})
+            subscription.topics.discard(ALL_TOPICS)
+        # No topics means a filter-only update; "*" comes back only when asked for by name
+        for topic in topics:
+            subscription.topics.add(topic)
+            self.topic_index.setdefault(topic, set()).add(websocket)
+        if filters is not None:
+            subscription.set_filters(filters)
+
+    def unsubscribe(self, websocket: WebSocket, topics: List[str]):
+        subscription = self.subscriptions[websocket]
+        removed = set(topics) if topics else set(subscription.topics)
+        self._unindex(websocket, removed & subscription.topics)
+        subscription.topics -= removed
+
+    async def handle_message(self, websocket: WebSocket, text: str):
+        try:
+            message = json.loads(text)
+            action = message.get("action")
+            if action == "subscribe":
+                filters = message.get("filters")
+                if filters is not None and not isinstance(filters, dict):
+                    raise ValueError("filters must be an object")
+                self.subscribe(websocket, self._topics(message), filters)
+            elif action == "unsubscribe":
+                self.unsubscribe(websocket, self._topics(message))
+            elif action != "ping":
+                raise ValueError(f"Unknown action: {action}")
+        except (ValueError, AttributeError, TypeError) as e:
+            await self._send(websocket, {"type": "error", "detail": str(e)})
+            return
+        await self._send(websocket, {"type": "subscription", **self.subscriptions[websocket].describe()})
+
+    @staticmethod
+    def _topics(message: Dict) -> List[str]:
+        topics = message.get("topics") or []
+        # A bare string would otherwise be taken letter by letter
+        if not isinstance(topics, list) or not all(isinstance(topic, str) for topic in topics):
+            raise ValueError("topics must be a list of strings")
+        return topics
+
+    async def _send(self, websocket: WebSocket, message: Dict):
+        frame = encode(message, self.subscriptions[websocket].encoding)
+        if isinstance(frame, bytes):
+            await websocket.send_bytes(frame)
+        else:
+            await websocket.send_text(frame)
+
+    def subscribers(self, topic: str, file_data: Dict = None) -> List[WebSocket]:
+        candidates = self.topic_index.get(topic, set())
+        if topic not in self.opt_in_topics:
+            candidates = candidates | self.topic_index[ALL_TOPICS]
+        return [ws for ws in candidates if self.subscriptions[ws].matches(file_data)]
+
+    async def publish(self, topic: str, message: Dict, file_data: Dict = None):
+        encoded = EncodedMessage(message)
+        for connection in self.subscribers(topic, file_data):
+            # The connection may have gone away while an earlier send was awaited
+            subscription = self.subscriptions.get(connection)
+            if subscription is None:
+                continue
+            frame = encoded.frame(subscription.encoding)
+            try:
+                if isinstance(frame, bytes):
+                    await connection.send_bytes(frame)
+                else:
+                    await connection.send_text(frame)
+            except Exception:
+                self.disconnect(connection)
+
+    async def broadcast(self, message: str):
+        for connection in list(self.active_connections):
+            try:
+                await connection.send_text(message)
+            except Exception:
+                self.disconnect(connection)
@@ -0,0 +1,83 @@
+﻿import json
+from json.encoder import encode_basestring
+from datetime import datetime
+from bson import ObjectId
+from typing import Callable, Dict, Iterable, Iterator
+from app.models.file_models import FileModel
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+# One shared encoder instance - json.dumps() with custom options builds a new one per call
+_encoder = json.JSONEncoder(
+    default=_default,
+    separators=(",", ":"),
+    ensure_ascii=False,
+    check_circular=False
+)
+
+def dumps(value) -> str:
+    """Compact JSON that understands datetime and ObjectId"""
+    return _encoder.encode(value)
+
+def prepare_file_document(doc: Dict, extra: Dict = None) -> Dict:
+    """Rename _id to id in place, the shape every API response uses"""
+    if "_id" in doc:
+        doc["id"] = str(doc.pop("_id"))
+    if extra:
+        doc.update(extra)
+    return doc
+
+def encode_file_document(doc: Dict, extra: Dict = None) -> str:
+    return _encoder.encode(prepare_file_document(doc, extra))
+
+def _encode_value(value) -> str:
+    # Exact type checks cover the model's field types without a trip through the encoder
+    if type(value) is str:
+        return encode_basestring(value)
+    if type(value) is datetime:
+        return '"' + value.isoformat() + '"'
+    return _encoder.encode(value)
+
+# Pre-built '"field":' prefixes for the slotted model, id comes first like the dict path
+_MODEL_KEYS = [(field, f'"{field}":') for field in FileModel.__slots__ if field != "_id"]
+
+def encode_file_model(model: FileModel, extra: Dict = None) -> str:
+    """Encode a slotted FileModel without building an intermediate dict"""
+    parts = [f'"id":"{model._id}"']
+    parts += [key + _encode_value(getattr(model, field)) for field, key in _MODEL_KEYS]
+    if extra:
+        parts += [encode_basestring(name) + ":" + _encode_value(value) for name, value in extra.items()]
+    return "{" + ",".join(parts) + "}"
+
+def encode_file_list(docs: Iterable[Dict], extra: Callable[[Dict], Dict] = None) -> bytes:
+    """Encode a cursor of file documents as one JSON array; extra(doc) adds per-document fields"""
+    if extra:
+        return ("[" + ",".join(encode_file_document(doc, extra(doc)) for doc in docs) + "]").encode("utf-8")
+    return ("[" + ",".join(encode_file_document(doc) for doc in docs) + "]").encode("utf-8")
+
+def iter_ndjson(docs: Iterable, batch_size: int = 100, encode: Callable[..., str] = encode_file_document) -> Iterator[bytes]:
+    """Yield newline-delimited JSON as documents arrive from the cursor.
+
+    Lines are grouped into chunks of batch_size so each send carries a
+    reasonable payload without buffering the whole listing.
+    """
+    chunk = []
+    for doc in docs:
+        chunk.append(encode(doc))
+        if len(chunk) >= batch_size:
+            yield ("\n".join(chunk) + "\n").encode("utf-8")
+            chunk = []
+    if chunk:
+        yield ("\n".join(chunk) + "\n").encode("utf-8")
+
+def wants_ndjson(accept: str, format_param: str = None) -> bool:
+    if format_param:
+        return format_param.lower() == "ndjson"
+    return NDJSON_MEDIA_TYPE in (accept or "")
@@ -2,11 +2,29 @@
 from bson import ObjectId
 from datetime import datetime
 from app.database import get_files_collection
-from app.models.file_models import FileModel
+from app.models.file_models import FileModel, hydrate_files
+from app.services.batch_loader import BatchLoader
+from app.services.insert_batcher import InsertBatcher, parse_write_concern
 
 class FileService:
     def __init__(self):
         self.collection = get_files_collection()
+        # Lookups issued in the same tick are answered by one $in query each
+        self._by_id = BatchLoader(self._load_by_ids)
+        self._by_filename = BatchLoader(self._load_by_filenames)
+        self._inserts = InsertBatcher(
+            self.collection,
+            window_ms=float(os.getenv("INSERT_BATCH_WINDOW_MS", "5")),
+            write_concern=parse_write_concern(os.getenv("INSERT_WRITE_CONCERN"), os.getenv("INSERT_JOURNAL"))
+        )
+
+    def _load_by_ids(self, file_ids):
+        docs = self.collection.find({"_id": {"$in": [ObjectId(file_id) for file_id in file_ids]}})
+        return {str(doc["_id"]): FileModel.from_dict(doc) for doc in docs}
+
+    def _load_by_filenames(self, filenames):
+        docs = self.collection.find({"filename": {"$in": filenames}})
+        return {doc["filename"]: FileModel.from_dict(doc) for doc in docs}
 
     async def save_file_info(self, filename: str, original_name: str, size: int, mime_type: str) -> str:
         file_model = FileModel(
@@ -16,25 +34,25 @@ class FileService:
             mime_type=mime_type
         )
         
-        result = self.collection.insert_one(file_model.to_dict())
-        return str(result.inserted_id)
+        return str(await self._inserts.insert(file_model.to_dict()))
 
     async def get_all_files(self):
-        files = self.collection.find().sort("upload_date", -1)
-        return [FileModel.from_dict(file) for file in files]
+        return list(self.iter_all_files())
+
+    def iter_all_files(self, batch_size: int = 500):
+        """Cursor of FileModel rows decoded straight from BSON, projected fields only"""
+        return hydrate_files(self.collection, batch_size=batch_size)
 
     async def get_file_by_id(self, file_id: str):
-        file_data = self.collection.find_one({"_id": ObjectId(file_id)})
-        if file_data:
-            return FileModel.from_dict(file_data)
-        return None
+        # Validate here so a bad id fails its own request rather than the whole batch
+        return await self._by_id.load(str(ObjectId(file_id)))
+
+    async def get_files_by_ids(self, file_ids):
+        return await self._by_id.load_many([str(ObjectId(file_id)) for file_id in file_ids])
 
     async def delete_file(self, file_id: str) -> bool:
         result = self.collection.delete_one({"_id": ObjectId(file_id)})
         return result.deleted_count > 0
 
     async def get_file_by_filename(self, filename: str):
-        file_data = self.collection.find_one({"filename": filename})
-        if file_data:
-            return FileModel.from_dict(file_data)
-        return None
+        return await self._by_filename.load(filename)
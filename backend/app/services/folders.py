@@ -0,0 +1,156 @@
+﻿from datetime import datetime
+from typing import Dict, List, Optional
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+MAX_DEPTH = 64
+
+class FolderError(ValueError):
+    pass
+
+class FolderNotFound(FolderError):
+    pass
+
+class FolderConflict(FolderError):
+    pass
+
+class FolderTree:
+    """Folders stored as documents with their ancestor ids and materialized path (names, root first).
+
+    Files only carry folder_id, so moving a subtree rewrites folder documents
+    (one update for the folder, one bulk update for its descendants) and never
+    touches files. Each folder keeps counters for its own live files and for
+    its whole subtree; a file change is one $inc over the folder and its
+    ancestors, so recursive sizes are a single document read.
+    """
+
+    def __init__(self, db):
+        self.collection = db.folders
+
+    def ensure_indexes(self, files_collection):
+        self.collection.create_index([("parent_id", 1), ("name", 1)], name="parent_name", unique=True)
+        self.collection.create_index("ancestors", background=True)
+        # _id breaks ties between files uploaded in the same instant, so page cursors never skip one
+        files_collection.create_index(
+            [("folder_id", 1), ("upload_date", -1), ("_id", -1)],
+            name="live_folder_upload_date_id",
+            partialFilterExpression={"trashed": False},
+            background=True
+        )
+        if "live_folder_upload_date" in files_collection.index_information():
+            files_collection.drop_index("live_folder_upload_date")
+
+    def get(self, folder_id: ObjectId) -> Optional[Dict]:
+        return self.collection.find_one({"_id": folder_id})
+
+    def children(self, parent_id: Optional[ObjectId], limit: int = 1000) -> List[Dict]:
+        return list(self.collection.find({"parent_id": parent_id}).sort("name", 1).limit(limit))
+
+    def create(self, name: str, parent_id: Optional[ObjectId] = None) -> Dict:
+        name = self._validate_name(name)
+        ancestors, path = [], []
+        if parent_id is not None:
+            parent = self.get(parent_id)
+            if not parent:
+                raise FolderNotFound("Parent folder not found")
+            ancestors, path = parent["ancestors"] + [parent["_id"]], parent["path"]
+            if len(ancestors) >= MAX_DEPTH:
+                raise FolderConflict(f"Folders cannot be nested more than {MAX_DEPTH} deep")
+
+        folder = {
+            "name": name,
+            "parent_id": parent_id,
+            "ancestors": ancestors,
+            "path": path + [name],
+            "created_at": datetime.utcnow(),
+            "file_count": 0,
+            "size": 0,
+            "tree_file_count": 0,
+            "tree_size": 0
+        }
+        try:
+            folder["_id"] = self.collection.insert_one(folder).inserted_id
+        except DuplicateKeyError:
+            raise FolderConflict(f"A folder named {name} already exists here")
+        return folder
+
+    def move(self, folder_id: ObjectId, new_parent_id: Optional[ObjectId]) -> Dict:
+        folder = self.get(folder_id)
+        if not folder:
+            raise FolderNotFound("Folder not found")
+
+        new_ancestors, new_prefix = [], []
+        if new_parent_id is not None:
+            parent = self.get(new_parent_id)
+            if not parent:
+                raise FolderNotFound("Target folder not found")
+            if parent["_id"] == folder_id or folder_id in parent["ancestors"]:
+                raise FolderConflict("A folder cannot be moved into itself")
+            new_ancestors, new_prefix = parent["ancestors"] + [parent["_id"]], parent["path"]
+            # Same bound as create(): the deepest descendant may have at most MAX_DEPTH - 1 ancestors
+            if len(new_ancestors) + self._subtree_height(folder) >= MAX_DEPTH:
+                raise FolderConflict(f"Folders cannot be nested more than {MAX_DEPTH} deep")
+
+        new_path = new_prefix + [folder["name"]]
+        try:
+            moved = self.collection.find_one_and_update(
+                {"_id": folder_id},
+                {"$set": {"parent_id": new_parent_id, "ancestors": new_ancestors, "path": new_path}},
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            raise FolderConflict(f"A folder named {folder['name']} already exists there")
+
+        # Descendants keep the part of their ancestry from this folder down and swap the prefix above it
+        depth = len(folder["ancestors"])
+        self.collection.update_many({"ancestors": folder_id}, [{"$set": {
+            "ancestors": {"$concatArrays": [new_ancestors, {"$slice": ["$ancestors", depth, MAX_DEPTH]}]},
+            "path": {"$concatArrays": [new_path, {"$slice": ["$path", depth + 1, MAX_DEPTH]}]}
+        }}])
+
+        # The subtree's totals leave the old ancestors and join the new ones
+        totals = {"tree_file_count": folder["tree_file_count"], "tree_size": folder["tree_size"]}
+        self._inc_many(folder["ancestors"], {key: -value for key, value in totals.items()})
+        self._inc_many(new_ancestors, totals)
+        return moved
+
+    def delete(self, folder_id: ObjectId):
+        """Only empty folders can be deleted; files have to be moved or deleted first"""
+        folder = self.get(folder_id)
+        if not folder:
+            raise FolderNotFound("Folder not found")
+        if folder["tree_file_count"] or self.collection.find_one({"parent_id": folder_id}, {"_id": 1}):
+            raise FolderConflict("Folder is not empty")
+        self.collection.delete_one({"_id": folder_id, "tree_file_count": 0})
+
+    def record_files(self, folder_id: Optional[ObjectId], count: int, size: int):
+        """Account live files entering (positive) or leaving (negative) a folder"""
+        if folder_id is None:
+            return
+        folder = self.collection.find_one({"_id": folder_id}, {"ancestors": 1})
+        if not folder:
+            return
+        self.collection.update_one(
+            {"_id": folder_id},
+            {"$inc": {"file_count": count, "size": size, "tree_file_count": count, "tree_size": size}}
+        )
+        self._inc_many(folder["ancestors"], {"tree_file_count": count, "tree_size": size})
+
+    def _subtree_height(self, folder: Dict) -> int:
+        # Sorting on an array field orders by its largest element, not its length, so take $size
+        deepest = list(self.collection.aggregate([
+            {"$match": {"ancestors": folder["_id"]}},
+            {"$group": {"_id": None, "depth": {"$max": {"$size": "$ancestors"}}}}
+        ]))
+        return deepest[0]["depth"] - len(folder["ancestors"]) if deepest else 0
+
+    def _inc_many(self, folder_ids: List[ObjectId], increments: Dict):
+        if folder_ids:
+            self.collection.update_many({"_id": {"$in": folder_ids}}, {"$inc": increments})
+
+    def _validate_name(self, name: str) -> str:
+        name = (name or "").strip()
+        if not name or "/" in name or name in (".", ".."):
+            raise FolderError("Folder names must be non-empty and cannot contain '/'")
+        return name
@@ -0,0 +1,113 @@
+﻿from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+class FrequencySketch:
+    """Count-min sketch of recent access counts; halves every counter once enough accesses were seen"""
+
+    def __init__(self, width: int = 4096, depth: int = 4):
+        self.width = width
+        self.rows = [[0] * width for _ in range(depth)]
+        self.sample_size = width * 10
+        self.additions = 0
+
+    def _slots(self, key: Hashable):
+        return [hash((row, key)) % self.width for row in range(len(self.rows))]
+
+    def increment(self, key: Hashable):
+        for row, slot in zip(self.rows, self._slots(key)):
+            row[slot] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            # Aging keeps yesterday's popular files from blocking today's
+            for row in self.rows:
+                for slot in range(self.width):
+                    row[slot] >>= 1
+            self.additions //= 2
+
+    def estimate(self, key: Hashable) -> int:
+        return min(row[slot] for row, slot in zip(self.rows, self._slots(key)))
+
+class HotFileCache:
+    """In-memory bytes for small, frequently downloaded files under a global byte budget.
+
+    Entries are kept in LRU order. A file is only admitted once the frequency
+    sketch has seen it admit_after times, and when room has to be made it must
+    also be more popular than the entries it would push out, so a one-off scan
+    over many files cannot flush the hot set.
+    """
+
+    def __init__(self, budget_bytes: int, max_file_bytes: int = 256 * 1024, admit_after: int = 2):
+        self.budget_bytes = budget_bytes
+        self.max_file_bytes = min(max_file_bytes, budget_bytes)
+        self.admit_after = admit_after
+        self.sketch = FrequencySketch()
+        self._entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.admissions = 0
+        self.rejections = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        """Look up a file and count the access towards its admission"""
+        self.sketch.increment(key)
+        content = self._entries.get(key)
+        if content is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return content
+
+    def should_admit(self, key: Hashable, size: int) -> bool:
+        """Cheap check before reading the file from disk"""
+        return 0 <= size <= self.max_file_bytes and self.sketch.estimate(key) >= self.admit_after
+
+    def put(self, key: Hashable, content: bytes) -> bool:
+        size = len(content)
+        if key in self._entries or not self.should_admit(key, size):
+            return False
+
+        candidate = self.sketch.estimate(key)
+        victims = []
+        freed = 0
+        for victim in self._entries:
+            if self.bytes_used - freed + size <= self.budget_bytes:
+                break
+            if self.sketch.estimate(victim) > candidate:
+                self.rejections += 1
+                return False
+            victims.append(victim)
+            freed += len(self._entries[victim])
+
+        for victim in victims:
+            self.bytes_used -= len(self._entries.pop(victim))
+            self.evictions += 1
+        self._entries[key] = content
+        self.bytes_used += size
+        self.admissions += 1
+        return True
+
+    def invalidate(self, key: Hashable):
+        content = self._entries.pop(key, None)
+        if content is not None:
+            self.bytes_used -= len(content)
+            self.invalidations += 1
+
+    def metrics(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes_used": self.bytes_used,
+            "budget_bytes": self.budget_bytes,
+            "max_file_bytes": self.max_file_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "admissions": self.admissions,
+            "rejections": self.rejections,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
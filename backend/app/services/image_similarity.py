@@ -0,0 +1,180 @@
+﻿import asyncio
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+from bson import ObjectId
+
+try:
+    import numpy as np
+    from PIL import Image
+except ImportError:
+    np = None
+    Image = None
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+
+def available() -> bool:
+    return np is not None and Image is not None
+
+def _dct_matrix(n: int):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+_DCT = _dct_matrix(DCT_SIZE) if np is not None else None
+# Set-bit count of every 16-bit value, for numpy releases without bitwise_count
+_POPCOUNT16 = None
+
+def _popcount(values):
+    global _POPCOUNT16
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    if _POPCOUNT16 is None:
+        _POPCOUNT16 = np.array([bin(value).count("1") for value in range(1 << 16)], dtype=np.uint8)
+    return _POPCOUNT16[values.view(np.uint16)].reshape(-1, 4).sum(axis=1, dtype=np.uint8)
+
+def perceptual_hash(path: Path) -> str:
+    """64-bit DCT hash as 16 hex digits; survives resizing and re-encoding. Blocking."""
+    with Image.open(path) as image:
+        pixels = np.asarray(image.convert("L").resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS), dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+    bits = low > np.median(low[1:])
+    return f"{int(np.packbits(bits).view('>u8')[0]):016x}"
+
+class HashIndex:
+    """Packed in-memory index of 64-bit image hashes, searched by vectorized Hamming distance.
+
+    Hashes sit in one uint64 array and ids in a parallel array of 12-byte
+    ObjectIds, so a million images take about 20MB. A dict maps each id to its
+    row, and removal moves the last row into the freed one, so the arrays stay
+    dense and add/remove/get are O(1).
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.hashes = np.zeros(capacity, dtype=np.uint64)
+        self.ids = np.zeros(capacity, dtype="S12")
+        self.rows: Dict[bytes, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def rebuild(self, docs: Iterable[Dict]):
+        """Replace the contents from {"_id", "phash"} documents, e.g. a files_collection cursor"""
+        pairs = dict((doc["_id"].binary, int(doc["phash"], 16)) for doc in docs)
+        capacity = max(1024, len(pairs) * 2)
+        self.hashes = np.zeros(capacity, dtype=np.uint64)
+        self.ids = np.zeros(capacity, dtype="S12")
+        if pairs:
+            self.ids[:len(pairs)] = list(pairs)
+            self.hashes[:len(pairs)] = list(pairs.values())
+        self.rows = {file_id: row for row, file_id in enumerate(pairs)}
+
+    def add(self, file_id: str, phash: str):
+        key = ObjectId(file_id).binary
+        row = self.rows.get(key)
+        if row is None:
+            row = len(self.rows)
+            if row == len(self.hashes):
+                self._resize(len(self.hashes) * 2)
+            self.ids[row] = key
+            self.rows[key] = row
+        self.hashes[row] = int(phash, 16)
+
+    def remove(self, file_id: str):
+        row = self.rows.pop(ObjectId(file_id).binary, None)
+        if row is None:
+            return
+        last = len(self.rows)
+        if row != last:
+            # Fill the hole with the last row so the live rows stay contiguous
+            self.ids[row] = self.ids[last]
+            self.hashes[row] = self.hashes[last]
+            self.rows[self._id_at(row)] = row
+
+    def get(self, file_id: str):
+        row = self.rows.get(ObjectId(file_id).binary)
+        return int(self.hashes[row]) if row is not None else None
+
+    def search(self, phash: int, max_distance: int = 10, limit: int = 20) -> List[Tuple[str, int]]:
+        """(file id, distance) pairs within max_distance, closest first"""
+        size = len(self.rows)
+        distances = _popcount(np.bitwise_xor(self.hashes[:size], np.uint64(phash)))
+        matches = np.nonzero(distances <= max_distance)[0]
+        best = matches[np.argsort(distances[matches], kind="stable")[:limit]]
+        return [(str(ObjectId(self._id_at(row))), int(distances[row])) for row in best]
+
+    def _id_at(self, row: int) -> bytes:
+        # Indexing an S12 array strips trailing NUL bytes; a one-row slice keeps all 12
+        return self.ids[row:row + 1].tobytes()
+
+    def _resize(self, capacity: int):
+        size = len(self.rows)
+        for name in ("hashes", "ids"):
+            old = getattr(self, name)
+            grown = np.zeros(capacity, dtype=old.dtype)
+            grown[:size] = old[:size]
+            setattr(self, name, grown)
+
+class PerceptualHasher:
+    """Background worker that hashes image files lacking a phash and feeds the index"""
+
+    def __init__(self, files_collection, index: HashIndex, batch_size: int = 50, interval_seconds: float = 30):
+        self.collection = files_collection
+        self.index = index
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.hashed_total = 0
+        self.failed_total = 0
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def wake(self):
+        """New images were uploaded - hash them now instead of at the next interval"""
+        self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                while await self.hash_batch():
+                    await asyncio.sleep(0)
+            except Exception as e:
+                print(f"❌ Perceptual hashing failed: {e}")
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def hash_batch(self) -> int:
+        # Cold files are hashed when they come back to local disk
+        batch = list(self.collection.find(
+            {"file_type": "image", "trashed": False, "phash": {"$exists": False}, "storage_tier": {"$ne": "cold"}},
+            {"file_path": 1}
+        ).limit(self.batch_size))
+        for doc in batch:
+            try:
+                phash = await asyncio.to_thread(perceptual_hash, Path(doc.get("file_path", "")))
+            except Exception as e:
+                # Stored as null so an undecodable image is not retried forever
+                self.collection.update_one({"_id": doc["_id"]}, {"$set": {"phash": None, "phash_error": str(e)[:200]}})
+                self.failed_total += 1
+                continue
+            result = self.collection.update_one({"_id": doc["_id"], "trashed": False}, {"$set": {"phash": phash}})
+            if result.modified_count:
+                self.index.add(str(doc["_id"]), phash)
+                self.hashed_total += 1
+        return len(batch)
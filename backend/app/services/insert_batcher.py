@@ -0,0 +1,123 @@
+﻿import asyncio
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import WriteConcern
+from pymongo.errors import BulkWriteError, WriteConcernError
+
+def parse_write_concern(w: Optional[str] = None, journal: Optional[str] = None) -> Optional[WriteConcern]:
+    """w as "majority", "1", "0"... plus an optional journal flag; None keeps the collection's default"""
+    if not w and journal is None:
+        return None
+    options = {}
+    if w:
+        options["w"] = int(w) if w.isdigit() else w
+    if journal is not None:
+        options["j"] = journal.lower() == "true"
+    return WriteConcern(**options)
+
+class InsertBatcher:
+    """Group commit for inserts: documents arriving within window_ms share one insert_many.
+
+    Ids are assigned client-side, so every caller gets its own id back and a
+    duplicate or invalid document only fails its own request - the batch is
+    unordered and per-document write errors are matched back by index. A
+    write concern error fails every document not already failed, since none
+    of them is known to be as durable as configured. The write runs in a
+    worker thread, so the next window fills while one commits.
+    """
+
+    def __init__(self, collection, window_ms: float = 5, max_batch_size: int = 500, write_concern: Optional[WriteConcern] = None):
+        self.collection = collection.with_options(write_concern=write_concern) if write_concern else collection
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self._pending: List[Tuple[Dict, asyncio.Future]] = []
+        self._timer = None
+        self.batches = 0
+        self.documents = 0
+        self.errors = 0
+        self.write_concern_errors = 0
+        self.largest_batch = 0
+        self._batch_sizes = deque(maxlen=1000)
+        self._latencies_ms = deque(maxlen=1000)
+
+    def insert(self, doc: Dict) -> asyncio.Future:
+        """Queue a document; the future resolves to its ObjectId once the batch is acknowledged"""
+        if doc.get("_id") is None:
+            doc["_id"] = ObjectId()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((doc, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            # First document of this window
+            self._timer = loop.call_later(self.window, self._flush) if self.window > 0 else loop.call_soon(self._flush)
+        return future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._commit(batch))
+
+    async def _commit(self, batch: List[Tuple[Dict, asyncio.Future]]):
+        docs = [doc for doc, _ in batch]
+        failed: Dict[int, Exception] = {}
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self.collection.insert_many, docs, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[error["index"]] = BulkWriteError({"writeErrors": [error]})
+            concern_errors = e.details.get("writeConcernErrors") or []
+            if concern_errors:
+                self.write_concern_errors += 1
+                error = WriteConcernError(concern_errors[0].get("errmsg", "Write concern not satisfied"), concern_errors[0].get("code"), concern_errors[0])
+                for index in range(len(batch)):
+                    failed.setdefault(index, error)
+        except Exception as e:
+            failed = {index: e for index in range(len(batch))}
+        self._observe(len(batch), (time.perf_counter() - started) * 1000, len(failed))
+
+        for index, (doc, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in failed:
+                future.set_exception(failed[index])
+            else:
+                future.set_result(doc["_id"])
+
+    def _observe(self, size: int, latency_ms: float, errors: int):
+        self.batches += 1
+        self.documents += size
+        self.errors += errors
+        self.largest_batch = max(self.largest_batch, size)
+        self._batch_sizes.append(size)
+        self._latencies_ms.append(latency_ms)
+
+    def metrics(self) -> Dict:
+        def percentile(values, q):
+            ordered = sorted(values)
+            return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0
+
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch_size": self.max_batch_size,
+            "write_concern": self.collection.write_concern.document,
+            "batches": self.batches,
+            "documents": self.documents,
+            "errors": self.errors,
+            "write_concern_errors": self.write_concern_errors,
+            "mean_batch_size": round(self.documents / self.batches, 2) if self.batches else 0,
+            "largest_batch": self.largest_batch,
+            "recent_batch_size_p50": percentile(self._batch_sizes, 0.5),
+            "recent_batch_size_p99": percentile(self._batch_sizes, 0.99),
+            "recent_commit_ms_p50": round(percentile(self._latencies_ms, 0.5), 2),
+            "recent_commit_ms_p99": round(percentile(self._latencies_ms, 0.99), 2),
+            "pending": len(self._pending)
+        }
@@ -0,0 +1,141 @@
+﻿import asyncio
+import hashlib
+from datetime import datetime
+from pathlib import Path
+from typing import Dict
+
+CHECKSUM_ALGORITHM = "sha256"
+SCRUB_CHUNK_SIZE = 1024 * 1024
+
+class IntegrityScrubber:
+    """Re-hashes stored blobs in _id order at a capped read rate.
+
+    The position is persisted in scrub_state after every file, so a restart
+    resumes where the last pass stopped instead of starting over. Files
+    uploaded before checksums existed get their digest recorded on first visit.
+    """
+
+    STATE_ID = "files"
+
+    def __init__(self, db, files_collection, bandwidth_bytes_per_sec: float = 5 * 1024 * 1024,
+                 pass_interval_seconds: float = 3600, batch_size: int = 100):
+        self.collection = files_collection
+        self.state = db.scrub_state
+        self.bandwidth = bandwidth_bytes_per_sec
+        self.pass_interval_seconds = pass_interval_seconds
+        self.batch_size = batch_size
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def progress(self) -> Dict:
+        state = self.state.find_one({"_id": self.STATE_ID}) or {}
+        state.pop("_id", None)
+        if state.get("last_id") is not None:
+            state["last_id"] = str(state["last_id"])
+        state["running"] = self._task is not None and not self._task.done()
+        state["bandwidth_bytes_per_sec"] = self.bandwidth
+        return state
+
+    async def _run(self):
+        while True:
+            try:
+                finished = await self.scrub_batch()
+            except Exception as e:
+                print(f"❌ Integrity scrub failed: {e}")
+                finished = True
+            if finished:
+                await asyncio.sleep(self.pass_interval_seconds)
+
+    async def scrub_batch(self) -> bool:
+        """Verify the next batch of files; returns True when the pass is complete"""
+        state = self.state.find_one({"_id": self.STATE_ID}) or {}
+        # Cold objects are checksummed by the object store itself
+        query = {"trashed": False, "storage_tier": {"$ne": "cold"}}
+        if state.get("last_id") is not None:
+            query["_id"] = {"$gt": state["last_id"]}
+        else:
+            self.state.update_one(
+                {"_id": self.STATE_ID},
+                {"$set": {"pass_started_at": datetime.utcnow(), "pass_files": 0, "pass_bytes": 0}},
+                upsert=True
+            )
+
+        batch = list(self.collection.find(query, {"file_path": 1, "size": 1, CHECKSUM_ALGORITHM: 1}).sort("_id", 1).limit(self.batch_size))
+        for doc in batch:
+            status, size = await self.verify(doc)
+            self.state.update_one(
+                {"_id": self.STATE_ID},
+                {
+                    "$set": {"last_id": doc["_id"], "last_checked_at": datetime.utcnow()},
+                    "$inc": {"pass_files": 1, "pass_bytes": size, "files_checked": 1, f"status_counts.{status}": 1}
+                },
+                upsert=True
+            )
+
+        if len(batch) < self.batch_size:
+            self.state.update_one(
+                {"_id": self.STATE_ID},
+                {"$set": {"last_id": None, "pass_completed_at": datetime.utcnow()}, "$inc": {"passes_completed": 1}},
+                upsert=True
+            )
+            return True
+        return False
+
+    async def verify(self, doc: Dict):
+        path = Path(doc.get("file_path", ""))
+        update = {"integrity_checked_at": datetime.utcnow()}
+        size = 0
+
+        try:
+            digest, size = await self._hash_file(path)
+        except FileNotFoundError:
+            status = "missing"
+        else:
+            expected = doc.get(CHECKSUM_ALGORITHM)
+            if expected is None:
+                update[CHECKSUM_ALGORITHM] = digest
+                status = "ok" if size == doc.get("size") else "mismatch"
+            else:
+                status = "ok" if digest == expected else "mismatch"
+
+        update["integrity_status"] = status
+        # The read can take minutes at the bandwidth cap; a file demoted, trashed or deleted meanwhile is not damaged
+        result = self.collection.update_one(
+            {"_id": doc["_id"], "trashed": False, "storage_tier": {"$ne": "cold"}},
+            {"$set": update}
+        )
+        if not result.matched_count:
+            return "skipped", size
+        if status != "ok":
+            print(f"⚠️ Integrity {status}: {path}")
+        return status, size
+
+    async def _hash_file(self, path: Path):
+        hasher = hashlib.new(CHECKSUM_ALGORITHM)
+        size = 0
+        f = await asyncio.to_thread(open, path, "rb")
+        try:
+            while True:
+                chunk = await asyncio.to_thread(f.read, SCRUB_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                size += len(chunk)
+                # Pace reads so the scrubber stays under its bandwidth cap
+                if self.bandwidth > 0:
+                    await asyncio.sleep(len(chunk) / self.bandwidth)
+        finally:
+            f.close()
+        return hasher.hexdigest(), size
@@ -0,0 +1,108 @@
+﻿import asyncio
+import cProfile
+import hmac
+import json
+import random
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+class ProfileStore:
+    """Bounded on-disk ring of cProfile dumps (pstats format) with a JSON sidecar each"""
+
+    def __init__(self, directory: Path, max_profiles: int = 50):
+        self.directory = Path(directory)
+        self.max_profiles = max_profiles
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def save(self, profiler: cProfile.Profile, meta: Dict) -> str:
+        """Blocking - call through asyncio.to_thread"""
+        profile_id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:6]}"
+        profiler.dump_stats(self.directory / f"{profile_id}.prof")
+        (self.directory / f"{profile_id}.json").write_text(json.dumps({"id": profile_id, **meta}))
+        self._trim()
+        return profile_id
+
+    def _trim(self):
+        profiles = sorted(self.directory.glob("*.prof"))
+        for old in profiles[:max(0, len(profiles) - self.max_profiles)]:
+            old.unlink(missing_ok=True)
+            old.with_suffix(".json").unlink(missing_ok=True)
+
+    def list(self) -> List[Dict]:
+        entries = []
+        for meta_path in sorted(self.directory.glob("*.json"), reverse=True):
+            try:
+                entries.append(json.loads(meta_path.read_text()))
+            except (OSError, ValueError):
+                continue
+        return entries
+
+    def path(self, profile_id: str) -> Optional[Path]:
+        # Ids come from the URL, so only accept names this store could have written
+        candidate = self.directory / f"{Path(profile_id).name}.prof"
+        return candidate if candidate.exists() else None
+
+class ProfilingMiddleware:
+    """ASGI middleware that runs cProfile around a sample of requests.
+
+    A request is profiled when it matches one of the route prefixes, carries
+    the trigger header together with the admin token, or wins
+    the sample_rate draw. cProfile sees the whole event-loop thread, so only
+    one request is profiled at a time and the rest pass straight through.
+    """
+
+    TRIGGER_HEADER = b"x-profile-request"
+
+    def __init__(self, app, store: ProfileStore, sample_rate: float = 0.0, routes: List[str] = None, admin_token: str = None):
+        self.app = app
+        self.store = store
+        self.sample_rate = sample_rate
+        self.routes = [route for route in (routes or []) if route]
+        self.admin_token = admin_token.encode() if admin_token else None
+        self._active = False
+
+    def _should_profile(self, scope) -> bool:
+        if self._active:
+            return False
+        headers = dict(scope.get("headers") or [])
+        # The trigger header is an admin feature, so without a configured token nobody can use it
+        if headers.get(self.TRIGGER_HEADER) and self.admin_token and hmac.compare_digest(headers.get(b"x-admin-token", b""), self.admin_token):
+            return True
+        if any(scope["path"].startswith(route) for route in self.routes):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        self._active = True
+        status = {"code": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.disable()
+            self._active = False
+            meta = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": status["code"],
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            }
+            try:
+                await asyncio.to_thread(self.store.save, profiler, meta)
+            except Exception as e:
+                print(f"❌ Could not save profile: {e}")
@@ -0,0 +1,421 @@
+﻿import asyncio
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+
+# Operators that pin a field to one value or a set of values; everything else is a range
+EQUALITY_OPERATORS = {"$eq", "$in"}
+# Driver and session fields that explain does not accept
+SESSION_FIELDS = {"lsid", "txnNumber", "startTransaction", "autocommit", "writeConcern", "readConcern"}
+TRACKED_COMMANDS = {"find", "count", "distinct", "aggregate", "update", "delete", "findAndModify"}
+
+def _shape_filter(query: Dict) -> Dict:
+    shape = {}
+    for key, value in query.items():
+        if key in ("$and", "$or", "$nor") and isinstance(value, list):
+            shape[key] = [_shape_filter(clause) for clause in value if isinstance(clause, dict)]
+        elif key.startswith("$"):
+            shape[key] = "?"
+        else:
+            shape[key] = _shape_value(value)
+    return shape
+
+def _shape_value(value):
+    if isinstance(value, dict) and value and all(key.startswith("$") for key in value):
+        shape = {}
+        for operator, operand in value.items():
+            if operator == "$elemMatch" and isinstance(operand, dict):
+                shape[operator] = _shape_filter(operand)
+            elif operator == "$not":
+                shape[operator] = _shape_value(operand)
+            else:
+                shape[operator] = "?"
+        return shape
+    return "?"
+
+def query_shape(command_name: str, command: Dict) -> Optional[Tuple[str, Dict, Dict]]:
+    """(collection, filter shape, sort) with every value replaced by "?"; None for untracked commands"""
+    collection = command.get(command_name)
+    if command_name not in TRACKED_COMMANDS or not isinstance(collection, str):
+        return None
+    query, sort = {}, {}
+    if command_name == "find":
+        query, sort = command.get("filter") or {}, command.get("sort") or {}
+    elif command_name in ("count", "distinct", "findAndModify"):
+        query, sort = command.get("query") or {}, command.get("sort") or {}
+    elif command_name == "aggregate":
+        # Only a leading $match (and a $sort right after it) can use an index
+        pipeline = command.get("pipeline") or []
+        if pipeline and "$match" in pipeline[0]:
+            query = pipeline[0]["$match"]
+            if len(pipeline) > 1 and "$sort" in pipeline[1]:
+                sort = pipeline[1]["$sort"]
+    elif command_name in ("update", "delete"):
+        # Bulk writes are attributed to the shape of their first statement
+        statements = command.get(command_name + "s") or []
+        query = statements[0].get("q", {}) if statements else {}
+    return collection, _shape_filter(query), dict(sort)
+
+def explain_command(command_name: str, command: Dict) -> Dict:
+    explained = {key: value for key, value in command.items() if not key.startswith("$") and key not in SESSION_FIELDS}
+    if command_name in ("update", "delete"):
+        # Explain takes exactly one write statement
+        key = command_name + "s"
+        explained[key] = explained[key][:1]
+    return explained
+
+def _walk_plan(plan: Dict, stages: List[str], indexes: List[str]):
+    if not isinstance(plan, dict):
+        return
+    plan = plan.get("queryPlan", plan)
+    if plan.get("stage"):
+        stages.append(plan["stage"])
+    if plan.get("indexName"):
+        indexes.append(plan["indexName"])
+    _walk_plan(plan.get("inputStage"), stages, indexes)
+    for child in plan.get("inputStages") or []:
+        _walk_plan(child, stages, indexes)
+
+def summarize_plan(explain: Dict) -> Dict:
+    """Winning plan stages, indexes used, collection-scan flag and examined/returned counts"""
+    if "queryPlanner" not in explain:
+        # Aggregations nest the find layer of the plan under their first stage
+        for stage in explain.get("stages") or []:
+            if "$cursor" in stage:
+                explain = stage["$cursor"]
+                break
+    stages, indexes = [], []
+    _walk_plan((explain.get("queryPlanner") or {}).get("winningPlan"), stages, indexes)
+    summary = {
+        "stages": stages,
+        "indexes": indexes,
+        "collection_scan": "COLLSCAN" in stages,
+        "explained_at": datetime.utcnow()
+    }
+    stats = explain.get("executionStats")
+    if stats:
+        summary.update(
+            docs_examined=stats.get("totalDocsExamined"),
+            keys_examined=stats.get("totalKeysExamined"),
+            returned=stats.get("nReturned"),
+            execution_ms=stats.get("executionTimeMillis")
+        )
+    return summary
+
+class QueryShape:
+    """Counts and recent latencies of one normalized query, plus its latest sampled plan"""
+
+    __slots__ = ("collection", "operation", "filter", "sort", "count", "total_ms", "max_ms", "latencies",
+                 "errors", "last_seen", "plan", "last_explained")
+
+    def __init__(self, collection: str, operation: str, filter: Dict, sort: Dict):
+        self.collection = collection
+        self.operation = operation
+        self.filter = filter
+        self.sort = sort
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.latencies = deque(maxlen=200)
+        self.errors = 0
+        self.last_seen = None
+        self.plan = None
+        self.last_explained = 0.0
+
+    def describe(self) -> Dict:
+        ordered = sorted(self.latencies)
+        return {
+            "collection": self.collection,
+            "operation": self.operation,
+            "filter": self.filter,
+            "sort": self.sort,
+            "count": self.count,
+            "errors": self.errors,
+            "total_ms": round(self.total_ms, 2),
+            "mean_ms": round(self.total_ms / self.count, 2) if self.count else 0,
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 2) if ordered else 0,
+            "max_ms": round(self.max_ms, 2),
+            "last_seen": self.last_seen,
+            "plan": self.plan
+        }
+
+class QueryShapeRecorder(monitoring.CommandListener):
+    """Command listener that aggregates every query by shape and queues explains worth taking.
+
+    A shape is queued for a cheap queryPlanner explain the first time it is
+    seen, and for an executionStats explain when it runs slower than slow_ms,
+    at most once per explain_interval_seconds. The listener runs on whichever
+    thread issued the command, so it only does bookkeeping under a lock; the
+    explains themselves run in ExplainSampler.
+    """
+
+    def __init__(self, slow_ms: float = 100, explain_interval_seconds: float = 600, max_shapes: int = 1000):
+        self.slow_ms = slow_ms
+        self.explain_interval_seconds = explain_interval_seconds
+        self.max_shapes = max_shapes
+        self.shapes: Dict[str, QueryShape] = {}
+        self.dropped_shapes = 0
+        self.pending_explains: Dict[str, Tuple[str, str, Dict, str]] = {}
+        self._inflight: Dict[int, Tuple[str, str, Dict]] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        shape = query_shape(event.command_name, event.command)
+        if shape is None:
+            return
+        collection, query, sort = shape
+        # Filter fields are sorted for the key, sort fields keep their order
+        key = json.dumps([collection, event.command_name, query, list(sort.items())], sort_keys=True, default=str)
+        with self._lock:
+            if key not in self.shapes:
+                if len(self.shapes) >= self.max_shapes:
+                    self.dropped_shapes += 1
+                    return
+                self.shapes[key] = QueryShape(collection, event.command_name, query, sort)
+            self._inflight[event.request_id] = (key, event.database_name, event.command)
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool):
+        with self._lock:
+            inflight = self._inflight.pop(event.request_id, None)
+            if inflight is None:
+                return
+            key, database, command = inflight
+            shape = self.shapes[key]
+            duration_ms = event.duration_micros / 1000
+            shape.count += 1
+            shape.total_ms += duration_ms
+            shape.max_ms = max(shape.max_ms, duration_ms)
+            shape.latencies.append(duration_ms)
+            shape.last_seen = datetime.utcnow()
+            if failed:
+                shape.errors += 1
+                return
+
+            if key in self.pending_explains:
+                return
+            if shape.plan is None and not shape.last_explained:
+                verbosity = "queryPlanner"
+            elif duration_ms >= self.slow_ms and time.monotonic() - shape.last_explained >= self.explain_interval_seconds:
+                verbosity = "executionStats"
+            else:
+                return
+            shape.last_explained = time.monotonic()
+            self.pending_explains[key] = (database, event.command_name, command, verbosity)
+
+    def take_pending(self) -> List[Tuple[str, Tuple[str, str, Dict, str]]]:
+        with self._lock:
+            pending, self.pending_explains = list(self.pending_explains.items()), {}
+        return pending
+
+    def record_plan(self, key: str, plan: Dict):
+        with self._lock:
+            if key in self.shapes:
+                self.shapes[key].plan = plan
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            return [shape.describe() for shape in self.shapes.values()]
+
+class ExplainSampler:
+    """Runs the explains queued by the recorder, one at a time, off the request path"""
+
+    def __init__(self, client, recorder: QueryShapeRecorder, interval_seconds: float = 5):
+        self.client = client
+        self.recorder = recorder
+        self.interval_seconds = interval_seconds
+        self.explained_total = 0
+        self.failed_total = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            for key, (database, command_name, command, verbosity) in self.recorder.take_pending():
+                try:
+                    explain = await asyncio.to_thread(
+                        self.client[database].command,
+                        {"explain": explain_command(command_name, command), "verbosity": verbosity}
+                    )
+                except Exception as e:
+                    # Some servers and commands cannot be explained; the shape keeps its counters
+                    self.failed_total += 1
+                    self.recorder.record_plan(key, {"error": str(e)[:200], "explained_at": datetime.utcnow()})
+                    continue
+                self.recorder.record_plan(key, summarize_plan(explain))
+                self.explained_total += 1
+
+def _split_filter(query: Dict) -> Optional[Tuple[List[str], List[str]]]:
+    """(equality fields, range fields) of a filter shape; None when one compound index cannot serve it"""
+    query = dict(query)
+    for clause in query.pop("$and", []):
+        query.update(clause)
+    if "$or" in query or "$nor" in query or "_id" in query:
+        # $or needs an index per branch; _id lookups already have one
+        return None
+    equality, ranges = [], []
+    for field, value in query.items():
+        if field.startswith("$"):
+            continue
+        if value == "?" or (isinstance(value, dict) and set(value) <= EQUALITY_OPERATORS):
+            equality.append(field)
+        else:
+            ranges.append(field)
+    return equality, ranges
+
+def recommend_index(shape: Dict) -> Optional[List[Tuple[str, int]]]:
+    """Compound index keys for a shape by the equality, sort, range rule; None when no index helps"""
+    fields = _split_filter(shape["filter"])
+    if fields is None:
+        return None
+    equality, ranges = fields
+    keys = [(field, 1) for field in equality]
+    keys += [(field, -1 if direction == -1 else 1) for field, direction in shape["sort"].items() if field not in equality]
+    keys += [(field, 1) for field in ranges if field not in shape["sort"]]
+    return keys or None
+
+def _covered(keys: List[Tuple[str, int]], equality: List[str], index: Dict) -> bool:
+    """Whether an existing index serves keys: after dropping the fields its partial filter fixes,
+    keys must be its prefix, with any direction on equality fields and the sort consistently
+    forwards or backwards"""
+    partial = index.get("partialFilterExpression") or {}
+    if any(field not in equality for field in partial):
+        return False
+    wanted = [key for key in keys if key[0] not in partial]
+    existing = [(field, direction) for field, direction in index["key"] if isinstance(direction, (int, float))][:len(wanted)]
+    if [field for field, _ in existing] != [field for field, _ in wanted]:
+        return False
+    ordered = [(int(have), want) for (field, have), (_, want) in zip(existing, wanted) if field not in equality]
+    return all(have == want for have, want in ordered) or all(have == -want for have, want in ordered)
+
+def index_report(collection, recorder: QueryShapeRecorder, limit: int = 50) -> Dict:
+    """Query shapes for one collection ranked by total time, collection scans, index usage and recommendations"""
+    shapes = sorted(
+        (shape for shape in recorder.snapshot() if shape["collection"] == collection.name),
+        key=lambda shape: shape["total_ms"],
+        reverse=True
+    )
+    indexes = list(collection.index_information().items())
+    indexes = [{"name": name, **info} for name, info in indexes]
+
+    try:
+        usage = {
+            entry["name"]: {"ops": entry["accesses"]["ops"], "since": entry["accesses"]["since"]}
+            for entry in collection.aggregate([{"$indexStats": {}}])
+        }
+    except (PyMongoError, NotImplementedError):
+        usage = None
+
+    recommendations: Dict[tuple, Dict] = {}
+    for shape in shapes:
+        keys = recommend_index(shape)
+        if not keys:
+            continue
+        equality, _ = _split_filter(shape["filter"])
+        if any(_covered(keys, equality, index) for index in indexes):
+            continue
+        entry = recommendations.setdefault(tuple(keys), {
+            "keys": [list(key) for key in keys],
+            "name": "_".join(f"{field}_{direction}" for field, direction in keys),
+            "shapes": 0,
+            "count": 0,
+            "total_ms": 0.0,
+            "collection_scan": False
+        })
+        entry["shapes"] += 1
+        entry["count"] += shape["count"]
+        entry["total_ms"] = round(entry["total_ms"] + shape["total_ms"], 2)
+        entry["collection_scan"] = entry["collection_scan"] or bool((shape["plan"] or {}).get("collection_scan"))
+
+    # An index whose keys start with another recommendation's serves both
+    merged = []
+    for keys in sorted(recommendations, key=len, reverse=True):
+        wider = next((other for other in merged if tuple(other["keys"][:len(keys)]) == tuple(list(key) for key in keys)), None)
+        if wider:
+            for field in ("shapes", "count"):
+                wider[field] += recommendations[keys][field]
+            wider["total_ms"] = round(wider["total_ms"] + recommendations[keys]["total_ms"], 2)
+            wider["collection_scan"] = wider["collection_scan"] or recommendations[keys]["collection_scan"]
+        else:
+            merged.append(recommendations[keys])
+
+    return {
+        "collection": collection.name,
+        "tracked_shapes": len(shapes),
+        "dropped_shapes": recorder.dropped_shapes,
+        "shapes": shapes[:limit],
+        "collection_scans": [shape for shape in shapes if (shape["plan"] or {}).get("collection_scan")],
+        "indexes": [
+            {"name": index["name"], "key": index["key"], "partial": index.get("partialFilterExpression"), "usage": (usage or {}).get(index["name"])}
+            for index in indexes
+        ],
+        "index_usage_available": usage is not None,
+        "recommendations": sorted(merged, key=lambda entry: entry["total_ms"], reverse=True)
+    }
+
+class IndexBuilder:
+    """Builds indexes one after another in the background and keeps the outcome of each"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.builds: Dict[str, Dict] = {}
+        self._queue: List[Dict] = []
+        self._task = None
+
+    def build(self, specs: List[Dict]):
+        """Queue {"keys": [(field, direction)], "name": ..., **create_index options} specs"""
+        for spec in specs:
+            if self.builds.get(spec["name"], {}).get("state") in ("queued", "building", "built"):
+                continue
+            self.builds[spec["name"]] = {"keys": [list(key) for key in spec["keys"]], "state": "queued"}
+            self._queue.append(spec)
+        if self._queue and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while self._queue:
+            spec = self._queue.pop(0)
+            options = {key: value for key, value in spec.items() if key != "keys"}
+            status = self.builds[spec["name"]]
+            status.update(state="building", started_at=datetime.utcnow())
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.collection.create_index, [tuple(key) for key in spec["keys"]], background=True, **options)
+            except PyMongoError as e:
+                status.update(state="failed", error=str(e)[:200])
+                print(f"❌ Index build {spec['name']} failed: {e}")
+                continue
+            status.update(state="built", seconds=round(time.perf_counter() - started, 2))
+            print(f"🗂️ Built index {spec['name']} in {status['seconds']}s")
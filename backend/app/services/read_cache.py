@@ -0,0 +1,57 @@
+﻿import asyncio
+import time
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+class ReadCache:
+    """Single-flight computation with an optional short TTL per key.
+
+    Concurrent callers of the same key share one computation, which runs in a
+    worker thread so the blocking driver calls really do overlap. Results are
+    kept for ttl seconds unless invalidate() is called; a computation that was
+    already running when the cache was invalidated is not stored.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def invalidate(self, *_):
+        self.generation += 1
+        self._entries.clear()
+
+    async def get(self, key: Hashable, compute: Callable[[], Any], ttl: float = 0) -> Tuple[Any, bool]:
+        """Returns (value, computed) - computed is True only for the caller that ran compute"""
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1], False
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight), False
+
+        self.misses += 1
+        # A task of its own, so cancelling the caller that started it does not fail the others
+        task = asyncio.ensure_future(self._compute(key, compute, ttl))
+        # Nobody may be waiting; mark exceptions as retrieved so they aren't logged twice
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._inflight[key] = task
+        return await asyncio.shield(task), True
+
+    async def _compute(self, key: Hashable, compute: Callable[[], Any], ttl: float) -> Any:
+        generation = self.generation
+        try:
+            value = await asyncio.to_thread(compute)
+        finally:
+            del self._inflight[key]
+        if ttl > 0 and generation == self.generation:
+            self._entries[key] = (time.monotonic() + ttl, value)
+        return value
+
+    def metrics(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "entries": len(self._entries)}
@@ -0,0 +1,186 @@
+﻿import asyncio
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List
+from app.services.trash_purger import unlink_blobs, BLOB_PROJECTION
+
+REMOVAL_PROJECTION = {**BLOB_PROJECTION, "original_name": 1, "size": 1, "file_type": 1, "starred": 1, "trashed": 1, "folder_id": 1}
+
+class RetentionManager:
+    """Enforces per-file expiry and an optional global storage budget.
+
+    Expired files are removed outright. When stored bytes exceed the budget,
+    trashed files go first, then live unstarred files in least-recently
+    accessed order. Removal happens in batches with a pause in between, and
+    on_removed is awaited with each batch so callers can emit events.
+
+    Documents are deleted first, re-checking the condition they were picked
+    for, and only the blobs of documents actually deleted are unlinked.
+
+    The stored total is a running counter shared by all workers: uploads add
+    to it through record_upload() and removals here subtract from it. A
+    $group every stored_bytes_refresh_seconds corrects drift (e.g. trash
+    purges), and is also run before anything is evicted, so a figure that
+    is briefly too high never costs a file.
+    """
+
+    COUNTER_ID = "stored_bytes"
+
+    def __init__(self, files_collection, on_removed: Callable[[List[Dict], str], Awaitable[None]] = None,
+                 budget_bytes: int = 0, batch_size: int = 100, interval_seconds: float = 60,
+                 batch_pause_seconds: float = 0.5, cold_storage=None, stored_bytes_refresh_seconds: float = 600):
+        self.collection = files_collection
+        self.counters = files_collection.database.counters
+        self.on_removed = on_removed
+        self.budget_bytes = budget_bytes
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.batch_pause_seconds = batch_pause_seconds
+        self.cold_storage = cold_storage
+        self.stored_bytes_refresh_seconds = stored_bytes_refresh_seconds
+        self._stored_bytes_at = None
+        self.expired_total = 0
+        self.evicted_total = 0
+        self.evicted_bytes_total = 0
+        self._task = None
+
+    def ensure_indexes(self):
+        self.collection.create_index("expires_at", background=True)
+        self.collection.create_index(
+            [("last_accessed_at", 1)],
+            name="evictable_last_accessed_at",
+            partialFilterExpression={"trashed": False, "starred": False},
+            background=True
+        )
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def metrics(self) -> Dict:
+        return {
+            "budget_bytes": self.budget_bytes,
+            "stored_bytes": self.stored_bytes() if self.budget_bytes else None,
+            "expired_total": self.expired_total,
+            "evicted_total": self.evicted_total,
+            "evicted_bytes_total": self.evicted_bytes_total
+        }
+
+    async def _run(self):
+        while True:
+            try:
+                expired = await self.expire()
+                evicted = await self.enforce_budget()
+                if expired or evicted:
+                    print(f"♻️ Retention removed {expired} expired and {evicted} evicted files")
+            except Exception as e:
+                print(f"❌ Retention sweep failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def record_upload(self, size: int):
+        if self.budget_bytes:
+            self._adjust_stored_bytes(size)
+
+    def stored_bytes(self, refresh: bool = False) -> int:
+        if refresh or self._stored_bytes_at is None or time.monotonic() - self._stored_bytes_at > self.stored_bytes_refresh_seconds:
+            result = list(self.collection.aggregate([{"$group": {"_id": None, "total": {"$sum": "$size"}}}]))
+            total = result[0]["total"] if result else 0
+            # An upload counted between the $group and this $set is lost until the next correction
+            self.counters.update_one({"_id": self.COUNTER_ID}, {"$set": {"total": total}}, upsert=True)
+            self._stored_bytes_at = time.monotonic()
+            return total
+        counter = self.counters.find_one({"_id": self.COUNTER_ID})
+        return counter.get("total", 0) if counter else 0
+
+    def _adjust_stored_bytes(self, delta: int):
+        self.counters.update_one({"_id": self.COUNTER_ID}, {"$inc": {"total": delta}}, upsert=True)
+
+    async def expire(self) -> int:
+        removed = 0
+        while True:
+            now = datetime.utcnow()
+            batch = list(self.collection.find({"expires_at": {"$lte": now}}, REMOVAL_PROJECTION).limit(self.batch_size))
+            if not batch:
+                return removed
+
+            # The expiry may have been extended or cleared since the find
+            deleted = await self._remove(batch, "expired", {"expires_at": {"$lte": now}})
+            removed += len(deleted)
+            self.expired_total += len(deleted)
+            if len(batch) < self.batch_size:
+                return removed
+            await asyncio.sleep(self.batch_pause_seconds)
+
+    async def enforce_budget(self) -> int:
+        if not self.budget_bytes:
+            return 0
+
+        excess = self.stored_bytes() - self.budget_bytes
+        if excess > 0:
+            # Purges are not counted as they happen; confirm with an exact total before deleting anything
+            excess = self.stored_bytes(refresh=True) - self.budget_bytes
+        removed = 0
+        while excess > 0:
+            batch = self._eviction_candidates(excess)
+            if not batch:
+                print(f"⚠️ Storage budget exceeded by {excess} bytes but nothing is evictable")
+                return removed
+
+            # Restored or starred files are no longer evictable; trashed ones must still be in the trash
+            trashed = [doc for doc in batch if doc.get("trashed")]
+            live = [doc for doc in batch if not doc.get("trashed")]
+            deleted = await self._remove(trashed, "evicted", {"trashed": True}) if trashed else []
+            deleted += await self._remove(live, "evicted", {"trashed": False, "starred": False}) if live else []
+            if not deleted:
+                return removed
+            freed = sum(doc.get("size", 0) for doc in deleted)
+            removed += len(deleted)
+            self.evicted_total += len(deleted)
+            self.evicted_bytes_total += freed
+            excess -= freed
+            if excess > 0:
+                await asyncio.sleep(self.batch_pause_seconds)
+        return removed
+
+    def _eviction_candidates(self, excess: int) -> List[Dict]:
+        """Smallest prefix of the eviction order that frees excess bytes, capped at batch_size"""
+        cursors = [
+            self.collection.find({"trashed": True}, REMOVAL_PROJECTION).sort("deleted_at", 1),
+            self.collection.find({"trashed": False, "starred": False}, REMOVAL_PROJECTION).sort("last_accessed_at", 1)
+        ]
+        batch = []
+        for cursor in cursors:
+            for doc in cursor.limit(self.batch_size - len(batch)):
+                batch.append(doc)
+                excess -= doc.get("size", 0)
+                if excess <= 0 or len(batch) >= self.batch_size:
+                    return batch
+        return batch
+
+    async def _remove(self, docs: List[Dict], reason: str, guard: Dict) -> List[Dict]:
+        """Delete the documents still matching guard, then their blobs; returns those deleted"""
+        ids = [doc["_id"] for doc in docs]
+        result = self.collection.delete_many({"_id": {"$in": ids}, **guard})
+        if result.deleted_count == len(docs):
+            deleted = docs
+        else:
+            remaining = {doc["_id"] for doc in self.collection.find({"_id": {"$in": ids}}, {"_id": 1})}
+            deleted = [doc for doc in docs if doc["_id"] not in remaining]
+        if not deleted:
+            return []
+
+        if self.budget_bytes:
+            self._adjust_stored_bytes(-sum(doc.get("size", 0) for doc in deleted))
+        await asyncio.to_thread(unlink_blobs, deleted, self.cold_storage)
+        if self.on_removed:
+            await self.on_removed(deleted, reason)
+        return deleted
@@ -0,0 +1,129 @@
+﻿import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Dict, Optional
+
+LAG_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+class StallDetector:
+    """Measures event-loop lag and captures the stack that is blocking it.
+
+    A heartbeat task on the loop records how late each short sleep wakes up.
+    A watchdog thread notices when the heartbeat goes quiet for longer than the
+    threshold and snapshots the loop thread's stack while it is still blocked.
+    Stalls are attributed to a route by finding a route endpoint in that stack.
+    """
+
+    def __init__(self, threshold_ms: float = 100, interval_ms: float = 20, max_reports: int = 50):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.reports = deque(maxlen=max_reports)
+        self.histogram = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.route_stalls: Dict[str, Dict] = {}
+        self.max_lag_ms = 0.0
+        self.samples = 0
+        self._endpoints: Dict = {}
+        self._loop_thread_id = None
+        self._last_beat = time.monotonic()
+        self._pending: Optional[Dict] = None
+        self._running = False
+        self._task = None
+
+    def register_routes(self, app):
+        for route in app.routes:
+            endpoint = getattr(route, "endpoint", None)
+            code = getattr(endpoint, "__code__", None)
+            if code is not None:
+                self._endpoints[code] = getattr(route, "path", endpoint.__name__)
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watchdog, name="stall-watchdog", daemon=True).start()
+
+    async def stop(self):
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._last_beat = now
+            self._observe((now - before - self.interval) * 1000)
+
+    def _observe(self, lag_ms: float):
+        lag_ms = max(0.0, lag_ms)
+        self.samples += 1
+        self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+        for index, bound in enumerate(LAG_BUCKETS_MS):
+            if lag_ms <= bound:
+                self.histogram[index] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+        pending, self._pending = self._pending, None
+        if lag_ms < self.threshold * 1000:
+            return
+
+        report = pending or {"detected_at": datetime.utcnow(), "route": "unknown", "stack": []}
+        report["lag_ms"] = round(lag_ms, 1)
+        self.reports.append(report)
+        stats = self.route_stalls.setdefault(report["route"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stats["count"] += 1
+        stats["total_ms"] = round(stats["total_ms"] + lag_ms, 1)
+        stats["max_ms"] = max(stats["max_ms"], report["lag_ms"])
+
+    def _watchdog(self):
+        captured_beat = None
+        while self._running:
+            time.sleep(self.interval / 2)
+            beat = self._last_beat
+            if time.monotonic() - beat > self.threshold and captured_beat != beat:
+                # Snapshot once per stall, while the loop is still stuck in the offending call
+                captured_beat = beat
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    self._pending = self._describe(frame)
+
+    def _describe(self, frame) -> Dict:
+        stack = traceback.extract_stack(frame)
+        route = "background"
+        walker = frame
+        while walker is not None:
+            if walker.f_code in self._endpoints:
+                route = self._endpoints[walker.f_code]
+                break
+            walker = walker.f_back
+        return {
+            "detected_at": datetime.utcnow(),
+            "route": route,
+            "stack": [f"{entry.filename}:{entry.lineno} in {entry.name}" for entry in stack[-25:]]
+        }
+
+    def report(self, last: int = 10) -> Dict:
+        buckets = [f"<={bound}ms" for bound in LAG_BUCKETS_MS] + [f">{LAG_BUCKETS_MS[-1]}ms"]
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "samples": self.samples,
+            "max_lag_ms": round(self.max_lag_ms, 1),
+            "histogram": dict(zip(buckets, self.histogram)),
+            "routes": self.route_stalls,
+            "stalls": list(self.reports)[-last:][::-1]
+        }
@@ -0,0 +1,141 @@
+﻿import os
+import shutil
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+class StorageBackend:
+    """Blob store addressed by key; every method blocks, so call them through asyncio.to_thread.
+
+    Keys are the stored filename of a file document. open_stream is a
+    generator and can be handed straight to StreamingResponse.
+    """
+
+    name = "base"
+
+    def put(self, key: str, source: Path):
+        raise NotImplementedError
+
+    def fetch(self, key: str, destination: Path):
+        raise NotImplementedError
+
+    def open_stream(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Yield bytes start..end inclusive (end=None reads to the end)"""
+        raise NotImplementedError
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        return b"".join(self.open_stream(key, start, start + length - 1))
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def stat(self, key: str) -> Optional[Dict]:
+        """{"size", "modified"} or None when the key does not exist"""
+        raise NotImplementedError
+
+class LocalStorage(StorageBackend):
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key: str) -> Path:
+        # Keys never contain directories; strip them in case one comes from outside
+        return self.root / Path(key).name
+
+    def put(self, key: str, source: Path):
+        destination = self.path(key)
+        partial = destination.with_name(destination.name + ".part")
+        shutil.copyfile(source, partial)
+        os.replace(partial, destination)
+
+    def fetch(self, key: str, destination: Path):
+        partial = Path(destination).with_name(Path(destination).name + ".part")
+        shutil.copyfile(self.path(key), partial)
+        os.replace(partial, destination)
+
+    def open_stream(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        with open(self.path(key), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(STREAM_CHUNK_SIZE if remaining is None else min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def delete(self, key: str):
+        self.path(key).unlink(missing_ok=True)
+
+    def stat(self, key: str) -> Optional[Dict]:
+        try:
+            st = self.path(key).stat()
+        except FileNotFoundError:
+            return None
+        return {"size": st.st_size, "modified": st.st_mtime}
+
+class S3Storage(StorageBackend):
+    """Any S3-compatible object store; endpoint_url points it at MinIO, moto or another stand-in"""
+
+    name = "s3"
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str = None):
+        if boto3 is None:
+            raise RuntimeError("S3 storage needs boto3 - pip install boto3")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def put(self, key: str, source: Path):
+        # upload_file switches to multipart for large files on its own
+        self.client.upload_file(str(source), self.bucket, self._key(key))
+
+    def fetch(self, key: str, destination: Path):
+        partial = Path(destination).with_name(Path(destination).name + ".part")
+        self.client.download_file(self.bucket, self._key(key), str(partial))
+        os.replace(partial, destination)
+
+    def open_stream(self, key: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        extra = {}
+        if start or end is not None:
+            extra["Range"] = f"bytes={start}-{'' if end is None else end}"
+        body = self.client.get_object(Bucket=self.bucket, Key=self._key(key), **extra)["Body"]
+        try:
+            yield from body.iter_chunks(STREAM_CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def stat(self, key: str) -> Optional[Dict]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return {"size": head["ContentLength"], "modified": head["LastModified"].timestamp()}
+
+def open_backend(url: str, endpoint_url: str = None) -> StorageBackend:
+    """file:///srv/cold or a plain path for a local directory, s3://bucket/prefix for object storage"""
+    parsed = urlparse(url)
+    if parsed.scheme == "s3":
+        return S3Storage(parsed.netloc, parsed.path, endpoint_url=endpoint_url)
+    if parsed.scheme in ("", "file"):
+        return LocalStorage(Path(parsed.path if parsed.scheme else url))
+    raise ValueError(f"Unsupported storage URL: {url}")
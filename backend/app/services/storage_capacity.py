@@ -0,0 +1,75 @@
+﻿import errno
+import os
+import time
+from pathlib import Path
+from typing import Dict
+
+class StorageCapacity:
+    """Tracks free space under the upload directory plus bytes promised to in-flight uploads.
+
+    statvfs is cached for a few seconds; reservations are counted in memory so
+    concurrent uploads see each other before any of them has written a byte.
+    """
+
+    def __init__(self, path: Path, high_water_ratio: float = 0.9, cache_seconds: float = 5.0):
+        self.path = Path(path)
+        self.high_water_ratio = high_water_ratio
+        self.cache_seconds = cache_seconds
+        self.reserved = 0
+        self.in_flight = 0
+        self.rejected = 0
+        self._stat = None
+        self._stat_time = 0.0
+
+    def _disk(self):
+        now = time.monotonic()
+        if self._stat is None or now - self._stat_time > self.cache_seconds:
+            st = os.statvfs(self.path)
+            total = st.f_blocks * st.f_frsize
+            free = st.f_bavail * st.f_frsize
+            self._stat = (total, free)
+            self._stat_time = now
+        return self._stat
+
+    def invalidate(self):
+        self._stat = None
+
+    def try_reserve(self, nbytes: int) -> bool:
+        total, free = self._disk()
+        used = total - free
+        if used + self.reserved + nbytes > total * self.high_water_ratio:
+            self.rejected += 1
+            return False
+        self.reserved += nbytes
+        self.in_flight += 1
+        return True
+
+    def release(self, nbytes: int):
+        self.reserved = max(0, self.reserved - nbytes)
+        self.in_flight = max(0, self.in_flight - 1)
+        # The upload has now hit the disk (or failed), so the cached figure is stale
+        self.invalidate()
+
+    def snapshot(self) -> Dict:
+        total, free = self._disk()
+        used = total - free
+        return {
+            "total_bytes": total,
+            "used_bytes": used,
+            "free_bytes": free,
+            "reserved_bytes": self.reserved,
+            "in_flight_uploads": self.in_flight,
+            "high_water_bytes": int(total * self.high_water_ratio),
+            "available_for_uploads": max(0, int(total * self.high_water_ratio) - used - self.reserved),
+            "rejected_uploads": self.rejected
+        }
+
+def preallocate(fd: int, size: int):
+    """Reserve size bytes for a file up front so it is laid out contiguously"""
+    if size > 0 and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError as e:
+            # Not supported on every filesystem; the plain write still works there
+            if e.errno == errno.ENOSPC:
+                raise
@@ -0,0 +1,221 @@
+﻿import asyncio
+import threading
+import weakref
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator
+from app.services.storage import LocalStorage, StorageBackend
+
+HOT = "hot"
+COLD = "cold"
+
+class ColdStream:
+    """Chunks of one cold read; release runs once, when the stream is exhausted, closed or collected"""
+
+    def __init__(self, chunks: Iterator[bytes], release: Callable[[], None]):
+        self._chunks = chunks
+        # Also covers a stream dropped before its first chunk, whose generator never runs a finally
+        self._release = weakref.finalize(self, release)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        try:
+            return next(self._chunks)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        self._chunks.close()
+        self._release()
+
+class TieringManager:
+    """Moves files nobody has downloaded for a while to the cold backend, and back on access.
+
+    A demotion uploads the blob, flips storage_tier with a guard on
+    last_accessed_at, and only then removes the local copy, so a download
+    that lands mid-move keeps the file hot. Promotions are single-flight per
+    file. The tier is internal bookkeeping and does not bump change versions.
+
+    Cold reads go through open_stream, which counts readers per key; a
+    promotion that finishes while one is still streaming leaves the cold copy
+    for the last reader to delete.
+    """
+
+    def __init__(self, files_collection, hot: LocalStorage, cold: StorageBackend, cold_after_days: float = 30,
+                 batch_size: int = 50, interval_seconds: float = 3600, batch_pause_seconds: float = 0.5):
+        self.collection = files_collection
+        self.hot = hot
+        self.cold = cold
+        self.cold_after_days = cold_after_days
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.batch_pause_seconds = batch_pause_seconds
+        self.demoted_total = 0
+        self.demoted_bytes_total = 0
+        self.promoted_total = 0
+        self.cold_reads = 0
+        self._promotions: Dict[str, asyncio.Task] = {}
+        self._readers: Dict[str, int] = {}
+        self._pending_deletes = set()
+        # Readers are released from threadpool threads as their streams end
+        self._readers_lock = threading.Lock()
+        self._task = None
+
+    def ensure_indexes(self):
+        self.collection.create_index(
+            [("storage_tier", 1), ("last_accessed_at", 1)],
+            name="tier_last_accessed_at",
+            partialFilterExpression={"trashed": False},
+            background=True
+        )
+        # Files from before access tracking would never look idle; treat their upload as the last access
+        self.collection.update_many(
+            {"last_accessed_at": {"$exists": False}},
+            [{"$set": {"last_accessed_at": "$upload_date"}}]
+        )
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                demoted = await self.demote_idle()
+                if demoted:
+                    print(f"🧊 Moved {demoted} idle files to {self.cold.name} storage")
+            except Exception as e:
+                print(f"❌ Tiering sweep failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def _idle_query(self, cutoff: datetime) -> Dict:
+        # Files from before tiering existed have no storage_tier and count as hot
+        return {"trashed": False, "storage_tier": {"$in": [None, HOT]}, "last_accessed_at": {"$lt": cutoff}}
+
+    async def demote_idle(self) -> int:
+        cutoff = datetime.utcnow() - timedelta(days=self.cold_after_days)
+        demoted = 0
+        skipped = []
+        while True:
+            batch = list(self.collection.find(
+                {**self._idle_query(cutoff), "_id": {"$nin": skipped}},
+                {"filename": 1, "size": 1}
+            ).sort("last_accessed_at", 1).limit(self.batch_size))
+            if not batch:
+                return demoted
+
+            for doc in batch:
+                if await self.demote(doc, cutoff):
+                    demoted += 1
+                else:
+                    skipped.append(doc["_id"])
+
+            if len(batch) < self.batch_size:
+                return demoted
+            await asyncio.sleep(self.batch_pause_seconds)
+
+    async def demote(self, doc: Dict, cutoff: datetime) -> bool:
+        key = doc["filename"]
+        if self.hot.stat(key) is None:
+            # Missing blobs are the integrity scrubber's business
+            return False
+
+        await asyncio.to_thread(self.cold.put, key, self.hot.path(key))
+        result = self.collection.update_one(
+            {"_id": doc["_id"], **self._idle_query(cutoff)},
+            {"$set": {"storage_tier": COLD, "tiered_at": datetime.utcnow()}}
+        )
+        if not result.modified_count:
+            # Downloaded or deleted while uploading - the local copy stays authoritative
+            await asyncio.to_thread(self.cold.delete, key)
+            return False
+
+        await asyncio.to_thread(self.hot.delete, key)
+        self.demoted_total += 1
+        self.demoted_bytes_total += doc.get("size", 0)
+        return True
+
+    async def promote(self, doc: Dict):
+        """Bring a cold file back to local disk; concurrent callers share one transfer"""
+        await asyncio.shield(self._promotion(doc))
+
+    def schedule_promotion(self, doc: Dict):
+        """Promote in the background, e.g. while the current request streams from cold storage"""
+        self._promotion(doc)
+
+    def _promotion(self, doc: Dict) -> asyncio.Task:
+        file_id = str(doc["_id"])
+        task = self._promotions.get(file_id)
+        if task is None:
+            task = self._promotions[file_id] = asyncio.create_task(self._promote(doc))
+            task.add_done_callback(lambda done: self._promotion_done(file_id, done))
+        return task
+
+    def _promotion_done(self, file_id: str, task: asyncio.Task):
+        self._promotions.pop(file_id, None)
+        if not task.cancelled() and task.exception():
+            print(f"❌ Promoting {file_id} from {self.cold.name} storage failed: {task.exception()}")
+
+    async def _promote(self, doc: Dict):
+        key = doc["filename"]
+        await asyncio.to_thread(self.cold.fetch, key, self.hot.path(key))
+        result = self.collection.update_one(
+            {"_id": doc["_id"], "storage_tier": COLD},
+            {"$set": {"storage_tier": HOT, "tiered_at": datetime.utcnow()}}
+        )
+        if result.modified_count:
+            self.promoted_total += 1
+            with self._readers_lock:
+                if self._readers.get(key):
+                    # A cold stream is still reading it; the last one to finish deletes it
+                    self._pending_deletes.add(key)
+                    return
+            await asyncio.to_thread(self.cold.delete, key)
+
+    def open_stream(self, key: str) -> Iterator[bytes]:
+        """Stream a blob from the cold backend; a promotion meanwhile keeps the cold copy until it ends"""
+        with self._readers_lock:
+            self._readers[key] = self._readers.get(key, 0) + 1
+        return ColdStream(self.cold.open_stream(key), lambda: self._release(key))
+
+    def _release(self, key: str):
+        with self._readers_lock:
+            self._readers[key] -= 1
+            if self._readers[key]:
+                return
+            del self._readers[key]
+            if key not in self._pending_deletes:
+                return
+            self._pending_deletes.discard(key)
+        try:
+            self.cold.delete(key)
+        except Exception as e:
+            print(f"❌ Removing promoted {key} from {self.cold.name} storage failed: {e}")
+
+    def metrics(self) -> Dict:
+        files_by_tier = {HOT: 0, COLD: 0}
+        for entry in self.collection.aggregate([
+            {"$match": {"trashed": False}},
+            {"$group": {"_id": "$storage_tier", "count": {"$sum": 1}}}
+        ]):
+            files_by_tier[entry["_id"] or HOT] += entry["count"]
+        return {
+            "cold_backend": self.cold.name,
+            "cold_after_days": self.cold_after_days,
+            "files_by_tier": files_by_tier,
+            "demoted_total": self.demoted_total,
+            "demoted_bytes_total": self.demoted_bytes_total,
+            "promoted_total": self.promoted_total,
+            "cold_reads": self.cold_reads
+        }
@@ -0,0 +1,89 @@
+﻿import json
+import time
+from pathlib import Path
+from typing import Dict, Iterator
+
+class TrafficLog:
+    """Append-only NDJSON log of request metadata; stops recording once max_bytes is reached"""
+
+    FLUSH_SECONDS = 1.0
+
+    def __init__(self, path: Path, max_bytes: int = 100 * 1024 * 1024):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._size = self.path.stat().st_size
+        self._last_flush = time.monotonic()
+        self.recorded = 0
+        self.dropped = 0
+
+    def write(self, record: Dict):
+        if self._file is None or self._size >= self.max_bytes:
+            self.dropped += 1
+            return
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        # Buffered, so this only reaches the disk every few kilobytes or once a second
+        self._file.write(line)
+        self._size += len(line)
+        self.recorded += 1
+        if time.monotonic() - self._last_flush > self.FLUSH_SECONDS:
+            self._file.flush()
+            self._last_flush = time.monotonic()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def read_traffic_log(path: Path) -> Iterator[Dict]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+class TrafficCaptureMiddleware:
+    """ASGI middleware that records what each HTTP request looked like, never what it carried.
+
+    One line per request: wall-clock start, method, route template, concrete
+    path, query string, status, request and response byte counts, and duration.
+    Bodies and headers are not recorded.
+    """
+
+    def __init__(self, app, log: TrafficLog):
+        self.app = app
+        self.log = log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response = {"status": None, "bytes": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            headers = dict(scope.get("headers") or [])
+            # The router stores the matched route in the scope, which gives "/api/files/{file_id}/download"
+            route = scope.get("route")
+            self.log.write({
+                "ts": round(started_at, 4),
+                "method": scope["method"],
+                "route": getattr(route, "path", None),
+                "path": scope["path"],
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                "status": response["status"],
+                "req_bytes": int(headers.get(b"content-length", 0) or 0),
+                "resp_bytes": response["bytes"],
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2)
+            })
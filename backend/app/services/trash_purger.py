@@ -0,0 +1,83 @@
+﻿import asyncio
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List
+
+# Enough of a file document to find its blob in either storage tier
+BLOB_PROJECTION = {"file_path": 1, "filename": 1, "storage_tier": 1}
+
+def unlink_blobs(docs: List[Dict], cold_storage=None):
+    """Blocking - call through asyncio.to_thread"""
+    for doc in docs:
+        try:
+            if doc.get("storage_tier") == "cold" and cold_storage is not None:
+                cold_storage.delete(doc["filename"])
+            elif doc.get("file_path"):
+                Path(doc["file_path"]).unlink(missing_ok=True)
+        except Exception as e:
+            print(f"❌ Could not remove {doc.get('filename')}: {e}")
+
+class TrashPurger:
+    """Background task that hard-deletes trashed files after the retention period.
+
+    Work is done in small batches with a pause in between so a large cleanup
+    never monopolises the event loop or the disk; blob unlinks run in a thread.
+    """
+
+    def __init__(self, files_collection, retention_days: int = 30, batch_size: int = 200,
+                 interval_seconds: float = 300, batch_pause_seconds: float = 0.5, on_cycle=None,
+                 cold_storage=None):
+        self.collection = files_collection
+        self.retention = timedelta(days=retention_days)
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.batch_pause_seconds = batch_pause_seconds
+        self.on_cycle = on_cycle
+        self.cold_storage = cold_storage
+        self.purged_total = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                purged = await self.purge_expired()
+                if purged:
+                    print(f"🗑️ Purged {purged} trashed files")
+                if self.on_cycle:
+                    self.on_cycle()
+            except Exception as e:
+                print(f"❌ Trash purge failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def purge_expired(self) -> int:
+        cutoff = datetime.utcnow() - self.retention
+        purged = 0
+        while True:
+            batch = list(self.collection.find(
+                {"trashed": True, "deleted_at": {"$lt": cutoff}},
+                BLOB_PROJECTION
+            ).limit(self.batch_size))
+            if not batch:
+                return purged
+
+            await asyncio.to_thread(unlink_blobs, batch, self.cold_storage)
+            result = self.collection.delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}, "trashed": True})
+            purged += result.deleted_count
+            self.purged_total += result.deleted_count
+
+            if len(batch) < self.batch_size:
+                return purged
+            await asyncio.sleep(self.batch_pause_seconds)
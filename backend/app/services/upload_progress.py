@@ -0,0 +1,179 @@
+﻿import asyncio
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+class Transfer:
+    """One request body being received, with its progress and a smoothed receive rate"""
+
+    __slots__ = ("upload_id", "path", "client", "total", "received", "started", "started_at",
+                 "last_chunk", "rate", "_last_emit", "_emitted_bytes")
+
+    def __init__(self, upload_id: str, path: str, client: Optional[str], total: Optional[int]):
+        now = time.monotonic()
+        self.upload_id = upload_id
+        self.path = path
+        self.client = client
+        self.total = total
+        self.received = 0
+        self.started = now
+        self.started_at = datetime.utcnow()
+        self.last_chunk = now
+        self.rate = 0.0
+        self._last_emit = now
+        self._emitted_bytes = 0
+
+    def describe(self, state: str = "receiving") -> Dict:
+        now = time.monotonic()
+        elapsed = now - self.started
+        remaining = self.total - self.received if self.total else None
+        return {
+            "upload_id": self.upload_id,
+            "state": state,
+            "path": self.path,
+            "bytes_received": self.received,
+            "bytes_total": self.total,
+            "percent": round(100 * self.received / self.total, 1) if self.total else None,
+            "rate_bytes_per_sec": round(self.rate),
+            "average_bytes_per_sec": round(self.received / elapsed) if elapsed > 0 else 0,
+            "eta_seconds": round(remaining / self.rate, 1) if remaining and self.rate > 0 else None,
+            "elapsed_seconds": round(elapsed, 2),
+            "idle_seconds": round(now - self.last_chunk, 2),
+            "started_at": self.started_at.isoformat() + "Z"
+        }
+
+class UploadTracker:
+    """In-flight request bodies and their throughput, published as throttled progress events.
+
+    The rate is an exponential moving average over the intervals between
+    events, so one slow chunk does not swing the ETA. Events go out at most
+    once per interval per upload plus once when the upload ends. They are
+    queued and published in order by a background task, so a slow
+    subscriber never holds up the request body. Events carry no client
+    address; only snapshot(include_clients=True) adds it.
+    """
+
+    def __init__(self, publish: Callable[[Dict], Awaitable[None]], interval_seconds: float = 0.25, smoothing: float = 0.3,
+                 max_pending: int = 1000):
+        self.publish = publish
+        self.interval = interval_seconds
+        self.smoothing = smoothing
+        self.transfers: Dict[str, Transfer] = {}
+        self.completed = 0
+        self.failed = 0
+        self.bytes_received = 0
+        # Oldest events are dropped first if subscribers fall this far behind
+        self._pending = deque(maxlen=max_pending)
+        self._sender = None
+
+    def begin(self, upload_id: str, path: str, client: Optional[str], total: Optional[int]) -> Transfer:
+        if upload_id in self.transfers:
+            # Client-chosen ids can collide; the second upload gets a fresh one
+            upload_id = uuid.uuid4().hex
+        transfer = Transfer(upload_id, path, client, total)
+        self.transfers[upload_id] = transfer
+        return transfer
+
+    def received(self, transfer: Transfer, size: int):
+        transfer.received += size
+        transfer.last_chunk = time.monotonic()
+        self.bytes_received += size
+        elapsed = transfer.last_chunk - transfer._last_emit
+        if elapsed >= self.interval:
+            window_rate = (transfer.received - transfer._emitted_bytes) / elapsed
+            transfer.rate = window_rate if not transfer.rate else self.smoothing * window_rate + (1 - self.smoothing) * transfer.rate
+            transfer._last_emit = transfer.last_chunk
+            transfer._emitted_bytes = transfer.received
+            self._emit(transfer.describe())
+
+    def finish(self, transfer: Transfer, status: Optional[int]):
+        if self.transfers.pop(transfer.upload_id, None) is None:
+            return
+        succeeded = status is not None and status < 400
+        if succeeded:
+            self.completed += 1
+        else:
+            self.failed += 1
+        event = transfer.describe("completed" if succeeded else "failed")
+        event["status"] = status
+        self._emit(event)
+
+    def _emit(self, event: Dict):
+        self._pending.append(event)
+        if self._sender is None or self._sender.done():
+            self._sender = asyncio.create_task(self._send_pending())
+
+    async def _send_pending(self):
+        while self._pending:
+            event = self._pending.popleft()
+            try:
+                await self.publish(event)
+            except Exception as e:
+                # Progress is best-effort; it must never fail the upload itself
+                print(f"❌ Upload progress event failed: {e}")
+
+    def snapshot(self, include_clients: bool = False) -> Dict:
+        transfers = [
+            {**transfer.describe(), "client": transfer.client} if include_clients else transfer.describe()
+            for transfer in self.transfers.values()
+        ]
+        return {
+            "in_flight": len(transfers),
+            "receiving_bytes_per_sec": sum(transfer["rate_bytes_per_sec"] for transfer in transfers),
+            "completed": self.completed,
+            "failed": self.failed,
+            "bytes_received": self.bytes_received,
+            # Stalled (longest idle) first, so stuck uploads top the list
+            "transfers": sorted(transfers, key=lambda transfer: transfer["idle_seconds"], reverse=True)
+        }
+
+class UploadProgressMiddleware:
+    """ASGI middleware that counts request body bytes as they arrive for the given paths.
+
+    It sits below the multipart parser, so progress reflects the network even
+    though the endpoint only runs once the whole body is in. The upload id comes
+    from an X-Upload-Id request header when the client sets one, and is
+    returned in the X-Upload-Id response header either way.
+    """
+
+    def __init__(self, app, tracker: UploadTracker, paths: List[str]):
+        self.app = app
+        self.tracker = tracker
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        upload_id = headers.get(b"x-upload-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        length = headers.get(b"content-length", b"")
+        client = scope.get("client")
+        transfer = self.tracker.begin(
+            upload_id,
+            scope["path"],
+            client[0] if client else None,
+            int(length) if length.isdigit() else None
+        )
+        status = None
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                self.tracker.received(transfer, len(message.get("body", b"")))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-upload-id", transfer.upload_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            self.tracker.finish(transfer, status)
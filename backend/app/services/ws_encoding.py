@@ -0,0 +1,54 @@
+﻿from datetime import datetime
+from bson import ObjectId
+from typing import Dict, Union
+from app.services.file_encoder import dumps
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# File document keys are sent as small integers in binary frames; clients get this table in the hello message
+FILE_FIELDS = [
+    "id", "original_name", "filename", "file_path", "mime_type", "file_type", "size", "sha256",
+    "upload_date", "last_accessed_at", "expires_at", "starred", "download_count", "trashed",
+    "deleted_at", "version", "reason", "integrity_status", "integrity_checked_at", "folder_id"
+]
+FILE_FIELD_CODES = {name: code for code, name in enumerate(FILE_FIELDS)}
+
+def negotiate_encoding(requested: str = None) -> str:
+    if requested == "msgpack" and msgpack is not None:
+        return "msgpack"
+    return "json"
+
+def _msgpack_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+def _intern_file_keys(file_data: Dict) -> Dict:
+    return {FILE_FIELD_CODES.get(key, key): value for key, value in file_data.items()}
+
+def encode(message: Dict, encoding: str) -> Union[str, bytes]:
+    if encoding == "msgpack":
+        if isinstance(message.get("file"), dict):
+            message = {**message, "file": _intern_file_keys(message["file"])}
+        return msgpack.packb(message, default=_msgpack_default, use_bin_type=True)
+    return dumps(message)
+
+class EncodedMessage:
+    """A message encoded at most once per wire format, shared by every subscriber"""
+
+    __slots__ = ("message", "_frames")
+
+    def __init__(self, message: Dict):
+        self.message = message
+        self._frames = {}
+
+    def frame(self, encoding: str) -> Union[str, bytes]:
+        frame = self._frames.get(encoding)
+        if frame is None:
+            frame = self._frames[encoding] = encode(self.message, encoding)
+        return frame
@@ -0,0 +1,176 @@
+﻿"""Replay a captured traffic log and report latency percentiles per route.
+
+Capture with TRAFFIC_CAPTURE_FILE=traffic.ndjson on the instance whose
+workload you want, then re-drive it at 1x or accelerated speed:
+
+    python -m benchmarks.replay_traffic traffic.ndjson [--speed 4] [--target http://localhost:8000]
+
+Without --target the app is started in-process on a temporary upload
+directory with mongomock as the database, so nothing real is touched.
+Every file id the log refers to is seeded first with synthetic contents of
+the recorded size; uploads in the log send synthetic bodies of the recorded
+length. Needs httpx (and mongomock for the in-process instance).
+"""
+import argparse
+import asyncio
+import io
+import os
+import tempfile
+import time
+import zipfile
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from app.services.traffic_capture import read_traffic_log
+
+DEFAULT_SEED_SIZE = 4096
+MULTIPART_OVERHEAD = 256
+
+def file_id_of(record: Dict) -> Optional[str]:
+    route, path = record.get("route") or "", record["path"]
+    for template, segment in zip(route.split("/"), path.split("/")):
+        if template == "{file_id}":
+            return segment
+    return None
+
+def plan_seed_files(records: List[Dict]) -> Dict[str, Dict]:
+    """Size and shape of every file the log refers to, from what its responses looked like"""
+    files: Dict[str, Dict] = {}
+    for record in records:
+        file_id = file_id_of(record)
+        if not file_id:
+            continue
+        seed = files.setdefault(file_id, {"size": 0, "members": {}})
+        if record["route"].endswith("/download"):
+            seed["size"] = max(seed["size"], record["resp_bytes"])
+        elif "{member:path}" in record["route"]:
+            member = record["path"].split("/archive/", 1)[1]
+            seed["members"][member] = max(seed["members"].get(member, 0), record["resp_bytes"])
+    return files
+
+def synthetic_content(seed: Dict) -> Tuple[str, bytes]:
+    if seed["members"]:
+        # Archive routes were used on this file, so seed an archive with the members that were read
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for member, size in seed["members"].items():
+                archive.writestr(member, os.urandom(size))
+        return "seed.zip", buffer.getvalue()
+    return "seed.bin", os.urandom(seed["size"] or DEFAULT_SEED_SIZE)
+
+def in_process_app(workdir: Path, admin_token: Optional[str] = None):
+    """The real app on a scratch directory, with mongomock standing in for MongoDB"""
+    import mongomock
+    os.environ.pop("TRAFFIC_CAPTURE_FILE", None)
+    if admin_token:
+        # Admin endpoints are closed without a configured token
+        os.environ["ADMIN_TOKEN"] = admin_token
+    os.environ["MONGODB_URI"] = "mongodb://replay-stand-in"
+    os.chdir(workdir)
+    import main
+    main.MongoClient = lambda *args, **kwargs: mongomock.MongoClient()
+    if not main.initialize_database():
+        raise RuntimeError("Could not start the in-process instance")
+    return main.app
+
+async def seed_files(client, files: Dict[str, Dict]) -> Dict[str, str]:
+    id_map = {}
+    for old_id, seed in files.items():
+        name, content = synthetic_content(seed)
+        response = await client.post("/api/upload", files={"file": (name, content, "application/octet-stream")})
+        response.raise_for_status()
+        id_map[old_id] = response.json()["id"]
+    return id_map
+
+async def issue(client, record: Dict, id_map: Dict[str, str], results: Dict, semaphore: asyncio.Semaphore):
+    path = record["path"]
+    file_id = file_id_of(record)
+    if file_id in id_map:
+        path = path.replace(file_id, id_map[file_id], 1)
+    url = path + ("?" + record["query"] if record["query"] else "")
+
+    kwargs = {}
+    if record["route"] == "/api/upload":
+        body = os.urandom(max(0, record["req_bytes"] - MULTIPART_OVERHEAD))
+        kwargs["files"] = {"file": ("replay.bin", body, "application/octet-stream")}
+    elif record["method"] in ("PATCH", "PUT") and record["req_bytes"]:
+        # Bodies are not captured; an empty JSON object keeps every field at its default
+        kwargs["json"] = {}
+
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            response = await client.request(record["method"], url, **kwargs)
+            status = response.status_code
+        except Exception:
+            status = "error"
+        elapsed = (time.perf_counter() - started) * 1000
+
+    stats = results[f"{record['method']} {record['route'] or record['path']}"]
+    stats["replayed_ms"].append(elapsed)
+    stats["captured_ms"].append(record["duration_ms"])
+    stats["statuses"][status] += 1
+
+async def replay(records: List[Dict], client, speed: float, concurrency: int) -> Dict:
+    id_map = await seed_files(client, plan_seed_files(records))
+    results = defaultdict(lambda: {"replayed_ms": [], "captured_ms": [], "statuses": defaultdict(int)})
+    semaphore = asyncio.Semaphore(concurrency)
+    origin = records[0]["ts"]
+    started = time.perf_counter()
+    tasks = []
+    for record in records:
+        if speed > 0:
+            delay = (record["ts"] - origin) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(issue(client, record, id_map, results, semaphore)))
+    await asyncio.gather(*tasks)
+    return results
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def report(results: Dict):
+    print(f"{'route':<48} {'n':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'cap p50':>8}  statuses")
+    for route in sorted(results, key=lambda r: -len(results[r]["replayed_ms"])):
+        stats = results[route]
+        latencies = stats["replayed_ms"]
+        print(
+            f"{route[:48]:<48} {len(latencies):>6} "
+            f"{percentile(latencies, 0.5):>8.1f} {percentile(latencies, 0.9):>8.1f} "
+            f"{percentile(latencies, 0.99):>8.1f} {max(latencies):>8.1f} "
+            f"{percentile(stats['captured_ms'], 0.5):>8.1f}  {dict(stats['statuses'])}"
+        )
+
+async def main_async(args):
+    import httpx
+    records = sorted(read_traffic_log(args.log), key=lambda record: record["ts"])
+    if not records:
+        print("Traffic log is empty")
+        return
+
+    headers = {"X-Admin-Token": args.admin_token} if args.admin_token else {}
+    if args.target:
+        client = httpx.AsyncClient(base_url=args.target, headers=headers, timeout=60)
+    else:
+        workdir = Path(tempfile.mkdtemp(prefix="replay-"))
+        app = in_process_app(workdir, args.admin_token)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://replay", headers=headers)
+
+    async with client:
+        started = time.perf_counter()
+        results = await replay(records, client, args.speed, args.concurrency)
+        elapsed = time.perf_counter() - started
+    pace = f"{args.speed:g}x speed" if args.speed > 0 else "maximum speed"
+    print(f"Replayed {len(records)} requests in {elapsed:.1f}s at {pace} (latencies in ms)")
+    report(results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log", type=Path, help="NDJSON written by TRAFFIC_CAPTURE_FILE")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = recorded pace, 4 = four times faster, 0 = as fast as possible")
+    parser.add_argument("--target", help="Base URL of a running test instance; default is an in-process instance")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--admin-token", help="Sent as X-Admin-Token so captured admin requests replay too")
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,75 @@
+﻿"""WebSocket framing benchmark: bytes and CPU per event.
+
+Compares the original per-broadcast json.dumps frames with compact JSON and
+interned MessagePack, each with and without permessage-deflate (raw deflate,
+as negotiated by the server), and shows the cost of encoding per send versus
+once per event for a number of subscribers.
+
+    python -m benchmarks.ws_framing_benchmark [subscribers]
+"""
+import json
+import sys
+import time
+import zlib
+from datetime import datetime
+import bson
+from app.services.ws_encoding import EncodedMessage, encode, msgpack
+
+ROUNDS = 200
+
+def sample_event():
+    return {
+        "type": "file_uploaded",
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "version": 48213,
+        "file": {
+            "id": str(bson.ObjectId()),
+            "original_name": "quarterly-report-final.pdf",
+            "filename": "4f1c2d0e9b8a4c7d8e6f5a4b3c2d1e0f.pdf",
+            "file_path": "uploads/4f1c2d0e9b8a4c7d8e6f5a4b3c2d1e0f.pdf",
+            "mime_type": "application/pdf",
+            "file_type": "document",
+            "size": 1843221,
+            "sha256": "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08",
+            "upload_date": datetime.utcnow(),
+            "last_accessed_at": datetime.utcnow(),
+            "expires_at": None,
+            "starred": False,
+            "download_count": 0,
+            "trashed": False,
+            "deleted_at": None,
+            "version": 48213
+        }
+    }
+
+def deflate(frame) -> bytes:
+    data = frame.encode("utf-8") if isinstance(frame, str) else frame
+    compressor = zlib.compressobj(wbits=-15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+def per_event_us(fn) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        fn()
+    return (time.perf_counter() - start) / ROUNDS * 1_000_000
+
+def main():
+    subscribers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    event = sample_event()
+    formats = {"json (original)": lambda: json.dumps(event, default=str), "json (compact)": lambda: encode(event, "json")}
+    if msgpack is not None:
+        formats["msgpack (interned)"] = lambda: encode(event, "msgpack")
+
+    print(f"{'format':<20}{'bytes':>8}{'deflated':>10}{'encode us':>11}{'+deflate us':>13}")
+    for name, fn in formats.items():
+        frame = fn()
+        size = len(frame.encode("utf-8") if isinstance(frame, str) else frame)
+        print(f"{name:<20}{size:>8}{len(deflate(frame)):>10}{per_event_us(fn):>11.1f}{per_event_us(lambda: deflate(fn())):>13.1f}")
+
+    encoding = "msgpack" if msgpack is not None else "json"
+    per_send = per_event_us(lambda: [encode(event, encoding) for _ in range(subscribers)]) / 1000
+    shared = per_event_us(lambda: [EncodedMessage(event).frame(encoding)] * subscribers) / 1000
+    print(f"\n{subscribers} subscribers, {encoding}: encode per send {per_send:.2f} ms/event, encode once {shared:.3f} ms/event")
+
+if __name__ == "__main__":
+    main()
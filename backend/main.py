@@ -1,19 +1,49 @@
-﻿from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, WebSocket, WebSocketDisconnect
+﻿from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, WebSocket, WebSocketDisconnect, Request, Query, Header, Depends, Form, Body
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+from fastapi.responses import FileResponse, Response, StreamingResponse, JSONResponse, RedirectResponse
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError, WriteConcernError
 import os
 from dotenv import load_dotenv
 from bson import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
+import hashlib
+import hmac
 import shutil
+import mimetypes
+import tarfile
+import zipfile
+from urllib.parse import quote
 from pathlib import Path
 import asyncio
-import json
-from typing import List, Dict
+from typing import List, Dict, Optional
 import time
+from app.services.file_encoder import dumps, encode_file_document, encode_file_list, iter_ndjson, prepare_file_document, wants_ndjson, NDJSON_MEDIA_TYPE
+from app.services.change_tracker import ChangeTracker
+from app.services.trash_purger import TrashPurger
+from app.services.batch_loader import BatchLoader
+from app.services.storage_capacity import StorageCapacity, preallocate
+from app.services.integrity_scrubber import IntegrityScrubber, CHECKSUM_ALGORITHM
+from app.services.retention import RetentionManager
+from app.services.analytics import AnalyticsRecorder, GRANULARITIES, METRICS
+from app.services.connection_manager import ConnectionManager
+from app.services.ws_encoding import negotiate_encoding
+from app.services.stall_detector import StallDetector
+from app.services.read_cache import ReadCache
+from app.services.profiler import ProfileStore, ProfilingMiddleware
+from app.services.hot_cache import HotFileCache
+from app.services.traffic_capture import TrafficLog, TrafficCaptureMiddleware
+from app.services.upload_progress import UploadTracker, UploadProgressMiddleware
+from app.services.storage import LocalStorage, open_backend, STREAM_CHUNK_SIZE
+from app.services.tiering import TieringManager, COLD
+from app.services.folders import FolderTree, FolderError, FolderNotFound, FolderConflict
+from app.services.signed_urls import UrlSigner, AccessRecorder
+from app.services.insert_batcher import InsertBatcher, parse_write_concern
+from app.services.archive_reader import build_index, find_entry, iter_member, UnsupportedArchive
+from app.services.query_advisor import QueryShapeRecorder, ExplainSampler, IndexBuilder, index_report
+from app.services import image_similarity
+from app.services.image_similarity import HashIndex, PerceptualHasher
 
 # Load environment variables FIRST
 env_path = Path(".env")
@@ -45,7 +75,148 @@ app = FastAPI(
     version="2.0.0"
 )
 
-# CORS middleware
+# Configuration
+UPLOAD_DIR = Path("uploads")
+MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+LISTING_BATCH_SIZE = int(os.getenv("LISTING_BATCH_SIZE", "500"))
+TOMBSTONE_RETENTION_DAYS = int(os.getenv("TOMBSTONE_RETENTION_DAYS", "7"))
+TRASH_RETENTION_DAYS = int(os.getenv("TRASH_RETENTION_DAYS", "30"))
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "200"))
+PURGE_INTERVAL_SECONDS = float(os.getenv("PURGE_INTERVAL_SECONDS", "300"))
+STORAGE_HIGH_WATER_RATIO = float(os.getenv("STORAGE_HIGH_WATER_RATIO", "0.9"))
+SCRUB_BANDWIDTH_MB_S = float(os.getenv("SCRUB_BANDWIDTH_MB_S", "5"))
+SCRUB_INTERVAL_SECONDS = float(os.getenv("SCRUB_INTERVAL_SECONDS", "3600"))
+DEFAULT_FILE_TTL_DAYS = float(os.getenv("DEFAULT_FILE_TTL_DAYS", "0"))  # 0 = files never expire
+STORAGE_BUDGET_MB = int(os.getenv("STORAGE_BUDGET_MB", "0"))  # 0 = no budget
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "60"))
+EVENT_LOG_RETENTION_DAYS = int(os.getenv("EVENT_LOG_RETENTION_DAYS", "30"))
+ANALYTICS_FLUSH_SECONDS = float(os.getenv("ANALYTICS_FLUSH_SECONDS", "2"))
+ETAG_REFRESH_MS = int(os.getenv("ETAG_REFRESH_MS", "1000"))  # how late other workers' writes can show in ETags
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() == "true"
+STALL_DETECTOR_ENABLED = os.getenv("STALL_DETECTOR_ENABLED", "false").lower() == "true"
+STALL_THRESHOLD_MS = float(os.getenv("STALL_THRESHOLD_MS", "100"))
+HEALTH_CACHE_SECONDS = float(os.getenv("HEALTH_CACHE_SECONDS", "5"))
+FILES_CACHE_SECONDS = float(os.getenv("FILES_CACHE_SECONDS", "0"))  # 0 = single-flight only
+STATS_CACHE_SECONDS = float(os.getenv("STATS_CACHE_SECONDS", "0"))
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_ROUTES = os.getenv("PROFILE_ROUTES", "").split(",")
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+HOT_CACHE_MB = int(os.getenv("HOT_CACHE_MB", "0"))  # 0 = downloads always read from disk
+HOT_CACHE_MAX_FILE_KB = int(os.getenv("HOT_CACHE_MAX_FILE_KB", "256"))
+HOT_CACHE_ADMIT_AFTER = int(os.getenv("HOT_CACHE_ADMIT_AFTER", "2"))
+COLD_STORAGE_URL = os.getenv("COLD_STORAGE_URL")  # s3://bucket/prefix or a directory; unset = no tiering
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # for MinIO or another S3-compatible server
+COLD_AFTER_DAYS = float(os.getenv("COLD_AFTER_DAYS", "30"))
+TIERING_INTERVAL_SECONDS = float(os.getenv("TIERING_INTERVAL_SECONDS", "3600"))
+TRAFFIC_CAPTURE_FILE = os.getenv("TRAFFIC_CAPTURE_FILE")  # unset = no capture; replay with benchmarks.replay_traffic
+TRAFFIC_CAPTURE_MAX_MB = int(os.getenv("TRAFFIC_CAPTURE_MAX_MB", "100"))
+DOWNLOAD_URL_SECRET = os.getenv("DOWNLOAD_URL_SECRET")  # unset = no signed download URLs
+DOWNLOAD_URL_TTL_SECONDS = int(os.getenv("DOWNLOAD_URL_TTL_SECONDS", "300"))
+DOWNLOAD_ACCESS_LOG = os.getenv("DOWNLOAD_ACCESS_LOG", "true").lower() == "true"
+DOWNLOAD_ACCESS_LOG_INTERVAL_SECONDS = float(os.getenv("DOWNLOAD_ACCESS_LOG_INTERVAL_SECONDS", "5"))
+INSERT_BATCH_WINDOW_MS = float(os.getenv("INSERT_BATCH_WINDOW_MS", "5"))  # 0 = only inserts from the same tick share a batch
+INSERT_BATCH_MAX = int(os.getenv("INSERT_BATCH_MAX", "500"))
+INSERT_WRITE_CONCERN = os.getenv("INSERT_WRITE_CONCERN")  # e.g. majority, 1, 0; unset = connection default
+INSERT_JOURNAL = os.getenv("INSERT_JOURNAL")  # true/false; unset = server default
+ORPHAN_GRACE_SECONDS = float(os.getenv("ORPHAN_GRACE_SECONDS", "3600"))  # younger files are never treated as orphans
+UPLOAD_PROGRESS_INTERVAL_MS = float(os.getenv("UPLOAD_PROGRESS_INTERVAL_MS", "250"))  # per upload, between progress events
+QUERY_CAPTURE_ENABLED = os.getenv("QUERY_CAPTURE_ENABLED", "true").lower() == "true"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+EXPLAIN_INTERVAL_SECONDS = float(os.getenv("EXPLAIN_INTERVAL_SECONDS", "600"))  # per query shape
+QUERY_SHAPES_MAX = int(os.getenv("QUERY_SHAPES_MAX", "1000"))
+PHASH_ENABLED = os.getenv("PHASH_ENABLED", "true").lower() == "true"  # also needs numpy and Pillow
+PHASH_BATCH_SIZE = int(os.getenv("PHASH_BATCH_SIZE", "50"))
+PHASH_INTERVAL_SECONDS = float(os.getenv("PHASH_INTERVAL_SECONDS", "60"))
+
+# Files in the trash keep their document and blob until the purger removes them
+LIVE_FILES = {"trashed": False}
+# Internal bookkeeping that listings and events leave out; archive indexes can run to thousands of entries
+LISTING_PROJECTION = {"archive_index": 0, "storage_tier": 0, "tiered_at": 0}
+# Lookups by id keep the tier for downloads; the archive index is fetched only by the archive endpoints
+LOOKUP_PROJECTION = {"archive_index": 0}
+
+# Built in the background after startup; cleanup_old_files and filename lookups query on filename
+FILES_INDEX_MIGRATION = [
+    {"keys": [("filename", 1)], "name": "filename"}
+]
+
+# Create uploads directory
+UPLOAD_DIR.mkdir(exist_ok=True)
+
+print(f"💾 Upload directory: {UPLOAD_DIR.absolute()}")
+
+# Uploads always land on local disk; files idle for COLD_AFTER_DAYS move to cold storage
+hot_storage = LocalStorage(UPLOAD_DIR)
+cold_storage = open_backend(COLD_STORAGE_URL, S3_ENDPOINT_URL) if COLD_STORAGE_URL else None
+if cold_storage:
+    print(f"🧊 Cold storage: {COLD_STORAGE_URL}")
+
+storage_capacity = StorageCapacity(UPLOAD_DIR, STORAGE_HIGH_WATER_RATIO)
+
+# Every command is tallied by query shape; slow shapes get an explain sampled in the background
+query_recorder = QueryShapeRecorder(SLOW_QUERY_MS, EXPLAIN_INTERVAL_SECONDS, QUERY_SHAPES_MAX) if QUERY_CAPTURE_ENABLED else None
+
+@app.middleware("http")
+async def upload_preflight(request: Request, call_next):
+    """Reject uploads that would overrun the disk before their body is received"""
+    if request.method != "POST" or request.url.path != "/api/upload":
+        return await call_next(request)
+    
+    # Without a trustworthy length nothing can be reserved, so the upload is refused outright
+    content_length = request.headers.get("content-length")
+    if content_length is None:
+        return JSONResponse(status_code=411, content={"detail": "Content-Length is required for uploads"})
+    if not content_length.strip().isdigit():
+        return JSONResponse(status_code=400, content={"detail": "Invalid Content-Length header"})
+    
+    declared = int(content_length)
+    if declared > MAX_FILE_SIZE + 1024 * 1024:
+        return JSONResponse(status_code=413, content={"detail": f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB"})
+    
+    if not storage_capacity.try_reserve(declared):
+        return JSONResponse(status_code=507, content={"detail": "Not enough storage space for this upload"})
+    
+    try:
+        return await call_next(request)
+    finally:
+        storage_capacity.release(declared)
+
+async def publish_upload_progress(event: Dict):
+    await manager.publish("upload_progress", {
+        "type": "upload_progress",
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "upload": event
+    })
+
+# Counts body bytes as they arrive, before the multipart parser sees them
+upload_tracker = UploadTracker(publish_upload_progress, UPLOAD_PROGRESS_INTERVAL_MS / 1000)
+app.add_middleware(UploadProgressMiddleware, tracker=upload_tracker, paths=["/api/upload"])
+
+# Request metadata only (route, sizes, status, timing) - the input for benchmarks.replay_traffic
+traffic_log = None
+if TRAFFIC_CAPTURE_FILE:
+    traffic_log = TrafficLog(Path(TRAFFIC_CAPTURE_FILE), TRAFFIC_CAPTURE_MAX_MB * 1024 * 1024)
+    app.add_middleware(TrafficCaptureMiddleware, log=traffic_log)
+    print(f"🎥 Capturing request metadata to {TRAFFIC_CAPTURE_FILE}")
+
+# When profiling is off the middleware is not installed at all
+profile_store = None
+if PROFILING_ENABLED:
+    profile_store = ProfileStore(PROFILE_DIR, PROFILE_MAX_FILES)
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=profile_store,
+        sample_rate=PROFILE_SAMPLE_RATE,
+        routes=PROFILE_ROUTES,
+        admin_token=ADMIN_TOKEN
+    )
+    print(f"🔬 Request profiling enabled (sample rate {PROFILE_SAMPLE_RATE}, routes {[r for r in PROFILE_ROUTES if r]})")
+
+# CORS middleware - added after the others so it wraps them and their early responses
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -54,45 +225,69 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configuration
-UPLOAD_DIR = Path("uploads")
-MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
+# WebSocket connections
+# Upload progress is high-volume and reveals what others are uploading - only sent to clients that ask
+manager = ConnectionManager(opt_in_topics={"upload_progress"})
 
-# Create uploads directory
-UPLOAD_DIR.mkdir(exist_ok=True)
+# Identical concurrent reads share one query; read_cache is dropped on every mutation
+read_cache = ReadCache()
+probe_cache = ReadCache()
 
-print(f"💾 Upload directory: {UPLOAD_DIR.absolute()}")
+# Small popular downloads are served from memory once they have proven popular
+hot_cache = HotFileCache(
+    HOT_CACHE_MB * 1024 * 1024,
+    max_file_bytes=HOT_CACHE_MAX_FILE_KB * 1024,
+    admit_after=HOT_CACHE_ADMIT_AFTER
+) if HOT_CACHE_MB > 0 else None
 
-# WebSocket connections
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+def on_collection_change(version: int):
+    read_cache.invalidate()
+
+def collection_etag() -> str:
+    # Shared by every worker and answered from memory; other workers' writes show up within ETAG_REFRESH_MS
+    return f'W/"{change_tracker.committed_count()}"'
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+# Listings carry signed URLs only when a secret is configured; they are fixed for one signing window
+url_signer = UrlSigner(DOWNLOAD_URL_SECRET, DOWNLOAD_URL_TTL_SECONDS) if DOWNLOAD_URL_SECRET else None
+access_recorder = None
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+def with_download_url(doc: Dict) -> Optional[Dict]:
+    return {"download_url": url_signer.sign(doc)} if url_signer else None
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except:
-                self.disconnect(connection)
+def listing_etag() -> str:
+    # Signed URLs change with the window, so a client holding expired ones must not get a 304
+    return f'W/"{change_tracker.committed_count()}-{url_signer.current_window()}"' if url_signer else collection_etag()
 
-manager = ConnectionManager()
+def not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    # Weak comparison: W/"5" and "5" match
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
 
 # Database variables - initialize as None
 client = None
 db = None
 files_collection = None
+folder_tree = None
+insert_batcher = None
+change_tracker = None
+analytics = None
+trash_purger = None
+integrity_scrubber = None
+retention_manager = None
+tiering_manager = None
+explain_sampler = None
+index_builder = None
+similarity_index = None
+perceptual_hasher = None
+stall_detector = None
 database_connected = False
 
 def initialize_database():
     """Initialize MongoDB connection"""
-    global client, db, files_collection, database_connected
+    global client, db, files_collection, change_tracker, analytics, folder_tree, insert_batcher, database_connected
     
     if not MONGODB_URI:
         print("🚫 Skipping MongoDB initialization - MONGODB_URI not set")
@@ -104,7 +299,8 @@ def initialize_database():
             MONGODB_URI, 
             serverSelectionTimeoutMS=10000,
             connectTimeoutMS=10000,
-            socketTimeoutMS=10000
+            socketTimeoutMS=10000,
+            event_listeners=[query_recorder] if query_recorder else None
         )
         
         # Test connection
@@ -117,6 +313,39 @@ def initialize_database():
         files_collection.create_index("starred", background=True)
         files_collection.create_index("file_type", background=True)
         
+        # Soft delete: backfill the flag once so live listings match the partial index exactly
+        files_collection.update_many({"trashed": {"$exists": False}}, {"$set": {"trashed": False}})
+        files_collection.create_index(
+            [("upload_date", -1)],
+            name="live_upload_date",
+            partialFilterExpression=LIVE_FILES,
+            background=True
+        )
+        files_collection.create_index(
+            "deleted_at",
+            name="trash_deleted_at",
+            partialFilterExpression={"trashed": True},
+            background=True
+        )
+        
+        change_tracker = ChangeTracker(db, TOMBSTONE_RETENTION_DAYS, on_change=on_collection_change)
+        change_tracker.ensure_indexes(files_collection)
+        change_tracker.prune_tombstones()
+        
+        analytics = AnalyticsRecorder(db, EVENT_LOG_RETENTION_DAYS, ANALYTICS_FLUSH_SECONDS)
+        analytics.ensure_indexes()
+        
+        folder_tree = FolderTree(db)
+        folder_tree.ensure_indexes(files_collection)
+        
+        # Upload bursts commit their metadata together instead of one acknowledged write each
+        insert_batcher = InsertBatcher(
+            files_collection,
+            window_ms=INSERT_BATCH_WINDOW_MS,
+            max_batch_size=INSERT_BATCH_MAX,
+            write_concern=parse_write_concern(INSERT_WRITE_CONCERN, INSERT_JOURNAL)
+        )
+        
         print("✅ MongoDB Atlas connected successfully!")
         database_connected = True
         return True
@@ -126,9 +355,24 @@ def initialize_database():
         database_connected = False
         return False
 
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Admin endpoints are closed unless ADMIN_TOKEN is set and sent in X-Admin-Token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
 def get_file_extension(filename: str) -> str:
     return Path(filename).suffix.lower()
 
+def get_upload_size(file: UploadFile) -> int:
+    if file.size is not None:
+        return file.size
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(0)
+    return size
+
 def generate_unique_filename(original_name: str) -> str:
     extension = get_file_extension(original_name)
     unique_id = uuid.uuid4().hex
@@ -152,35 +396,131 @@ def get_file_type(mime_type: str, filename: str) -> str:
     else:
         return 'other'
 
+def attachment_headers(filename: str) -> Dict[str, str]:
+    return {"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"}
+
+def parse_folder_id(folder_id: Optional[str]) -> Optional[ObjectId]:
+    """None, "" and "root" all mean the top level"""
+    if not folder_id or folder_id == "root":
+        return None
+    if not ObjectId.is_valid(folder_id):
+        raise HTTPException(status_code=404, detail="Folder not found")
+    return ObjectId(folder_id)
+
+def folder_error(e: FolderError) -> HTTPException:
+    if isinstance(e, FolderNotFound):
+        return HTTPException(status_code=404, detail=str(e))
+    if isinstance(e, FolderConflict):
+        return HTTPException(status_code=409, detail=str(e))
+    return HTTPException(status_code=400, detail=str(e))
+
+def is_cold(file_data: Dict) -> bool:
+    return file_data.get("storage_tier") == COLD and tiering_manager is not None
+
+def read_blob(file_data: Dict) -> bytes:
+    """Blocking - call through asyncio.to_thread"""
+    if is_cold(file_data):
+        return b"".join(tiering_manager.open_stream(file_data["filename"]))
+    return Path(file_data["file_path"]).read_bytes()
+
+def open_if_exists(path: Path):
+    """Blocking - an open handle keeps reading even if a demotion unlinks the path afterwards"""
+    try:
+        return open(path, "rb")
+    except FileNotFoundError:
+        return None
+
+def iter_open_file(f):
+    with f:
+        while chunk := f.read(STREAM_CHUNK_SIZE):
+            yield chunk
+
+def load_files_by_ids(file_ids: List[str]) -> Dict[str, Dict]:
+    docs = files_collection.find({"_id": {"$in": [ObjectId(file_id) for file_id in file_ids]}, **LIVE_FILES}, LOOKUP_PROJECTION)
+    return {str(doc["_id"]): doc for doc in docs}
+
+def load_filenames(filenames: List[str]) -> Dict[str, bool]:
+    docs = files_collection.find({"filename": {"$in": filenames}}, {"filename": 1, "_id": 0})
+    return {doc["filename"]: True for doc in docs}
+
+# Concurrent lookups in the same tick share one $in query
+file_loader = BatchLoader(load_files_by_ids)
+filename_loader = BatchLoader(load_filenames)
+
+# Blobs written to disk whose document has not been inserted yet
+uploads_in_progress = set()
+
+def is_orphan_candidate(file_path: Path) -> bool:
+    # .part files are promotions from cold storage still in flight; fresh files may belong to an upload
+    # whose document is still waiting for its insert batch, here or in another worker
+    if not file_path.is_file() or file_path.suffix == ".part" or file_path.name in uploads_in_progress:
+        return False
+    return time.time() - file_path.stat().st_mtime > ORPHAN_GRACE_SECONDS
+
 async def cleanup_old_files():
     try:
-        if UPLOAD_DIR.exists():
-            for file_path in UPLOAD_DIR.iterdir():
-                if file_path.is_file():
-                    filename = file_path.name
-                    if files_collection and not files_collection.find_one({"filename": filename}):
-                        file_path.unlink()
-                        print(f"🧹 Cleaned up orphaned file: {filename}")
+        if UPLOAD_DIR.exists() and files_collection is not None:
+            file_paths = [file_path for file_path in UPLOAD_DIR.iterdir() if is_orphan_candidate(file_path)]
+            known = await filename_loader.load_many([file_path.name for file_path in file_paths])
+            for file_path, is_known in zip(file_paths, known):
+                if not is_known and file_path.name not in uploads_in_progress:
+                    file_path.unlink()
+                    print(f"🧹 Cleaned up orphaned file: {file_path.name}")
     except Exception as e:
         print(f"❌ File cleanup failed: {e}")
 
-async def notify_file_update(update_type: str, file_data: Dict = None):
+def resolve_expiry(expires_in: Optional[int]) -> Optional[datetime]:
+    if expires_in is not None:
+        return datetime.utcnow() + timedelta(seconds=expires_in) if expires_in > 0 else None
+    if DEFAULT_FILE_TTL_DAYS > 0:
+        return datetime.utcnow() + timedelta(days=DEFAULT_FILE_TTL_DAYS)
+    return None
+
+async def announce_removed_files(docs: List[Dict], reason: str):
+    """Stamp versions and tombstones for files removed by retention, then tell clients"""
+    for doc in docs:
+        if hot_cache:
+            hot_cache.invalidate(str(doc["_id"]))
+        if doc.get("trashed"):
+            # Its tombstone, delete event and folder/similarity bookkeeping were done when it was trashed
+            continue
+        with change_tracker.change() as version:
+            change_tracker.record_deletion(str(doc["_id"]), version)
+        folder_tree.record_files(doc.get("folder_id"), -1, -doc.get("size", 0))
+        if similarity_index:
+            similarity_index.remove(str(doc["_id"]))
+        analytics.record("delete", str(doc["_id"]), doc.get("file_type"), doc.get("size", 0))
+        await notify_file_update("file_deleted", {
+            "id": str(doc["_id"]),
+            "original_name": doc.get("original_name"),
+            "file_type": doc.get("file_type"),
+            "starred": doc.get("starred", False),
+            "reason": reason
+        }, version)
+
+async def notify_file_update(update_type: str, file_data: Dict = None, version: int = None):
     message = {
         "type": update_type,
         "timestamp": datetime.utcnow().isoformat() + "Z"
     }
     
+    # Clients compare this with the last version they saw to detect missed events
+    if version is not None:
+        message["version"] = version
+    
     if file_data:
+        file_data = {key: value for key, value in file_data.items() if key not in LISTING_PROJECTION}
         message["file"] = file_data
     
-    await manager.broadcast(json.dumps(message))
+    await manager.publish(update_type, message, file_data)
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, encoding: Optional[str] = None):
+    # ?encoding=msgpack opts into binary frames; permessage-deflate is negotiated by the server
+    await manager.connect(websocket, negotiate_encoding(encoding))
     try:
         while True:
-            await websocket.receive_text()
+            await manager.handle_message(websocket, await websocket.receive_text())
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
@@ -194,6 +534,11 @@ async def root():
         "realtime": True
     }
 
+def probe_database() -> Dict:
+    client.admin.command('ping')
+    # Metadata-based count - probes must not scan the collection
+    return {"total_files": files_collection.estimated_document_count()}
+
 @app.get("/api/health")
 async def health_check():
     if not database_connected:
@@ -206,8 +551,8 @@ async def health_check():
         }
     
     try:
-        client.admin.command('ping')
-        total_files = files_collection.count_documents({})
+        probe, _ = await probe_cache.get("health", probe_database, HEALTH_CACHE_SECONDS)
+        total_files = probe["total_files"]
         
         return {
             "status": "healthy", 
@@ -216,8 +561,10 @@ async def health_check():
             "database_type": "MongoDB Atlas",
             "total_files": total_files,
             "upload_dir": str(UPLOAD_DIR.absolute()),
+            "storage": storage_capacity.snapshot(),
             "realtime_ws": True,
-            "websocket_connections": len(manager.active_connections)
+            "websocket_connections": len(manager.active_connections),
+            "read_cache": read_cache.metrics()
         }
     except Exception as e:
         return {
@@ -228,80 +575,277 @@ async def health_check():
             "total_files": 0
         }
 
+@app.get("/api/admin/scrub", dependencies=[Depends(require_admin)])
+async def get_scrub_progress():
+    if not integrity_scrubber:
+        raise HTTPException(status_code=503, detail="Integrity scrubber not running")
+    
+    progress = integrity_scrubber.progress()
+    progress["flagged_files"] = files_collection.count_documents({"integrity_status": {"$in": ["mismatch", "missing"]}})
+    return Response(content=dumps(progress), media_type="application/json")
+
+@app.get("/api/admin/retention", dependencies=[Depends(require_admin)])
+async def get_retention_metrics():
+    if not retention_manager:
+        raise HTTPException(status_code=503, detail="Retention manager not running")
+    
+    return retention_manager.metrics()
+
+@app.get("/api/admin/hot-cache", dependencies=[Depends(require_admin)])
+async def get_hot_cache_metrics():
+    if not hot_cache:
+        raise HTTPException(status_code=503, detail="Hot file cache disabled - set HOT_CACHE_MB")
+    
+    return hot_cache.metrics()
+
+@app.get("/api/admin/tiering", dependencies=[Depends(require_admin)])
+async def get_tiering_metrics():
+    if not tiering_manager:
+        raise HTTPException(status_code=503, detail="Tiering disabled - set COLD_STORAGE_URL")
+    
+    return tiering_manager.metrics()
+
+@app.get("/api/admin/inserts", dependencies=[Depends(require_admin)])
+async def get_insert_metrics():
+    if not insert_batcher:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    
+    return insert_batcher.metrics()
+
+@app.get("/api/admin/uploads", dependencies=[Depends(require_admin)])
+async def get_upload_transfers():
+    # require_admin refuses every request unless ADMIN_TOKEN is set, so addresses never reach anonymous callers
+    return upload_tracker.snapshot(include_clients=True)
+
+@app.get("/api/admin/index-advisor", dependencies=[Depends(require_admin)])
+async def get_index_advice(limit: int = Query(50, ge=1, le=1000)):
+    if not database_connected:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    if not query_recorder:
+        raise HTTPException(status_code=503, detail="Query capture is not enabled")
+    
+    report = index_report(files_collection, query_recorder, limit)
+    report["builds"] = index_builder.builds if index_builder else {}
+    if explain_sampler:
+        report["explained"] = explain_sampler.explained_total
+        report["explain_failures"] = explain_sampler.failed_total
+    return Response(content=dumps(report), media_type="application/json")
+
+@app.post("/api/admin/index-advisor/apply", dependencies=[Depends(require_admin)])
+async def apply_index_advice(names: Optional[List[str]] = Body(None, embed=True)):
+    """Build the recommended indexes (all, or those named) without waiting for them"""
+    if not database_connected or not index_builder:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    if not query_recorder:
+        raise HTTPException(status_code=503, detail="Query capture is not enabled")
+    
+    recommendations = index_report(files_collection, query_recorder)["recommendations"]
+    if names is not None:
+        unknown = set(names) - {entry["name"] for entry in recommendations}
+        if unknown:
+            raise HTTPException(status_code=404, detail=f"No current recommendation named {', '.join(sorted(unknown))}")
+        recommendations = [entry for entry in recommendations if entry["name"] in names]
+    index_builder.build([{"keys": entry["keys"], "name": entry["name"]} for entry in recommendations])
+    return {"queued": [entry["name"] for entry in recommendations], "builds": index_builder.builds}
+
+@app.get("/api/admin/stalls", dependencies=[Depends(require_admin)])
+async def get_stall_report(last: int = Query(10, ge=1, le=100)):
+    if not stall_detector:
+        raise HTTPException(status_code=503, detail="Stall detector disabled - set STALL_DETECTOR_ENABLED=true")
+    
+    return Response(content=dumps(stall_detector.report(last)), media_type="application/json")
+
+def compute_stats() -> Dict:
+    pipeline = [
+        {"$match": LIVE_FILES},
+        {
+            "$group": {
+                "_id": None,
+                "total_files": {"$sum": 1},
+                "total_size": {"$sum": "$size"},
+                "starred_count": {"$sum": {"$cond": ["$starred", 1, 0]}},
+                "total_downloads": {"$sum": "$download_count"}
+            }
+        }
+    ]
+    
+    stats = list(files_collection.aggregate(pipeline))
+    file_type_stats = list(files_collection.aggregate([
+        {"$match": LIVE_FILES},
+        {"$group": {"_id": "$file_type", "count": {"$sum": 1}}}
+    ]))
+    
+    if stats:
+        return {
+            "total_files": stats[0]["total_files"],
+            "total_size": stats[0]["total_size"],
+            "starred_count": stats[0]["starred_count"],
+            "total_downloads": stats[0]["total_downloads"],
+            "file_types": {ft["_id"]: ft["count"] for ft in file_type_stats}
+        }
+    return {
+        "total_files": 0,
+        "total_size": 0,
+        "starred_count": 0,
+        "total_downloads": 0,
+        "file_types": {}
+    }
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    if not profile_store:
+        raise HTTPException(status_code=503, detail="Profiling disabled - set PROFILING_ENABLED=true")
+    
+    return {"profiles": await asyncio.to_thread(profile_store.list)}
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str):
+    if not profile_store:
+        raise HTTPException(status_code=503, detail="Profiling disabled - set PROFILING_ENABLED=true")
+    
+    path = profile_store.path(profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    
+    # pstats format - open with python -m pstats, snakeviz or similar
+    return FileResponse(path=path, filename=path.name, media_type="application/octet-stream")
+
 @app.get("/api/stats")
-async def get_stats():
+async def get_stats(request: Request, response: Response):
     if not database_connected:
         raise HTTPException(status_code=503, detail="Database not connected")
     
+    etag = collection_etag()
+    if not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    
     try:
-        pipeline = [
-            {
-                "$group": {
-                    "_id": None,
-                    "total_files": {"$sum": 1},
-                    "total_size": {"$sum": "$size"},
-                    "starred_count": {"$sum": {"$cond": ["$starred", 1, 0]}},
-                    "total_downloads": {"$sum": "$download_count"}
-                }
-            }
-        ]
-        
-        stats = list(files_collection.aggregate(pipeline))
-        file_type_stats = list(files_collection.aggregate([
-            {"$group": {"_id": "$file_type", "count": {"$sum": 1}}}
-        ]))
-        
-        if stats:
-            result = {
-                "total_files": stats[0]["total_files"],
-                "total_size": stats[0]["total_size"],
-                "starred_count": stats[0]["starred_count"],
-                "total_downloads": stats[0]["total_downloads"],
-                "file_types": {ft["_id"]: ft["count"] for ft in file_type_stats}
-            }
-        else:
-            result = {
-                "total_files": 0,
-                "total_size": 0,
-                "starred_count": 0,
-                "total_downloads": 0,
-                "file_types": {}
-            }
+        # Keyed by ETag: another worker's write changes it without touching this process's cache
+        result, computed = await read_cache.get(("stats", etag), compute_stats, STATS_CACHE_SECONDS)
         
-        await manager.broadcast(json.dumps({
-            "type": "stats_updated",
-            "stats": result,
-            "timestamp": datetime.utcnow().isoformat() + "Z"
-        }))
+        # Only the request that actually ran the query pushes it to clients
+        if computed:
+            await manager.publish("stats_updated", {
+                "type": "stats_updated",
+                "stats": result,
+                "timestamp": datetime.utcnow().isoformat() + "Z"
+            })
         
         return result
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching stats: {str(e)}")
 
+def analytics_range(start: Optional[datetime], end: Optional[datetime], default_span: timedelta):
+    end = end or datetime.utcnow()
+    return start or end - default_span, end
+
+@app.get("/api/analytics")
+async def get_analytics(
+    metric: str = Query("uploads"),
+    granularity: str = Query("hour"),
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    group_by: Optional[str] = Query(None)
+):
+    if not database_connected:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    if metric not in METRICS:
+        raise HTTPException(status_code=400, detail=f"Unknown metric. Use one of: {', '.join(METRICS)}")
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown granularity. Use one of: {', '.join(GRANULARITIES)}")
+    if group_by not in (None, "file_type"):
+        raise HTTPException(status_code=400, detail="group_by must be file_type")
+    
+    try:
+        start, end = analytics_range(start, end, timedelta(days=1))
+        series = analytics.series(metric, granularity, start, end, group_by)
+        return Response(content=dumps({
+            "metric": metric,
+            "granularity": granularity,
+            "start": start,
+            "end": end,
+            "group_by": group_by,
+            "series": series
+        }), media_type="application/json")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching analytics: {str(e)}")
+
+@app.get("/api/analytics/top")
+async def get_top_files(
+    metric: str = Query("downloads"),
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    limit: int = Query(10, ge=1, le=100)
+):
+    if not database_connected:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    if metric not in METRICS:
+        raise HTTPException(status_code=400, detail=f"Unknown metric. Use one of: {', '.join(METRICS)}")
+    
+    try:
+        start, end = analytics_range(start, end, timedelta(days=7))
+        top = analytics.top_files(metric, start, end, limit)
+        names = load_files_by_ids([row["file_id"] for row in top]) if top else {}
+        for row in top:
+            row["original_name"] = names[row["file_id"]]["original_name"] if row["file_id"] in names else None
+        return Response(content=dumps({"metric": metric, "start": start, "end": end, "files": top}), media_type="application/json")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching top files: {str(e)}")
+
+def find_live_files():
+    return files_collection.find(LIVE_FILES, LISTING_PROJECTION).sort("upload_date", -1).batch_size(LISTING_BATCH_SIZE)
+
 @app.get("/api/files")
-async def get_files():
+async def get_files(request: Request, format: Optional[str] = Query(None)):
     if not database_connected:
         raise HTTPException(status_code=503, detail="Database not connected")
     
+    etag = listing_etag()
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    
     try:
-        files = list(files_collection.find({}).sort("upload_date", -1))
+        # NDJSON streams straight from the cursor; the generator runs in the threadpool
+        if wants_ndjson(request.headers.get("accept"), format):
+            encode = lambda doc: encode_file_document(doc, with_download_url(doc))
+            return StreamingResponse(iter_ndjson(find_live_files(), LISTING_BATCH_SIZE, encode), media_type=NDJSON_MEDIA_TYPE, headers=headers)
         
-        for file in files:
-            file["id"] = str(file["_id"])
-            del file["_id"]
-            
-        return files
+        body, _ = await read_cache.get(("files", etag), lambda: encode_file_list(find_live_files(), with_download_url), FILES_CACHE_SECONDS)
+        return Response(content=body, media_type="application/json", headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching files: {str(e)}")
 
+@app.get("/api/files/changes")
+async def get_file_changes(since: int = Query(0, ge=0), limit: int = Query(500, ge=1, le=5000)):
+    if not database_connected:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    
+    try:
+        changes = change_tracker.changes_since(files_collection, since, limit, LISTING_PROJECTION)
+        changes["files"] = [prepare_file_document(file) for file in changes["files"]]
+        return Response(content=dumps(changes), media_type="application/json")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching changes: {str(e)}")
+
 @app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...), background_tasks: BackgroundTasks = None):
+async def upload_file(
+    file: UploadFile = File(...),
+    expires_in: Optional[int] = Form(None),
+    folder_id: Optional[str] = Form(None),
+    background_tasks: BackgroundTasks = None
+):
     if not database_connected:
         raise HTTPException(status_code=503, detail="Database not connected")
     
-    content = await file.read()
-    file_size = len(content)
+    folder_oid = parse_folder_id(folder_id)
+    if folder_oid is not None and not folder_tree.get(folder_oid):
+        raise HTTPException(status_code=404, detail="Folder not found")
+    
+    file_size = get_upload_size(file)
     
     if file_size > MAX_FILE_SIZE:
         raise HTTPException(status_code=413, detail=f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB")
@@ -311,12 +855,19 @@ async def upload_file(file: UploadFile = File(...), background_tasks: Background
     
     unique_filename = generate_unique_filename(file.filename)
     file_path = UPLOAD_DIR / unique_filename
+    uploads_in_progress.add(unique_filename)
     
     try:
+        # Hash while copying so the checksum costs no extra pass over the data
+        hasher = hashlib.new(CHECKSUM_ALGORITHM)
         with open(file_path, "wb") as buffer:
-            buffer.write(content)
+            preallocate(buffer.fileno(), file_size)
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                hasher.update(chunk)
+                buffer.write(chunk)
         
         file_type = get_file_type(file.content_type or "application/octet-stream", file.filename)
+        upload_date = datetime.utcnow()
         
         file_data = {
             "original_name": file.filename,
@@ -325,28 +876,48 @@ async def upload_file(file: UploadFile = File(...), background_tasks: Background
             "mime_type": file.content_type or "application/octet-stream",
             "file_type": file_type,
             "size": file_size,
-            "upload_date": datetime.utcnow(),
+            CHECKSUM_ALGORITHM: hasher.hexdigest(),
+            "upload_date": upload_date,
+            "last_accessed_at": upload_date,
+            "expires_at": resolve_expiry(expires_in),
             "starred": False,
-            "download_count": 0
+            "download_count": 0,
+            "trashed": False,
+            "deleted_at": None,
+            "folder_id": folder_oid
         }
         
-        result = files_collection.insert_one(file_data)
-        file_data["id"] = str(result.inserted_id)
+        # The version is released once the batched insert lands or fails, never left in flight
+        with change_tracker.change() as version:
+            file_data["version"] = version
+            file_data["id"] = str(await insert_batcher.insert(file_data))
+        if retention_manager:
+            retention_manager.record_upload(file_size)
+        folder_tree.record_files(folder_oid, 1, file_size)
         del file_data["_id"]
         
+        analytics.record("upload", file_data["id"], file_type, file_size, upload_date)
+        if perceptual_hasher and file_type == "image":
+            perceptual_hasher.wake()
+        
         print(f"📁 Real upload: {file.filename} -> {unique_filename} ({file_size} bytes)")
         
         if background_tasks:
             background_tasks.add_task(cleanup_old_files)
         
-        await notify_file_update("file_uploaded", file_data)
+        await notify_file_update("file_uploaded", file_data, file_data["version"])
         
-        return file_data
+        return Response(content=dumps({**file_data, **(with_download_url(file_data) or {})}), media_type="application/json")
         
+    except WriteConcernError as e:
+        # The document may have landed anyway, so the blob stays; the orphan sweep removes it if it did not
+        raise HTTPException(status_code=503, detail=f"Upload was not stored durably: {str(e)}")
     except Exception as e:
         if file_path.exists():
             file_path.unlink()
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+    finally:
+        uploads_in_progress.discard(unique_filename)
 
 @app.delete("/api/files/{file_id}")
 async def delete_file(file_id: str):
@@ -354,78 +925,371 @@ async def delete_file(file_id: str):
         raise HTTPException(status_code=503, detail="Database not connected")
     
     try:
-        file_data = files_collection.find_one({"_id": ObjectId(file_id)})
+        # Moves the file to the trash; the blob and document are removed later by the purger
+        with change_tracker.change() as version:
+            file_data = files_collection.find_one_and_update(
+                {"_id": ObjectId(file_id), **LIVE_FILES},
+                {"$set": {"trashed": True, "deleted_at": datetime.utcnow(), "version": version}},
+                return_document=ReturnDocument.AFTER
+            )
+            if file_data:
+                change_tracker.record_deletion(file_id, version)
         if not file_data:
             raise HTTPException(status_code=404, detail="File not found")
         
-        file_path = Path(file_data.get("file_path", ""))
-        if file_path.exists():
-            file_path.unlink()
-        
-        result = files_collection.delete_one({"_id": ObjectId(file_id)})
-        if result.deleted_count == 0:
-            raise HTTPException(status_code=404, detail="File not found")
+        if hot_cache:
+            hot_cache.invalidate(file_id)
+        folder_tree.record_files(file_data.get("folder_id"), -1, -file_data.get("size", 0))
+        if similarity_index:
+            similarity_index.remove(file_id)
+        analytics.record("delete", file_id, file_data.get("file_type"), file_data.get("size", 0))
         
         file_data["id"] = str(file_data["_id"])
         del file_data["_id"]
         
-        await notify_file_update("file_deleted", file_data)
+        await notify_file_update("file_deleted", file_data, version)
         
-        return {"success": True, "message": "File deleted successfully"}
+        return {"success": True, "message": "File moved to trash"}
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Delete failed: {str(e)}")
 
+@app.get("/api/trash")
+async def get_trash():
+    if not database_connected:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    
+    try:
+        cursor = files_collection.find({"trashed": True}, LISTING_PROJECTION).sort("deleted_at", -1).batch_size(LISTING_BATCH_SIZE)
+        return Response(content=encode_file_list(cursor), media_type="application/json")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching trash: {str(e)}")
+
+@app.post("/api/files/{file_id}/restore")
+async def restore_file(file_id: str):
+    if not database_connected:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    
+    try:
+        # Files past retention may already be mid-purge, so only younger ones can come back
+        cutoff = datetime.utcnow() - timedelta(days=TRASH_RETENTION_DAYS)
+        with change_tracker.change() as version:
+            file_data = files_collection.find_one_and_update(
+                {"_id": ObjectId(file_id), "trashed": True, "deleted_at": {"$gte": cutoff}},
+                {"$set": {"trashed": False, "deleted_at": None, "version": version}},
+                return_document=ReturnDocument.AFTER
+            )
+        if not file_data:
+            raise HTTPException(status_code=404, detail="File not found in trash")
+        
+        # The folder may have been deleted while the file sat in the trash; it comes back to the root then
+        if file_data.get("folder_id") and not folder_tree.get(file_data["folder_id"]):
+            files_collection.update_one({"_id": file_data["_id"]}, {"$set": {"folder_id": None}})
+            file_data["folder_id"] = None
+        folder_tree.record_files(file_data.get("folder_id"), 1, file_data.get("size", 0))
+        if similarity_index and file_data.get("phash"):
+            similarity_index.add(file_id, file_data["phash"])
+        
+        file_data["id"] = str(file_data["_id"])
+        del file_data["_id"]
+        
+        await notify_file_update("file_restored", file_data, file_data["version"])
+        
+        return {"success": True, "message": "File restored successfully"}
+            
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Restore failed: {str(e)}")
+
 @app.patch("/api/files/{file_id}/star")
 async def toggle_star(file_id: str):
     if not database_connected:
         raise HTTPException(status_code=503, detail="Database not connected")
     
     try:
-        file = files_collection.find_one({"_id": ObjectId(file_id)})
+        file = files_collection.find_one({"_id": ObjectId(file_id), **LIVE_FILES})
         if not file:
             raise HTTPException(status_code=404, detail="File not found")
         
         new_star_status = not file.get("starred", False)
-        files_collection.update_one(
-            {"_id": ObjectId(file_id)},
-            {"$set": {"starred": new_star_status}}
-        )
+        with change_tracker.change() as version:
+            files_collection.update_one(
+                {"_id": ObjectId(file_id)},
+                {"$set": {"starred": new_star_status, "version": version}}
+            )
         
         updated_file = files_collection.find_one({"_id": ObjectId(file_id)})
         updated_file["id"] = str(updated_file["_id"])
         del updated_file["_id"]
         
-        await notify_file_update("file_updated", updated_file)
+        await notify_file_update("file_updated", updated_file, updated_file["version"])
         
         return {"success": True, "starred": new_star_status}
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Star toggle failed: {str(e)}")
 
+@app.patch("/api/files/{file_id}/expiry")
+async def set_expiry(file_id: str, expires_in: Optional[int] = Body(None, embed=True)):
+    if not database_connected:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    
+    try:
+        expires_at = datetime.utcnow() + timedelta(seconds=expires_in) if expires_in and expires_in > 0 else None
+        with change_tracker.change() as version:
+            updated_file = files_collection.find_one_and_update(
+                {"_id": ObjectId(file_id), **LIVE_FILES},
+                {"$set": {"expires_at": expires_at, "version": version}},
+                return_document=ReturnDocument.AFTER
+            )
+        if not updated_file:
+            raise HTTPException(status_code=404, detail="File not found")
+        
+        updated_file["id"] = str(updated_file["_id"])
+        del updated_file["_id"]
+        
+        await notify_file_update("file_updated", updated_file, updated_file["version"])
+        
+        return {"success": True, "expires_at": expires_at.isoformat() if expires_at else None}
+            
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Setting expiry failed: {str(e)}")
+
+@app.patch("/api/files/{file_id}/folder")
+async def move_file(file_id: str, folder_id: Optional[str] = Body(None, embed=True)):
+    if not database_connected:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    if not ObjectId.is_valid(file_id):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    target = parse_folder_id(folder_id)
+    if target is not None and not folder_tree.get(target):
+        raise HTTPException(status_code=404, detail="Folder not found")
+    
+    with change_tracker.change() as version:
+        previous = files_collection.find_one_and_update(
+            {"_id": ObjectId(file_id), **LIVE_FILES},
+            {"$set": {"folder_id": target, "version": version}},
+            projection=LISTING_PROJECTION
+        )
+    if not previous:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    if previous.get("folder_id") != target:
+        folder_tree.record_files(previous.get("folder_id"), -1, -previous.get("size", 0))
+        folder_tree.record_files(target, 1, previous.get("size", 0))
+    
+    updated_file = prepare_file_document(files_collection.find_one({"_id": ObjectId(file_id)}, LISTING_PROJECTION))
+    await notify_file_update("file_updated", updated_file, updated_file["version"])
+    
+    return {"success": True, "folder_id": folder_id if target else None}
+
+@app.post("/api/folders")
+async def create_folder(name: str = Body(..., embed=True), parent_id: Optional[str] = Body(None, embed=True)):
+    if not database_connected:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    
+    try:
+        folder = folder_tree.create(name, parse_folder_id(parent_id))
+    except FolderError as e:
+        raise folder_error(e)
+    return Response(content=dumps(prepare_file_document(folder)), media_type="application/json")
+
+@app.get("/api/folders/{folder_id}")
+async def list_folder(
+    folder_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    before: Optional[datetime] = Query(None, description="upload_date of the last file on the previous page"),
+    before_id: Optional[str] = Query(None, description="id of the last file on the previous page")
+):
+    """One page of a folder's files, newest first, plus its subfolders; "root" is the top level"""
+    if not database_connected:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    if before_id is not None and not ObjectId.is_valid(before_id):
+        raise HTTPException(status_code=400, detail="before_id is not a valid file id")
+    
+    folder_oid = parse_folder_id(folder_id)
+    
+    try:
+        folder = None
+        if folder_oid is not None:
+            folder = folder_tree.get(folder_oid)
+            if not folder:
+                raise HTTPException(status_code=404, detail="Folder not found")
+        
+        query = {"folder_id": folder_oid, **LIVE_FILES}
+        if before and before_id:
+            # (upload_date, _id) cursor - files sharing the boundary timestamp are neither skipped nor repeated
+            query["$or"] = [
+                {"upload_date": {"$lt": before}},
+                {"upload_date": before, "_id": {"$lt": ObjectId(before_id)}}
+            ]
+        elif before:
+            query["upload_date"] = {"$lt": before}
+        # Served by live_folder_upload_date_id: an index range scan that stops after limit + 1 documents
+        files = list(files_collection.find(query, LISTING_PROJECTION).sort([("upload_date", -1), ("_id", -1)]).limit(limit + 1))
+        has_more = len(files) > limit
+        files = files[:limit]
+        # Taken before prepare_file_document renames _id
+        next_before = files[-1]["upload_date"] if has_more else None
+        next_before_id = str(files[-1]["_id"]) if has_more else None
+        
+        return Response(content=dumps({
+            "folder": prepare_file_document(folder) if folder else None,
+            "folders": [prepare_file_document(child) for child in folder_tree.children(folder_oid)],
+            "files": [prepare_file_document(file) for file in files],
+            "next_before": next_before,
+            "next_before_id": next_before_id
+        }), media_type="application/json")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Listing folder failed: {str(e)}")
+
+@app.patch("/api/folders/{folder_id}")
+async def move_folder(folder_id: str, parent_id: Optional[str] = Body(None, embed=True)):
+    if not database_connected:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    
+    folder_oid = parse_folder_id(folder_id)
+    if folder_oid is None:
+        raise HTTPException(status_code=400, detail="The root folder cannot be moved")
+    
+    try:
+        folder = folder_tree.move(folder_oid, parse_folder_id(parent_id))
+    except FolderError as e:
+        raise folder_error(e)
+    return Response(content=dumps(prepare_file_document(folder)), media_type="application/json")
+
+@app.delete("/api/folders/{folder_id}")
+async def delete_folder(folder_id: str):
+    if not database_connected:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    
+    folder_oid = parse_folder_id(folder_id)
+    if folder_oid is None:
+        raise HTTPException(status_code=400, detail="The root folder cannot be deleted")
+    
+    try:
+        folder_tree.delete(folder_oid)
+    except FolderError as e:
+        raise folder_error(e)
+    return {"success": True, "message": "Folder deleted"}
+
+@app.get("/api/d/{token}")
+async def signed_download(token: str):
+    """Serve a signed download URL from the token alone - no database round trip"""
+    if not url_signer:
+        raise HTTPException(status_code=404, detail="Not found")
+    
+    claims = url_signer.verify(token)
+    if claims is None:
+        raise HTTPException(status_code=403, detail="Invalid download link")
+    if claims["e"] < time.time():
+        raise HTTPException(status_code=410, detail="Download link expired")
+    
+    headers = attachment_headers(claims["n"])
+    content = hot_cache.get(claims["i"]) if hot_cache else None
+    file_path = hot_storage.path(claims["k"])
+    if content is None and not file_path.exists():
+        # Moved to cold storage or gone - the regular endpoint knows which
+        return RedirectResponse(f"/api/files/{claims['i']}/download", status_code=307)
+    
+    if content is None and hot_cache and hot_cache.should_admit(claims["i"], claims["s"]):
+        content = await asyncio.to_thread(file_path.read_bytes)
+        hot_cache.put(claims["i"], content)
+    
+    if access_recorder:
+        access_recorder.record(claims)
+    
+    if content is not None:
+        return Response(content=content, media_type=claims["m"], headers=headers)
+    return FileResponse(path=file_path, media_type=claims["m"], headers=headers)
+
+async def record_signed_downloads(batch: List[Dict]):
+    """Fold a batch of signed-URL downloads into the documents and analytics"""
+    versions = [change_tracker.next_version() for _ in batch]
+    updates = [UpdateOne(
+        {"_id": ObjectId(entry["file_id"])},
+        {
+            "$inc": {"download_count": entry["count"]},
+            "$max": {"last_accessed_at": entry["last_accessed_at"]},
+            "$set": {"version": version}
+        }
+    ) for entry, version in zip(batch, versions)]
+    
+    def write():
+        files_collection.bulk_write(updates, ordered=False)
+        for entry in batch:
+            analytics.record("download", entry["file_id"], entry["file_type"], entry["size"], count=entry["count"])
+    
+    try:
+        await asyncio.to_thread(write)
+    finally:
+        for version in versions:
+            change_tracker.commit(version)
+
 @app.get("/api/files/{file_id}/download")
 async def download_file(file_id: str):
     if not database_connected:
         raise HTTPException(status_code=503, detail="Database not connected")
     
     try:
-        file_data = files_collection.find_one({"_id": ObjectId(file_id)})
+        file_data = await file_loader.load(str(ObjectId(file_id)))
         if not file_data:
             raise HTTPException(status_code=404, detail="File not found")
         
+        content = hot_cache.get(file_id) if hot_cache else None
+        cold = is_cold(file_data)
         file_path = Path(file_data.get("file_path", ""))
-        if not file_path.exists():
+        local_blob = None
+        if content is None and not cold and tiering_manager:
+            # Opened here so the tiering sweep cannot remove the blob between this check and the response
+            local_blob = await asyncio.to_thread(open_if_exists, file_path)
+            if local_blob is None:
+                # Possibly demoted since the lookup; the current document says where the bytes are now
+                file_data = files_collection.find_one({"_id": file_data["_id"], **LIVE_FILES}, LOOKUP_PROJECTION) or file_data
+                cold = is_cold(file_data)
+        if content is None and not cold and local_blob is None and not file_path.exists():
             raise HTTPException(status_code=404, detail="File not found on disk")
         
-        files_collection.update_one(
-            {"_id": ObjectId(file_id)},
-            {"$inc": {"download_count": 1}}
-        )
+        if content is None and hot_cache and hot_cache.should_admit(file_id, file_data.get("size", -1)):
+            if local_blob:
+                with local_blob:
+                    content = await asyncio.to_thread(local_blob.read)
+                local_blob = None
+            else:
+                content = await asyncio.to_thread(read_blob, file_data)
+            hot_cache.put(file_id, content)
+        
+        with change_tracker.change() as version:
+            files_collection.update_one(
+                {"_id": ObjectId(file_id)},
+                {"$inc": {"download_count": 1}, "$set": {"version": version, "last_accessed_at": datetime.utcnow()}}
+            )
+        analytics.record("download", file_id, file_data.get("file_type"), file_data.get("size", 0))
         
         await notify_file_update("file_downloaded", {
             "id": str(file_data["_id"]),
-            "original_name": file_data["original_name"]
-        })
+            "original_name": file_data["original_name"],
+            "file_type": file_data.get("file_type"),
+            "starred": file_data.get("starred", False)
+        }, version)
+        
+        if content is not None:
+            return Response(content=content, media_type=file_data["mime_type"], headers=attachment_headers(file_data["original_name"]))
+        
+        if cold:
+            # Serve this request straight from cold storage and bring the file back to local disk meanwhile
+            tiering_manager.cold_reads += 1
+            # Opened first, so the promotion leaves the cold copy in place until this stream ends
+            stream = tiering_manager.open_stream(file_data["filename"])
+            tiering_manager.schedule_promotion(file_data)
+            headers = {**attachment_headers(file_data["original_name"]), "Content-Length": str(file_data["size"])}
+            return StreamingResponse(stream, media_type=file_data["mime_type"], headers=headers)
+        
+        if local_blob:
+            headers = {**attachment_headers(file_data["original_name"]), "Content-Length": str(os.fstat(local_blob.fileno()).st_size)}
+            return StreamingResponse(iter_open_file(local_blob), media_type=file_data["mime_type"], headers=headers)
         
         return FileResponse(
             path=file_path,
@@ -436,15 +1300,221 @@ async def download_file(file_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Download failed: {str(e)}")
 
+async def load_archive(file_id: str):
+    file_data = await file_loader.load(str(ObjectId(file_id)))
+    if not file_data:
+        raise HTTPException(status_code=404, detail="File not found")
+    if file_data.get("file_type") != "archive":
+        raise HTTPException(status_code=400, detail="File is not an archive")
+    if is_cold(file_data):
+        # Member extraction needs random access, so the archive comes back to local disk first
+        try:
+            await tiering_manager.promote(file_data)
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Archive could not be restored from cold storage: {str(e)}")
+    
+    file_path = Path(file_data.get("file_path", ""))
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="File not found on disk")
+    
+    stored = files_collection.find_one({"_id": file_data["_id"]}, {"archive_index": 1})
+    index = stored.get("archive_index") if stored else None
+    if index is None:
+        try:
+            index = await asyncio.to_thread(build_index, file_path, file_data["original_name"])
+        except UnsupportedArchive as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        except (zipfile.BadZipFile, tarfile.TarError, OSError) as e:
+            raise HTTPException(status_code=422, detail=f"Archive could not be read: {str(e)}")
+        # Stored files never change, so the index is built once per file
+        files_collection.update_one({"_id": file_data["_id"]}, {"$set": {"archive_index": index}})
+    return file_data, file_path, index
+
+@app.get("/api/files/{file_id}/archive")
+async def list_archive(file_id: str):
+    if not database_connected:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    if not ObjectId.is_valid(file_id):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    try:
+        file_data, _, index = await load_archive(file_id)
+        return Response(content=dumps({"id": file_id, "original_name": file_data["original_name"], **index}), media_type="application/json")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Listing archive failed: {str(e)}")
+
+@app.get("/api/files/{file_id}/archive/{member:path}")
+async def extract_archive_member(file_id: str, member: str):
+    if not database_connected:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    if not ObjectId.is_valid(file_id):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    try:
+        file_data, file_path, index = await load_archive(file_id)
+        entry = find_entry(index, member)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Archive member not found")
+        
+        analytics.record("download", file_id, file_data.get("file_type"), entry.get("size") or 0)
+        
+        # Only this member's bytes are read and decompressed; the generator runs in the threadpool
+        headers = attachment_headers(Path(member).name)
+        if entry.get("size") is not None and index["format"] != "gzip":
+            headers["Content-Length"] = str(entry["size"])
+        media_type = mimetypes.guess_type(member)[0] or "application/octet-stream"
+        return StreamingResponse(iter_member(file_path, index, entry), media_type=media_type, headers=headers)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Archive extraction failed: {str(e)}")
+
+@app.get("/api/files/{file_id}/similar")
+async def find_similar_files(
+    file_id: str,
+    max_distance: int = Query(10, ge=0, le=32),
+    limit: int = Query(20, ge=1, le=200)
+):
+    if not database_connected:
+        raise HTTPException(status_code=503, detail="Database not connected")
+    if not similarity_index:
+        raise HTTPException(status_code=503, detail="Similarity search is not enabled")
+    if not ObjectId.is_valid(file_id):
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    phash = similarity_index.get(file_id)
+    if phash is None:
+        file_data = await file_loader.load(str(ObjectId(file_id)))
+        if not file_data:
+            raise HTTPException(status_code=404, detail="File not found")
+        if file_data.get("file_type") != "image":
+            raise HTTPException(status_code=400, detail="File is not an image")
+        if file_data.get("phash_error"):
+            raise HTTPException(status_code=422, detail=f"Image could not be hashed: {file_data['phash_error']}")
+        raise HTTPException(status_code=409, detail="Image has not been hashed yet")
+    
+    # One extra so the file itself can be dropped without shortening the page
+    matches = [(match_id, distance) for match_id, distance in similarity_index.search(phash, max_distance, limit + 1) if match_id != file_id][:limit]
+    distances = dict(matches)
+    docs = await file_loader.load_many(distances)
+    docs = [
+        {key: value for key, value in doc.items() if key not in LISTING_PROJECTION}
+        for doc in docs if doc
+    ]
+    return Response(
+        content=encode_file_list(docs, lambda doc: {"distance": distances[str(doc["_id"])], **(with_download_url(doc) or {})}),
+        media_type="application/json"
+    )
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup"""
+    global trash_purger, integrity_scrubber, retention_manager, tiering_manager, explain_sampler, index_builder, similarity_index, perceptual_hasher, access_recorder, stall_detector
+    if STALL_DETECTOR_ENABLED:
+        # Started first so stalls during startup (index builds, cleanup) are caught too
+        stall_detector = StallDetector(STALL_THRESHOLD_MS)
+        stall_detector.register_routes(app)
+        stall_detector.start()
     initialize_database()
     await cleanup_old_files()
+    if database_connected:
+        analytics.start()
+        change_tracker.start(ETAG_REFRESH_MS / 1000)
+        # Index builds can take minutes on a large collection, so startup does not wait for them
+        index_builder = IndexBuilder(files_collection)
+        index_builder.build(FILES_INDEX_MIGRATION)
+        if query_recorder:
+            explain_sampler = ExplainSampler(client, query_recorder)
+            explain_sampler.start()
+        trash_purger = TrashPurger(
+            files_collection,
+            retention_days=TRASH_RETENTION_DAYS,
+            batch_size=PURGE_BATCH_SIZE,
+            interval_seconds=PURGE_INTERVAL_SECONDS,
+            on_cycle=change_tracker.prune_tombstones,
+            cold_storage=cold_storage
+        )
+        trash_purger.start()
+        if SCRUB_BANDWIDTH_MB_S > 0:
+            integrity_scrubber = IntegrityScrubber(
+                db,
+                files_collection,
+                bandwidth_bytes_per_sec=SCRUB_BANDWIDTH_MB_S * 1024 * 1024,
+                pass_interval_seconds=SCRUB_INTERVAL_SECONDS
+            )
+            integrity_scrubber.start()
+        retention_manager = RetentionManager(
+            files_collection,
+            on_removed=announce_removed_files,
+            budget_bytes=STORAGE_BUDGET_MB * 1024 * 1024,
+            interval_seconds=RETENTION_INTERVAL_SECONDS,
+            cold_storage=cold_storage
+        )
+        retention_manager.ensure_indexes()
+        retention_manager.start()
+        if url_signer and DOWNLOAD_ACCESS_LOG:
+            access_recorder = AccessRecorder(record_signed_downloads, DOWNLOAD_ACCESS_LOG_INTERVAL_SECONDS)
+            access_recorder.start()
+        if cold_storage:
+            tiering_manager = TieringManager(
+                files_collection,
+                hot_storage,
+                cold_storage,
+                cold_after_days=COLD_AFTER_DAYS,
+                interval_seconds=TIERING_INTERVAL_SECONDS
+            )
+            tiering_manager.ensure_indexes()
+            tiering_manager.start()
+        if PHASH_ENABLED and image_similarity.available():
+            similarity_index = HashIndex()
+            await asyncio.to_thread(
+                similarity_index.rebuild,
+                files_collection.find({"phash": {"$type": "string"}, **LIVE_FILES}, {"phash": 1}).batch_size(10000)
+            )
+            print(f"🖼️ Similarity index loaded with {len(similarity_index)} image hashes")
+            perceptual_hasher = PerceptualHasher(
+                files_collection,
+                similarity_index,
+                batch_size=PHASH_BATCH_SIZE,
+                interval_seconds=PHASH_INTERVAL_SECONDS
+            )
+            perceptual_hasher.start()
+        elif PHASH_ENABLED:
+            print("⚠️ numpy and Pillow are not installed - similar image search disabled")
     print("🚀 Data Nestling Real-Time Backend started successfully!")
     print("📡 WebSocket support enabled for real-time updates")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if trash_purger:
+        await trash_purger.stop()
+    if integrity_scrubber:
+        await integrity_scrubber.stop()
+    if retention_manager:
+        await retention_manager.stop()
+    if tiering_manager:
+        await tiering_manager.stop()
+    if perceptual_hasher:
+        await perceptual_hasher.stop()
+    if explain_sampler:
+        await explain_sampler.stop()
+    if index_builder:
+        await index_builder.stop()
+    if access_recorder:
+        await access_recorder.stop()
+    if analytics:
+        # After the access recorder, whose last flush still records downloads
+        await analytics.stop()
+    if change_tracker:
+        await change_tracker.stop()
+    if stall_detector:
+        await stall_detector.stop()
+    if traffic_log:
+        traffic_log.close()
+
 if __name__ == "__main__":
     import uvicorn
     port = int(PORT)
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
+    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True, ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE)
@@ -0,0 +1,90 @@
+﻿import asyncio
+
+import pytest
+
+from app.services.batch_loader import BatchLoader
+
+class Recorder:
+    def __init__(self, fail: bool = False):
+        self.calls = []
+        self.fail = fail
+
+    def __call__(self, keys):
+        self.calls.append(list(keys))
+        if self.fail:
+            raise RuntimeError("lookup failed")
+        return {key: key.upper() for key in keys if key != "missing"}
+
+def test_same_tick_keys_are_deduplicated():
+    batch_fn = Recorder()
+    loader = BatchLoader(batch_fn)
+
+    async def run():
+        return await asyncio.gather(loader.load("a"), loader.load("b"), loader.load("a"), loader.load("missing"))
+
+    assert asyncio.run(run()) == ["A", "B", "A", None]
+    assert batch_fn.calls == [["a", "b", "missing"]]
+    assert loader.batches == 1 and loader.keys_loaded == 3
+
+def test_large_ticks_are_chunked():
+    batch_fn = Recorder()
+    loader = BatchLoader(batch_fn, max_batch_size=2)
+
+    async def run():
+        return await loader.load_many(["a", "b", "c", "d", "e"])
+
+    assert asyncio.run(run()) == ["A", "B", "C", "D", "E"]
+    assert batch_fn.calls == [["a", "b"], ["c", "d"], ["e"]]
+    assert loader.batches == 3
+
+def test_cancelled_caller_does_not_cancel_others():
+    loader = BatchLoader(Recorder())
+
+    async def run():
+        first = asyncio.ensure_future(loader.load("x"))
+        second = asyncio.ensure_future(loader.load("x"))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await asyncio.gather(first, second, return_exceptions=True)
+
+    first, second = asyncio.run(run())
+    assert isinstance(first, asyncio.CancelledError)
+    assert second == "X"
+
+def test_cancelled_load_many_leaves_other_waiters_intact():
+    loader = BatchLoader(Recorder())
+
+    async def run():
+        many = asyncio.ensure_future(loader.load_many(["x", "y"]))
+        # One step lets load_many register its keys; the batch is dispatched on the next
+        await asyncio.sleep(0)
+        single = asyncio.ensure_future(loader.load("y"))
+        many.cancel()
+        return await single
+
+    assert asyncio.run(run()) == "Y"
+
+def test_batch_errors_reach_every_caller():
+    loader = BatchLoader(Recorder(fail=True))
+
+    async def run():
+        return await asyncio.gather(loader.load("a"), loader.load("a"), loader.load("b"), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+def test_later_ticks_start_a_new_batch():
+    batch_fn = Recorder()
+    loader = BatchLoader(batch_fn)
+
+    async def run():
+        await loader.load("a")
+        return await loader.load("a")
+
+    assert asyncio.run(run()) == "A"
+    assert batch_fn.calls == [["a"], ["a"]]
+
+@pytest.mark.parametrize("keys", [[], ["only"]])
+def test_load_many_sizes(keys):
+    loader = BatchLoader(Recorder())
+    assert asyncio.run(loader.load_many(keys)) == [key.upper() for key in keys]
@@ -0,0 +1,120 @@
+﻿from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+from app.services.change_tracker import ChangeTracker
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().file_uploader
+
+@pytest.fixture
+def tracker(db):
+    tracker = ChangeTracker(db, tombstone_retention_days=7)
+    tracker.ensure_indexes(db.files)
+    return tracker
+
+def upload(tracker, files, name):
+    with tracker.change() as version:
+        return files.insert_one({"original_name": name, "trashed": False, "version": version}).inserted_id
+
+def delete(tracker, files, file_id):
+    with tracker.change() as version:
+        files.delete_one({"_id": file_id})
+        tracker.record_deletion(str(file_id), version)
+
+def test_pages_across_files_and_tombstones(db, tracker):
+    a = upload(tracker, db.files, "a")
+    b = upload(tracker, db.files, "b")
+    delete(tracker, db.files, a)
+    upload(tracker, db.files, "c")
+    delete(tracker, db.files, b)
+
+    first = tracker.changes_since(db.files, 0, limit=2)
+    # a and b were deleted, so the first two changes left are a's tombstone and c
+    assert [f["original_name"] for f in first["files"]] == ["c"]
+    assert [d["version"] for d in first["deleted"]] == [3]
+    assert first["version"] == 4 and first["has_more"]
+
+    seen_files, seen_deleted, since = [], [], 0
+    while True:
+        page = tracker.changes_since(db.files, since, limit=2)
+        seen_files += [(f["version"], f["original_name"]) for f in page["files"]]
+        seen_deleted += [(d["version"], d["id"]) for d in page["deleted"]]
+        assert page["version"] >= since
+        since = page["version"]
+        if not page["has_more"]:
+            break
+
+    assert seen_files == [(4, "c")]
+    assert seen_deleted == [(3, str(a)), (5, str(b))]
+    assert since == 5
+
+def test_empty_page_keeps_cursor(db, tracker):
+    upload(tracker, db.files, "a")
+    page = tracker.changes_since(db.files, 1)
+    assert page == {"reset": False, "version": 1, "files": [], "deleted": [], "has_more": False}
+
+def test_in_flight_version_holds_cursor_back(db, tracker):
+    upload(tracker, db.files, "a")
+    with tracker.change() as pending:
+        # A later write lands while the earlier one is still in flight
+        upload(tracker, db.files, "b")
+        page = tracker.changes_since(db.files, 0)
+        assert [f["original_name"] for f in page["files"]] == ["a"]
+        assert page["version"] == 1
+        assert tracker.stable_version() == pending - 1
+        db.files.insert_one({"original_name": "slow", "trashed": False, "version": pending})
+
+    page = tracker.changes_since(db.files, 1)
+    assert [f["original_name"] for f in page["files"]] == ["slow", "b"]
+    assert page["version"] == 3
+
+def test_failed_write_releases_its_version(db, tracker):
+    with pytest.raises(RuntimeError):
+        with tracker.change():
+            raise RuntimeError("insert failed")
+    upload(tracker, db.files, "a")
+    page = tracker.changes_since(db.files, 0)
+    assert [f["original_name"] for f in page["files"]] == ["a"]
+    assert page["version"] == 2
+
+def test_reset_below_pruned_horizon(db, tracker):
+    a = upload(tracker, db.files, "a")
+    delete(tracker, db.files, a)
+    upload(tracker, db.files, "b")
+    db.file_tombstones.update_many({}, {"$set": {"deleted_at": datetime.utcnow() - timedelta(days=8)}})
+
+    assert tracker.prune_tombstones() == 1
+    assert tracker.horizon() == 2
+
+    page = tracker.changes_since(db.files, 1)
+    assert page["reset"] and page["version"] == 3 and page["files"] == []
+    # Cursors at or past the horizon carry on normally
+    page = tracker.changes_since(db.files, 2)
+    assert not page["reset"] and [f["original_name"] for f in page["files"]] == ["b"]
+
+def test_committed_count_is_served_from_memory(db):
+    mine = ChangeTracker(db)
+    other = ChangeTracker(db)
+    assert mine.committed_count() == 0
+
+    with mine.change():
+        pass
+    assert mine.committed_count() == 1
+
+    # Another worker's commit shows up once this one refreshes
+    with other.change():
+        pass
+    assert mine.committed_count() == 1
+    mine.refresh_committed()
+    assert mine.committed_count() == 2
+
+def test_commit_notifies_and_counts(db):
+    seen = []
+    tracker = ChangeTracker(db, on_change=seen.append)
+    with tracker.change() as version:
+        assert seen == [] and tracker.committed_count() == 0
+    assert seen == [version]
+    assert tracker.committed_count() == 1
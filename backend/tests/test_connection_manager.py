@@ -0,0 +1,107 @@
+﻿import asyncio
+import json
+
+from app.services.connection_manager import ALL_TOPICS, ConnectionManager
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        if self.closed:
+            raise RuntimeError("socket closed")
+        self.sent.append(json.loads(text))
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+def connect(manager):
+    socket = FakeSocket()
+    asyncio.run(manager.connect(socket))
+    return socket
+
+def send(manager, socket, message):
+    asyncio.run(manager.handle_message(socket, json.dumps(message)))
+    return socket.sent[-1]
+
+def received(manager, socket, topic, file_data=None):
+    before = len(socket.sent)
+    asyncio.run(manager.publish(topic, {"type": topic}, file_data))
+    return len(socket.sent) > before
+
+def test_default_subscription_gets_everything_but_opt_in_topics():
+    manager = ConnectionManager(opt_in_topics={"upload_progress"})
+    socket = connect(manager)
+    assert received(manager, socket, "file_uploaded")
+    assert not received(manager, socket, "upload_progress")
+
+    send(manager, socket, {"action": "subscribe", "topics": ["upload_progress"]})
+    assert received(manager, socket, "upload_progress")
+
+def test_filter_only_update_keeps_topics_narrow():
+    manager = ConnectionManager()
+    socket = connect(manager)
+    send(manager, socket, {"action": "subscribe", "topics": ["file_uploaded"]})
+    reply = send(manager, socket, {"action": "subscribe", "filters": {"file_type": "image"}})
+
+    assert reply["topics"] == ["file_uploaded"]
+    assert reply["filters"]["file_type"] == ["image"]
+    assert not received(manager, socket, "file_deleted")
+    assert received(manager, socket, "file_uploaded", {"file_type": "image"})
+    assert not received(manager, socket, "file_uploaded", {"file_type": "video"})
+
+def test_all_topics_only_when_asked_for():
+    manager = ConnectionManager()
+    socket = connect(manager)
+    send(manager, socket, {"action": "subscribe", "topics": ["file_uploaded"]})
+    reply = send(manager, socket, {"action": "subscribe", "topics": [ALL_TOPICS]})
+    assert ALL_TOPICS in reply["topics"]
+    assert received(manager, socket, "file_deleted")
+
+def test_malformed_topics_are_rejected():
+    manager = ConnectionManager()
+    socket = connect(manager)
+    send(manager, socket, {"action": "subscribe", "topics": ["file_uploaded"]})
+
+    for message in (
+        {"action": "subscribe", "topics": "file_deleted"},
+        {"action": "subscribe", "topics": [1, 2]},
+        {"action": "unsubscribe", "topics": {"file_uploaded": True}},
+        {"action": "subscribe", "topics": ["file_deleted"], "filters": ["image"]},
+    ):
+        assert send(manager, socket, message)["type"] == "error"
+
+    assert manager.subscriptions[socket].topics == {"file_uploaded"}
+    assert set(manager.topic_index) == {ALL_TOPICS, "file_uploaded"}
+
+def test_unsubscribe_everything_then_filters_receives_nothing():
+    manager = ConnectionManager()
+    socket = connect(manager)
+    send(manager, socket, {"action": "unsubscribe"})
+    reply = send(manager, socket, {"action": "subscribe", "filters": {"starred": True}})
+    assert reply["topics"] == []
+    assert not received(manager, socket, "file_uploaded")
+
+def test_disconnect_during_publish_skips_the_rest():
+    manager = ConnectionManager()
+    sockets = [connect(manager) for _ in range(3)]
+    dropped = []
+
+    def dropping(socket):
+        async def send_text(text):
+            socket.sent.append(json.loads(text))
+            if not dropped:
+                # Whichever socket is served first disconnects one that has not been served yet
+                dropped.append(next(other for other in sockets if not other.sent))
+                manager.disconnect(dropped[0])
+        return send_text
+    for socket in sockets:
+        socket.send_text = dropping(socket)
+
+    asyncio.run(manager.publish("file_uploaded", {"type": "file_uploaded"}))
+    assert [len(socket.sent) for socket in sockets].count(1) == 2
+    assert dropped[0].sent == []
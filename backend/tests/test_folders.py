@@ -0,0 +1,94 @@
+﻿import mongomock
+import pytest
+from bson import ObjectId
+
+from app.services import folders
+from app.services.folders import FolderConflict, FolderNotFound, FolderTree
+
+@pytest.fixture
+def tree():
+    db = mongomock.MongoClient().file_uploader
+    tree = FolderTree(db)
+    tree.ensure_indexes(db.files)
+    return tree
+
+def counters(tree, folder):
+    doc = tree.get(folder["_id"])
+    return doc["file_count"], doc["size"], doc["tree_file_count"], doc["tree_size"]
+
+def test_record_files_rolls_up_to_ancestors(tree):
+    docs = tree.create("docs")
+    work = tree.create("work", docs["_id"])
+    reports = tree.create("reports", work["_id"])
+
+    tree.record_files(reports["_id"], 2, 300)
+    tree.record_files(work["_id"], 1, 50)
+    tree.record_files(reports["_id"], -1, -100)
+
+    assert counters(tree, reports) == (1, 200, 1, 200)
+    assert counters(tree, work) == (1, 50, 2, 250)
+    assert counters(tree, docs) == (0, 0, 2, 250)
+
+def test_move_rewrites_subtree_and_counters(tree):
+    docs = tree.create("docs")
+    archive = tree.create("archive")
+    work = tree.create("work", docs["_id"])
+    reports = tree.create("reports", work["_id"])
+    tree.record_files(reports["_id"], 3, 30)
+
+    moved = tree.move(work["_id"], archive["_id"])
+
+    assert moved["ancestors"] == [archive["_id"]]
+    assert moved["path"] == ["archive", "work"]
+    child = tree.get(reports["_id"])
+    assert child["ancestors"] == [archive["_id"], work["_id"]]
+    assert child["path"] == ["archive", "work", "reports"]
+    assert counters(tree, docs) == (0, 0, 0, 0)
+    assert counters(tree, archive) == (0, 0, 3, 30)
+
+    # Back to the top level
+    tree.move(work["_id"], None)
+    assert tree.get(reports["_id"])["path"] == ["work", "reports"]
+    assert counters(tree, archive) == (0, 0, 0, 0)
+
+def test_move_rejects_cycles_and_name_clashes(tree):
+    docs = tree.create("docs")
+    work = tree.create("work", docs["_id"])
+    with pytest.raises(FolderConflict):
+        tree.move(docs["_id"], work["_id"])
+    with pytest.raises(FolderConflict):
+        tree.move(docs["_id"], docs["_id"])
+
+    tree.create("work")
+    with pytest.raises(FolderConflict):
+        tree.move(work["_id"], None)
+    with pytest.raises(FolderNotFound):
+        tree.move(work["_id"], ObjectId())
+
+def test_move_respects_depth_of_deepest_branch(tree, monkeypatch):
+    monkeypatch.setattr(folders, "MAX_DEPTH", 4)
+    top = tree.create("top")
+    deep = tree.create("deep", top["_id"])
+    deeper = tree.create("deeper", deep["_id"])
+    deepest = tree.create("deepest", deeper["_id"])
+    # A shallow sibling created last has the highest ObjectId in its ancestors
+    tree.create("shallow", top["_id"])
+    other = tree.create("other")
+
+    assert tree._subtree_height(top) == 3
+    with pytest.raises(FolderConflict):
+        tree.move(top["_id"], other["_id"])
+    # Moving one level less deep fits exactly, and create() agrees on the limit
+    tree.move(deep["_id"], other["_id"])
+    assert len(tree.get(deepest["_id"])["ancestors"]) == 3
+    with pytest.raises(FolderConflict):
+        tree.create("too-deep", deepest["_id"])
+
+def test_delete_only_empty_folders(tree):
+    docs = tree.create("docs")
+    tree.record_files(docs["_id"], 1, 10)
+    with pytest.raises(FolderConflict):
+        tree.delete(docs["_id"])
+    tree.record_files(docs["_id"], -1, -10)
+    tree.delete(docs["_id"])
+    assert tree.get(docs["_id"]) is None
@@ -0,0 +1,87 @@
+﻿import random
+
+import pytest
+from bson import ObjectId
+
+from app.services import image_similarity
+from app.services.image_similarity import HashIndex
+
+pytestmark = pytest.mark.skipif(not image_similarity.available(), reason="needs numpy and Pillow")
+
+def test_remove_swaps_last_row_in():
+    index = HashIndex(capacity=2)
+    ids = [str(ObjectId()) for _ in range(5)]
+    for position, file_id in enumerate(ids):
+        index.add(file_id, f"{position:016x}")
+
+    index.remove(ids[1])
+    index.remove(ids[1])
+    assert len(index) == 4
+    assert index.get(ids[1]) is None
+    # The last row moved into the hole and is still found under its own id
+    assert index.rows[ObjectId(ids[4]).binary] == 1
+    assert [index.get(file_id) for file_id in ids] == [0, None, 2, 3, 4]
+
+    index.remove(ids[4])
+    assert [index.get(file_id) for file_id in ids] == [0, None, 2, 3, None]
+
+def test_add_replaces_existing_hash():
+    index = HashIndex()
+    file_id = str(ObjectId())
+    index.add(file_id, "00000000000000ff")
+    index.add(file_id, "0000000000000001")
+    assert len(index) == 1
+    assert index.get(file_id) == 1
+
+def test_ids_with_trailing_zero_bytes_survive():
+    index = HashIndex()
+    file_id = "0123456789abcdef00000000"
+    other = str(ObjectId())
+    index.add(file_id, "0000000000000000")
+    index.add(other, "ffffffffffffffff")
+    index.remove(file_id)
+    index.add(file_id, "0000000000000003")
+    index.remove(other)
+    assert index.get(file_id) == 3
+    assert index.search(0, max_distance=2) == [(file_id, 2)]
+
+def test_search_orders_by_distance_and_skips_removed():
+    index = HashIndex()
+    near, nearer, far, gone = (str(ObjectId()) for _ in range(4))
+    index.add(near, "0000000000000007")
+    index.add(far, "00000000000000ff")
+    index.add(nearer, "0000000000000001")
+    index.add(gone, "0000000000000000")
+    index.remove(gone)
+
+    assert index.search(0, max_distance=3) == [(nearer, 1), (near, 3)]
+    assert index.search(0, max_distance=8, limit=1) == [(nearer, 1)]
+
+def test_matches_brute_force_after_random_churn():
+    rng = random.Random(7)
+    index = HashIndex(capacity=4)
+    expected = {}
+    ids = [str(ObjectId()) for _ in range(200)]
+    for _ in range(1000):
+        file_id = rng.choice(ids)
+        if rng.random() < 0.6:
+            value = rng.getrandbits(64)
+            index.add(file_id, f"{value:016x}")
+            expected[file_id] = value
+        else:
+            index.remove(file_id)
+            expected.pop(file_id, None)
+
+    assert len(index) == len(expected)
+    assert all(index.get(file_id) == value for file_id, value in expected.items())
+    query = rng.getrandbits(64)
+    found = dict(index.search(query, max_distance=30, limit=1000))
+    assert found == {file_id: bin(value ^ query).count("1") for file_id, value in expected.items() if bin(value ^ query).count("1") <= 30}
+
+def test_rebuild_replaces_contents():
+    index = HashIndex()
+    index.add(str(ObjectId()), "0000000000000001")
+    docs = [{"_id": ObjectId(), "phash": f"{value:016x}"} for value in range(3000)]
+    index.rebuild(docs)
+    assert len(index) == 3000
+    assert index.get(str(docs[1234]["_id"])) == 1234
@@ -0,0 +1,90 @@
+﻿import asyncio
+
+import mongomock
+import pytest
+from pymongo import WriteConcern
+from pymongo.errors import BulkWriteError, WriteConcernError
+
+from app.services.insert_batcher import InsertBatcher, parse_write_concern
+
+class StubCollection:
+    """Fails insert_many with the given BulkWriteError details"""
+
+    write_concern = WriteConcern()
+
+    def __init__(self, details):
+        self.details = details
+        self.batches = []
+
+    def insert_many(self, docs, ordered=True):
+        self.batches.append(list(docs))
+        raise BulkWriteError(self.details)
+
+async def insert_all(batcher, docs):
+    return await asyncio.gather(*(batcher.insert(doc) for doc in docs), return_exceptions=True)
+
+def test_documents_in_one_window_share_a_batch():
+    collection = mongomock.MongoClient().file_uploader.files
+    batcher = InsertBatcher(collection, window_ms=5)
+    ids = asyncio.run(insert_all(batcher, [{"name": str(n)} for n in range(3)]))
+
+    assert collection.count_documents({}) == 3
+    assert [collection.find_one({"_id": file_id})["name"] for file_id in ids] == ["0", "1", "2"]
+    assert batcher.batches == 1 and batcher.errors == 0
+
+def test_max_batch_size_flushes_early():
+    collection = mongomock.MongoClient().file_uploader.files
+    batcher = InsertBatcher(collection, window_ms=1000, max_batch_size=2)
+    asyncio.run(insert_all(batcher, [{"name": str(n)} for n in range(5)]))
+    assert collection.count_documents({}) == 5
+    assert batcher.batches == 3 and batcher.largest_batch == 2
+
+def test_write_errors_fail_only_their_documents():
+    collection = StubCollection({"writeErrors": [
+        {"index": 1, "code": 11000, "errmsg": "duplicate key"},
+        {"index": 3, "code": 121, "errmsg": "validation failed"},
+    ]})
+    batcher = InsertBatcher(collection)
+    docs = [{"name": str(n)} for n in range(4)]
+    results = asyncio.run(insert_all(batcher, docs))
+
+    assert results[0] == docs[0]["_id"] and results[2] == docs[2]["_id"]
+    assert isinstance(results[1], BulkWriteError) and results[1].details["writeErrors"][0]["code"] == 11000
+    assert isinstance(results[3], BulkWriteError) and results[3].details["writeErrors"][0]["code"] == 121
+    assert batcher.errors == 2
+
+def test_write_concern_error_fails_the_whole_batch():
+    collection = StubCollection({
+        "writeErrors": [{"index": 0, "code": 11000, "errmsg": "duplicate key"}],
+        "writeConcernErrors": [{"code": 64, "errmsg": "waiting for replication timed out"}],
+    })
+    batcher = InsertBatcher(collection)
+    results = asyncio.run(insert_all(batcher, [{"name": str(n)} for n in range(3)]))
+
+    # The document's own error wins; the rest are not known to be durable
+    assert isinstance(results[0], BulkWriteError)
+    assert all(isinstance(result, WriteConcernError) for result in results[1:])
+    assert results[1].code == 64
+    assert batcher.errors == 3
+    assert batcher.write_concern_errors == 1
+    assert batcher.metrics()["write_concern_errors"] == 1
+
+def test_other_failures_fail_every_document():
+    class Down(StubCollection):
+        def insert_many(self, docs, ordered=True):
+            raise ConnectionError("no primary")
+
+    batcher = InsertBatcher(Down({}))
+    results = asyncio.run(insert_all(batcher, [{}, {}]))
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert batcher.errors == 2
+
+@pytest.mark.parametrize("w, journal, expected", [
+    (None, None, None),
+    ("majority", None, {"w": "majority"}),
+    ("1", "true", {"w": 1, "j": True}),
+    (None, "false", {"j": False}),
+])
+def test_parse_write_concern(w, journal, expected):
+    concern = parse_write_concern(w, journal)
+    assert (concern.document if concern else None) == expected
@@ -0,0 +1,58 @@
+﻿import asyncio
+import hashlib
+
+import mongomock
+import pytest
+
+from app.services.integrity_scrubber import CHECKSUM_ALGORITHM, IntegrityScrubber
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().file_uploader
+
+def add_file(db, tmp_path, name, content, **fields):
+    path = tmp_path / name
+    path.write_bytes(content)
+    doc = {"file_path": str(path), "size": len(content), "trashed": False,
+           CHECKSUM_ALGORITHM: hashlib.new(CHECKSUM_ALGORITHM, content).hexdigest(), **fields}
+    doc["_id"] = db.files.insert_one(doc).inserted_id
+    return doc
+
+def test_flags_mismatched_and_missing_blobs(db, tmp_path):
+    good = add_file(db, tmp_path, "good", b"good")
+    bad = add_file(db, tmp_path, "bad", b"bad")
+    gone = add_file(db, tmp_path, "gone", b"gone")
+    (tmp_path / "bad").write_bytes(b"rot")
+    (tmp_path / "gone").unlink()
+
+    scrubber = IntegrityScrubber(db, db.files, bandwidth_bytes_per_sec=0)
+    assert asyncio.run(scrubber.scrub_batch())
+
+    statuses = {doc["_id"]: doc["integrity_status"] for doc in db.files.find()}
+    assert statuses == {good["_id"]: "ok", bad["_id"]: "mismatch", gone["_id"]: "missing"}
+    assert scrubber.progress()["status_counts"] == {"ok": 1, "mismatch": 1, "missing": 1}
+
+def test_file_demoted_mid_scrub_is_not_flagged(db, tmp_path):
+    doc = add_file(db, tmp_path, "idle", b"idle")
+    scrubber = IntegrityScrubber(db, db.files, bandwidth_bytes_per_sec=0)
+
+    hash_file = scrubber._hash_file
+    async def demoted_while_reading(path):
+        # The tiering sweep moves the file to cold storage and unlinks the local copy
+        db.files.update_one({"_id": doc["_id"]}, {"$set": {"storage_tier": "cold"}})
+        path.unlink()
+        return await hash_file(path)
+    scrubber._hash_file = demoted_while_reading
+
+    assert asyncio.run(scrubber.scrub_batch())
+    assert "integrity_status" not in db.files.find_one({"_id": doc["_id"]})
+    assert scrubber.progress()["status_counts"] == {"skipped": 1}
+
+def test_cold_and_trashed_files_are_not_read(db, tmp_path):
+    add_file(db, tmp_path, "cold", b"cold", storage_tier="cold")
+    add_file(db, tmp_path, "trashed", b"trashed", trashed=True)
+    (tmp_path / "cold").unlink()
+
+    scrubber = IntegrityScrubber(db, db.files, bandwidth_bytes_per_sec=0)
+    assert asyncio.run(scrubber.scrub_batch())
+    assert db.files.count_documents({"integrity_status": {"$exists": True}}) == 0
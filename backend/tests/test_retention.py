@@ -0,0 +1,86 @@
+﻿import asyncio
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+from app.services.retention import RetentionManager
+
+@pytest.fixture
+def files():
+    return mongomock.MongoClient().file_uploader.files
+
+def add_file(files, tmp_path, name, size, **fields):
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    doc = {"filename": name, "file_path": str(path), "size": size, "trashed": False, "starred": False,
+           "last_accessed_at": datetime.utcnow(), **fields}
+    doc["_id"] = files.insert_one(doc).inserted_id
+    return doc
+
+def test_uploads_count_between_refreshes(files, tmp_path):
+    manager = RetentionManager(files, budget_bytes=1000)
+    add_file(files, tmp_path, "a", 300)
+    assert manager.stored_bytes() == 300
+
+    # Another worker's upload: only the shared counter hears about it
+    add_file(files, tmp_path, "b", 500)
+    RetentionManager(files, budget_bytes=1000).record_upload(500)
+    assert manager.stored_bytes() == 800
+
+    # Drift the counter cannot see is corrected by the periodic $group
+    files.delete_one({"filename": "b"})
+    assert manager.stored_bytes() == 800
+    assert manager.stored_bytes(refresh=True) == 300
+
+def test_budget_is_enforced_from_running_total(files, tmp_path):
+    manager = RetentionManager(files, budget_bytes=1000, batch_pause_seconds=0)
+    old = datetime.utcnow() - timedelta(days=1)
+    oldest = add_file(files, tmp_path, "oldest", 400, last_accessed_at=old - timedelta(hours=1))
+    add_file(files, tmp_path, "old", 400, last_accessed_at=old)
+    assert asyncio.run(manager.enforce_budget()) == 0
+
+    add_file(files, tmp_path, "new", 400)
+    manager.record_upload(400)
+    assert asyncio.run(manager.enforce_budget()) == 1
+    assert files.find_one({"_id": oldest["_id"]}) is None
+    assert not (tmp_path / "oldest").exists()
+    assert manager.stored_bytes() == 800
+    assert manager.evicted_bytes_total == 400
+
+def test_stale_high_total_is_confirmed_before_evicting(files, tmp_path):
+    manager = RetentionManager(files, budget_bytes=1000)
+    add_file(files, tmp_path, "a", 600)
+    trashed = add_file(files, tmp_path, "b", 600, trashed=True, deleted_at=datetime.utcnow())
+    assert manager.stored_bytes() == 1200
+
+    # Purged by the trash purger, which does not touch the counter
+    files.delete_one({"_id": trashed["_id"]})
+    assert asyncio.run(manager.enforce_budget()) == 0
+    assert files.count_documents({}) == 1
+    assert manager.stored_bytes() == 600
+
+def test_expiry_rechecks_and_counts_real_deletions(files, tmp_path):
+    removed = []
+
+    async def on_removed(docs, reason):
+        removed.extend((doc["filename"], reason) for doc in docs)
+
+    manager = RetentionManager(files, on_removed=on_removed, budget_bytes=10_000)
+    past = datetime.utcnow() - timedelta(minutes=1)
+    add_file(files, tmp_path, "a", 100, expires_at=past)
+    kept = add_file(files, tmp_path, "b", 100, expires_at=past)
+    assert manager.stored_bytes() == 200
+
+    delete_many = files.delete_many
+    def extend_then_delete(query, *args, **kwargs):
+        # The expiry of one file is extended between the find and the delete
+        files.update_one({"_id": kept["_id"]}, {"$set": {"expires_at": None}})
+        return delete_many(query, *args, **kwargs)
+    files.delete_many = extend_then_delete
+
+    assert asyncio.run(manager.expire()) == 1
+    assert manager.expired_total == 1
+    assert removed == [("a", "expired")]
+    assert (tmp_path / "b").exists()
+    assert manager.stored_bytes() == 100
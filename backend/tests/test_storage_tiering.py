@@ -0,0 +1,102 @@
+﻿import asyncio
+from datetime import datetime, timedelta
+
+import boto3
+import mongomock
+import pytest
+from moto import mock_aws
+
+from app.services.storage import LocalStorage, S3Storage
+from app.services.tiering import COLD, HOT, TieringManager
+
+BUCKET = "cold-files"
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        boto3.client("s3").create_bucket(Bucket=BUCKET)
+        yield S3Storage(BUCKET, "/blobs/")
+
+@pytest.fixture
+def hot(tmp_path):
+    return LocalStorage(tmp_path / "uploads")
+
+@pytest.fixture
+def files():
+    return mongomock.MongoClient().file_uploader.files
+
+def write_blob(hot, key, content):
+    hot.path(key).write_bytes(content)
+
+def test_s3_put_open_delete(s3, tmp_path):
+    source = tmp_path / "source.bin"
+    source.write_bytes(b"0123456789" * 1000)
+
+    s3.put("a.bin", source)
+    assert s3.stat("a.bin")["size"] == 10000
+    assert b"".join(s3.open_stream("a.bin")) == source.read_bytes()
+    assert s3.read_range("a.bin", 5, 10) == b"5678901234"
+
+    destination = tmp_path / "fetched.bin"
+    s3.fetch("a.bin", destination)
+    assert destination.read_bytes() == source.read_bytes()
+
+    s3.delete("a.bin")
+    assert s3.stat("a.bin") is None
+
+def test_demote_and_promote(s3, hot, files):
+    old = datetime.utcnow() - timedelta(days=60)
+    idle = files.insert_one({"filename": "idle.txt", "size": 4, "trashed": False, "upload_date": old, "last_accessed_at": old}).inserted_id
+    # Uploaded before access tracking existed - falls back to its upload date
+    legacy = files.insert_one({"filename": "legacy.txt", "size": 6, "trashed": False, "upload_date": old}).inserted_id
+    recent = files.insert_one({"filename": "recent.txt", "size": 6, "trashed": False, "upload_date": old, "last_accessed_at": datetime.utcnow()}).inserted_id
+    for key, content in (("idle.txt", b"idle"), ("legacy.txt", b"legacy"), ("recent.txt", b"recent")):
+        write_blob(hot, key, content)
+
+    manager = TieringManager(files, hot, s3, cold_after_days=30)
+    manager.ensure_indexes()
+    assert asyncio.run(manager.demote_idle()) == 2
+
+    for file_id, key in ((idle, "idle.txt"), (legacy, "legacy.txt")):
+        assert files.find_one({"_id": file_id})["storage_tier"] == COLD
+        assert hot.stat(key) is None
+        assert s3.stat(key) is not None
+    assert files.find_one({"_id": recent}).get("storage_tier") is None
+    assert hot.stat("recent.txt") is not None
+
+    asyncio.run(manager.promote(files.find_one({"_id": idle})))
+    assert files.find_one({"_id": idle})["storage_tier"] == HOT
+    assert hot.path("idle.txt").read_bytes() == b"idle"
+    assert s3.stat("idle.txt") is None
+    assert manager.promoted_total == 1
+
+def test_promotion_keeps_cold_copy_while_streaming(s3, hot, files):
+    write_blob(hot, "busy.txt", b"busy")
+    s3.put("busy.txt", hot.path("busy.txt"))
+    hot.delete("busy.txt")
+    file_id = files.insert_one({"filename": "busy.txt", "size": 4, "trashed": False, "storage_tier": COLD}).inserted_id
+
+    manager = TieringManager(files, hot, s3)
+    stream = manager.open_stream("busy.txt")
+    asyncio.run(manager.promote(files.find_one({"_id": file_id})))
+    assert hot.path("busy.txt").read_bytes() == b"busy"
+    assert s3.stat("busy.txt") is not None
+
+    assert b"".join(stream) == b"busy"
+    assert s3.stat("busy.txt") is None
+
+def test_unread_stream_releases_when_dropped(s3, hot, files):
+    write_blob(hot, "dropped.txt", b"dropped")
+    s3.put("dropped.txt", hot.path("dropped.txt"))
+    file_id = files.insert_one({"filename": "dropped.txt", "size": 7, "trashed": False, "storage_tier": COLD}).inserted_id
+
+    manager = TieringManager(files, hot, s3)
+    stream = manager.open_stream("dropped.txt")
+    asyncio.run(manager.promote(files.find_one({"_id": file_id})))
+    assert s3.stat("dropped.txt") is not None
+
+    del stream
+    assert s3.stat("dropped.txt") is None
@@ -1,11 +1,12 @@
 ﻿import { useEffect, useRef, useState, useCallback } from 'react';
 
 interface WebSocketMessage {
-  type: 'file_uploaded' | 'file_deleted' | 'file_updated' | 'stats_updated' | 'file_downloaded' | 'file_cleanup';
+  type: 'file_uploaded' | 'file_deleted' | 'file_updated' | 'stats_updated' | 'file_downloaded' | 'file_cleanup' | 'file_restored';
   file?: any;
   stats?: any;
   filename?: string;
   timestamp?: string;
+  version?: number;
 }
 
 export const useWebSocket = () => {